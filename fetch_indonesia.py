@@ -66,8 +66,9 @@ async def fetch_and_filter():
     unique_ips = list(ip_map.keys())
     print(f"Unique IPs to check: {len(unique_ips)}")
     
-    # Batch lookup
+    # Batch lookup (local GeoLite2 databases first, ip-api.com for misses)
     results = await geoip.lookup_batch(unique_ips)
+    await geoip.close()
     
     for ip, data in results.items():
         if data.get("country") == "ID":
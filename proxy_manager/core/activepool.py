@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from proxy_manager.core import health
+from proxy_manager.core.config import settings
+from proxy_manager.core.relay import proxy_url
+from proxy_manager.core.rotation import Selector, make_selector
+from proxy_manager.core.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+class PoolManager:
+    """
+    The gateway's active set of upstreams, sized from load: the peak number
+    of requests in flight since the last refresh over target_load (requests
+    per upstream), clamped to [min_size, max_size]. It grows at once and
+    shrinks only after demand stayed lower for shrink_after seconds, by
+    retiring the least healthy idle members. Gaps are topped up from
+    storage in health order.
+
+    Members leave when their score drops below min_score. One with more
+    than overload_factor x target_load requests in flight is benched: kept,
+    but not offered by the selector until it drains back to target_load,
+    and a replacement is pulled in meanwhile.
+
+    select/hold/release count requests per upstream and hand off to the
+    rotation selector, which only ever sees the members not benched.
+    Named views are further selectors of the configured strategy over a
+    subset of the members (say the ones known to work for a site); every
+    request is counted in all of them, so a least-outstanding view sees
+    the upstream's whole load.
+    """
+    def __init__(self, storage: StorageManager, selector: Selector, min_score: int):
+        cfg = settings.gateway
+        self.storage = storage
+        self.selector = selector
+        self.min_score = min_score
+        self.min_size = cfg.pool_min
+        self.max_size = max(cfg.pool_min, cfg.pool_max)
+        self.target_load = max(1, cfg.upstream_target_load)
+        self.overload_factor = cfg.overload_factor
+        self.shrink_after = cfg.pool_shrink_after
+        self.size = self.min_size  # Current target for active (not benched) members
+        self.members: List[Dict[str, Any]] = []
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        self.inflight: Dict[str, int] = {}
+        self.benched: Set[str] = set()
+        self.views: Dict[str, Selector] = {}
+        self._total = 0
+        self._peak = 0
+        self._below_since: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()  # Set when the pool wants a refresh before its next tick
+        self.stats = {"refills": 0, "refill_ms": 0.0, "added": 0, "evicted": 0, "retired": 0, "benched": 0}
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def __contains__(self, proxy: Dict[str, Any]) -> bool:
+        return proxy_url(proxy) in self._by_url
+
+    def active(self) -> int:
+        return len(self.members) - len(self.benched)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"size": len(self.members), "target": self.size, "active": self.active(),
+                "benched": len(self.benched), "inflight": self._total, **self.stats}
+
+    def set(self, pool: List[Dict[str, Any]]):
+        """Replaces the members outright; the selector only applies the difference."""
+        self.members = list(pool)
+        self._by_url = {proxy_url(p): p for p in self.members}
+        self.benched &= set(self._by_url)
+        self.selector.sync([p for p in self.members if proxy_url(p) not in self.benched])
+        for view in self.views.values():
+            view.sync([p for p in view.members() if proxy_url(p) in self._by_url and proxy_url(p) not in self.benched])
+
+    def set_view(self, name: str, pool: List[Dict[str, Any]]):
+        """Makes view `name` offer the members of `pool` that are in the pool and not benched."""
+        view = self.views.get(name)
+        if view is None:
+            view = self.views[name] = make_selector()
+        wanted = [p for p in pool if proxy_url(p) in self._by_url and proxy_url(p) not in self.benched]
+        new = [p for p in wanted if p not in view]
+        view.sync(wanted)
+        for proxy in new:
+            for _ in range(self.inflight.get(proxy_url(proxy), 0)):
+                view.hold(proxy)
+
+    # Request accounting
+
+    def select(self, key: Optional[str] = None, view: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Picks from the whole pool, or from view `view` (None if it is unknown or empty)."""
+        selector = self.selector if view is None else self.views.get(view)
+        proxy = selector.select(key) if selector is not None else None
+        if proxy is not None:
+            self._acquired(proxy, selector)
+        return proxy
+
+    def hold(self, proxy: Dict[str, Any]):
+        self._acquired(proxy)
+
+    def release(self, proxy: Dict[str, Any]):
+        self.selector.release(proxy)
+        for view in self.views.values():
+            view.release(proxy)
+        url = proxy_url(proxy)
+        count = self.inflight.get(url, 0)
+        if count <= 0:
+            return
+        self._total -= 1
+        if count == 1:
+            del self.inflight[url]
+        else:
+            self.inflight[url] = count - 1
+        if url in self.benched and count - 1 <= self.target_load:
+            self._unbench(url, count - 1)
+
+    def _acquired(self, proxy: Dict[str, Any], picked_by: Optional[Selector] = None):
+        for selector in (self.selector, *self.views.values()):
+            if selector is not picked_by:
+                selector.hold(proxy)
+        url = proxy_url(proxy)
+        count = self.inflight.get(url, 0) + 1
+        self.inflight[url] = count
+        self._total += 1
+        self._peak = max(self._peak, self._total)
+        if count > self.overload_factor * self.target_load and url in self._by_url and self.active() > 1:
+            self._bench(url)
+        if self._total > self.target_load * max(1, self.active()) and self.size < self.max_size:
+            self.wakeup.set()  # Demand outgrew the pool, grow it now rather than on the next tick
+
+    def _bench(self, url: str):
+        self.benched.add(url)
+        self._drop(self._by_url[url])
+        self.stats["benched"] += 1
+        self.wakeup.set()
+        logger.debug(f"Benched overloaded upstream {url} ({self.inflight[url]} in flight)")
+
+    def _unbench(self, url: str, inflight: int):
+        self.benched.discard(url)
+        proxy = self._by_url.get(url)
+        if proxy is None:
+            return
+        self.selector.add(proxy)
+        for _ in range(inflight):
+            self.selector.hold(proxy)  # The selector forgot them while benched
+        # Views take it back on their next set_view
+
+    def _drop(self, proxy: Dict[str, Any]):
+        self.selector.remove(proxy)
+        for view in self.views.values():
+            view.remove(proxy)
+
+    # Membership
+
+    def rescore(self, proxy: Dict[str, Any], score: int) -> bool:
+        """New health for a member: re-rank it, or evict it below min_score. Returns whether it was evicted."""
+        url = proxy_url(proxy)
+        if score >= self.min_score:
+            if url not in self.benched:
+                self.selector.update(proxy)
+                for view in self.views.values():
+                    view.update(proxy)
+            return False
+        self._drop(proxy)
+        self.benched.discard(url)
+        if self._by_url.pop(url, None) is None:
+            return False
+        self.members = [p for p in self.members if proxy_url(p) != url]
+        self.stats["evicted"] += 1
+        self.wakeup.set()
+        logger.warning(f"Evicting proxy from gateway: {url} (health {score} < {self.min_score})")
+        return True
+
+    async def refresh(self) -> List[Dict[str, Any]]:
+        """Resizes from the load seen since the last call, then retires or tops up. Returns the members added."""
+        async with self._lock:
+            now = time.monotonic()
+            demand, self._peak = self._peak, self._total
+            wanted = min(self.max_size, max(self.min_size, math.ceil(demand / self.target_load)))
+            if wanted >= self.size:
+                if wanted > self.size:
+                    logger.info(f"Gateway pool target {self.size} -> {wanted} ({demand} requests in flight)")
+                self.size, self._below_since = wanted, None
+            elif self._below_since is None:
+                self._below_since = now
+            elif now - self._below_since >= self.shrink_after:
+                logger.info(f"Gateway pool target {self.size} -> {wanted} ({demand} requests in flight)")
+                self.size, self._below_since = wanted, None
+
+            active = self.active()
+            if active > self.size:
+                self._retire(active - self.size)
+                return []
+            if active < self.size:
+                return await self._top_up(self.size - active)
+            return []
+
+    def _retire(self, count: int):
+        """Drops the least healthy idle members."""
+        idle = [p for p in self.members if proxy_url(p) not in self.inflight and proxy_url(p) not in self.benched]
+        idle.sort(key=health.score)
+        for proxy in idle[:count]:
+            url = proxy_url(proxy)
+            del self._by_url[url]
+            self._drop(proxy)
+        retired = {proxy_url(p) for p in idle[:count]}
+        self.members = [p for p in self.members if proxy_url(p) not in retired]
+        self.stats["retired"] += len(retired)
+
+    async def _top_up(self, count: int) -> List[Dict[str, Any]]:
+        """The `count` healthiest stored proxies not already members."""
+        started = time.perf_counter()
+        candidates = await self.storage.get_healthiest(limit=len(self.members) + count, min_score=self.min_score)
+        added = [p for p in candidates if proxy_url(p) not in self._by_url][:count]
+        for proxy in added:
+            self._by_url[proxy_url(proxy)] = proxy
+            self.members.append(proxy)
+            self.selector.add(proxy)
+        self.stats["refills"] += 1
+        self.stats["refill_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.stats["added"] += len(added)
+        if added:
+            logger.info(f"Added {len(added)} proxies to the gateway pool "
+                        f"({self.active()}/{self.size} active, refill {self.stats['refill_ms']}ms)")
+        return added
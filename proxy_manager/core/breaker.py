@@ -0,0 +1,191 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from proxy_manager.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# LightweightVerifier.handshake() reasons that mean the route to the proxy is
+# down rather than the proxy itself: nothing answered at all.
+ROUTE_FAILURES = ("timeout", "os_error")
+
+def subnet_key(ip: str) -> Optional[str]:
+    parts = ip.split(".")
+    return f"net:{parts[0]}.{parts[1]}.{parts[2]}" if len(parts) == 4 else None
+
+class CircuitBreaker:
+    """
+    One group of proxies that tend to fail together (a /24 or an ISP).
+    Closed: checks run and route outcomes are counted over a sliding window.
+    Open: after `min_failures` route failures making up `failure_ratio` of the
+    window, checks are paused until `retry_at`. Half-open: a few canary checks
+    decide for the whole group; one success closes it, `canaries` failures
+    reopen it with a doubled cooldown.
+    """
+    def __init__(self, key: str, scope: Dict[str, str], min_failures: int):
+        self.key = key
+        self.scope = scope  # storage.defer_checks() filter for the group
+        self.min_failures = min_failures
+        self.state = CLOSED
+        self.events: deque = deque()  # (ts, failed) inside the window
+        self.failures = 0
+        self.cooldown = settings.breaker.cooldown_s
+        self.retry_at = 0.0
+        self.probing_since = 0.0
+        self.canaries_out = 0
+        self.canary_fails = 0
+        self.deferred_until = 0  # Group rows are parked in storage up to here
+
+    def _prune(self, now: float):
+        horizon = now - settings.breaker.window_s
+        while self.events and self.events[0][0] < horizon:
+            _, failed = self.events.popleft()
+            self.failures -= failed
+
+    def blocks(self, now: float) -> bool:
+        """True while checks for the group must wait (moves open -> half-open once cooled down)."""
+        cfg = settings.breaker
+        if self.state == OPEN:
+            if now < self.retry_at:
+                return True
+            self.state = HALF_OPEN
+            self.probing_since = now
+            self.canaries_out = self.canary_fails = 0
+        if self.state == HALF_OPEN:
+            if now - self.probing_since >= cfg.canary_wait_s:
+                # Canaries that never reported back: start a fresh round
+                self.probing_since = now
+                self.canaries_out = self.canary_fails = 0
+            return self.canaries_out >= cfg.canaries
+        return False
+
+    def resume_at(self, now: float) -> int:
+        """When parked rows of the group should come due again."""
+        if self.state == OPEN:
+            return int(self.retry_at)
+        return int(self.probing_since + settings.breaker.canary_wait_s)
+
+    def record(self, failed: bool, now: float) -> Optional[str]:
+        """Counts one route outcome. Returns the new state on a transition, else None."""
+        cfg = settings.breaker
+        if self.state == HALF_OPEN:
+            self.canaries_out = max(0, self.canaries_out - 1)
+            if not failed:
+                self._close()
+                return CLOSED
+            self.canary_fails += 1
+            if self.canary_fails >= cfg.canaries:
+                self._open(now, min(cfg.max_cooldown_s, self.cooldown * 2))
+                return OPEN
+            return None
+        if self.state == OPEN:
+            return None  # Stragglers started before the trip tell us nothing new
+
+        self._prune(now)
+        self.events.append((now, int(failed)))
+        self.failures += failed
+        if self.failures >= self.min_failures and self.failures >= cfg.failure_ratio * len(self.events):
+            self._open(now, cfg.cooldown_s)
+            return OPEN
+        return None
+
+    def _open(self, now: float, cooldown: float):
+        self.state = OPEN
+        self.cooldown = cooldown
+        self.retry_at = now + cooldown
+        self.events.clear()
+        self.failures = 0
+
+    def _close(self):
+        self.state = CLOSED
+        self.cooldown = settings.breaker.cooldown_s
+        self.deferred_until = 0
+        self.events.clear()
+        self.failures = 0
+
+class BreakerBoard:
+    """Circuit breakers keyed by /24 ('net:a.b.c') and ISP ('isp:<name>')."""
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.stats = {"tripped": 0, "recovered": 0, "skipped": 0, "canaries": 0}
+
+    def _breakers(self, ip: str, isp: Optional[str], create: bool) -> List[CircuitBreaker]:
+        cfg = settings.breaker
+        found = []
+        for key, scope, min_failures in (
+            (subnet_key(ip), {"cidr": f"{ip.rsplit('.', 1)[0]}.0/24"}, cfg.min_failures),
+            (f"isp:{isp}" if isp not in (None, "", "Unknown") else None, {"isp": isp}, cfg.isp_min_failures),
+        ):
+            if key is None:
+                continue
+            breaker = self.breakers.get(key)
+            if breaker is None and create:
+                breaker = self.breakers[key] = CircuitBreaker(key, scope, min_failures)
+            if breaker is not None:
+                found.append(breaker)
+        return found
+
+    def acquire(self, ip: str, isp: Optional[str] = None, now: Optional[float] = None) -> Optional[CircuitBreaker]:
+        """
+        Asks to check a proxy. Returns the breaker holding it back, or None if
+        the check may run; in a half-open group that takes a canary slot.
+        """
+        if not settings.breaker.enabled:
+            return None
+        now = time.time() if now is None else now
+        breakers = self._breakers(ip, isp, create=False)
+        for breaker in breakers:
+            if breaker.blocks(now):
+                self.stats["skipped"] += 1
+                return breaker
+        for breaker in breakers:
+            if breaker.state == HALF_OPEN:
+                breaker.canaries_out += 1
+                self.stats["canaries"] += 1
+        return None
+
+    def blocking(self, ip: str, isp: Optional[str] = None, now: Optional[float] = None) -> Optional[CircuitBreaker]:
+        """The open breaker a proxy's group is under, without taking a canary slot."""
+        now = time.time() if now is None else now
+        for breaker in self._breakers(ip, isp, create=False):
+            if breaker.state == OPEN and now < breaker.retry_at:
+                return breaker
+        return None
+
+    def record(self, ip: str, isp: Optional[str], route_failed: bool, now: Optional[float] = None):
+        """Feeds one check outcome to the proxy's groups: route_failed when nothing answered at all."""
+        if not settings.breaker.enabled:
+            return
+        now = time.time() if now is None else now
+        # Successes count too: the failure ratio is over every outcome in the window
+        for breaker in self._breakers(ip, isp, create=True):
+            change = breaker.record(route_failed, now)
+            if change == OPEN:
+                self.stats["tripped"] += 1
+                logger.warning(f"Circuit {breaker.key} open for {int(breaker.cooldown)}s after correlated failures.")
+            elif change == CLOSED:
+                self.stats["recovered"] += 1
+                logger.info(f"Circuit {breaker.key} closed, canary check passed.")
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Drops closed breakers with nothing left in their window."""
+        now = time.time() if now is None else now
+        idle = []
+        for key, breaker in self.breakers.items():
+            if breaker.state == CLOSED:
+                breaker._prune(now)
+                if not breaker.events:
+                    idle.append(key)
+        for key in idle:
+            del self.breakers[key]
+        return len(idle)
+
+    def summary(self) -> Dict[str, Any]:
+        groups = {b.key: b.state for b in self.breakers.values() if b.state != CLOSED}
+        return dict(self.stats, open=groups)
@@ -1,11 +1,23 @@
 import yaml
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 import os
 
 class DatabaseConfig(BaseModel):
     type: str
     path: str
+    readers: int = 2  # Reader connections next to the single writer
+    synchronous: str = "NORMAL"  # Safe with WAL, one fsync per checkpoint instead of per commit
+    cache_size_kb: int = 65536
+    mmap_size_mb: int = 256
+    busy_timeout_ms: int = 5000
+    write_behind: bool = True  # Queue proxy writes and flush them in batches
+    flush_rows: int = 500
+    flush_interval_ms: int = 200
+    # check_history retention: raw rows, hourly and daily rollups
+    history_raw_hours: int = 48
+    history_hourly_days: int = 30
+    history_daily_days: int = 365
 
 class ScanningConfig(BaseModel):
     masscan_bin: str
@@ -17,15 +29,147 @@ class VerificationConfig(BaseModel):
     timeout: int
     judges: List[str]
     max_concurrent: int
+    timing_sink: str = "none"  # "none", "jsonl" or "histogram"
+    timing_path: str = "data/validator_timings.jsonl"
 
 class RotationConfig(BaseModel):
-    strategy: str
+    strategy: str  # random, round_robin, weighted, least_outstanding or sticky
+    sticky_replicas: int = 64  # Virtual nodes per proxy on the sticky hash ring
+    sticky_sessions: int = 10000  # Session -> proxy placements remembered (LRU)
+
+class GatewayConfig(BaseModel):
+    host: str = "127.0.0.1"
+    port: int = 8888
+    connect_timeout: float = 10.0  # Upstream TCP + proxy handshake
+    header_timeout: float = 10.0  # Client must send its request head within this
+    max_header_bytes: int = 65536
+    buffer_size: int = 65536  # Read size when splicing tunnel bytes
+    socks_port: int = 1080  # SOCKS5/SOCKS4a listener, 0 disables it
+    remote_dns: bool = True  # Let the upstream resolve names SOCKS clients send
+    client_idle_timeout: float = 60.0  # Keep-alive clients between requests
+    response_timeout: float = 60.0  # Upstream response head after the request was sent
+    # Keep-alive connections to upstreams for plain HTTP
+    pool_max_per_upstream: int = 8
+    pool_idle_timeout: float = 30.0
+    # Spare CONNECT tunnels for the most requested destinations (0 disables)
+    warm_destinations: int = 5
+    warm_per_destination: int = 2
+    warm_max_age: float = 20.0
+    warm_interval: float = 5.0
+    # Failover to other upstreams: connect errors always, errors after sending
+    # only for idempotent requests with an empty or buffered body
+    retry_attempts: int = 3  # Upstreams tried per request, 1 disables failover
+    retry_budget: float = 20.0  # No new attempt starts later than this after the first
+    retry_body_bytes: int = 65536  # Larger request bodies are streamed and never replayed
+    hedge_after: float = 0.0  # Race a second upstream after this many seconds, 0 disables
+    # Health from real traffic, written in batches; only idle upstreams are pinged
+    passive_flush_interval: float = 5.0
+    probe_idle_after: float = 60.0  # Seconds without traffic before an upstream is pinged again
+    probe_interval: float = 15.0  # Per upstream, spread by +/- probe_jitter of it
+    probe_jitter: float = 0.2
+    probe_concurrency: int = 20  # Pings in flight at once
+    probe_timeout: float = 5.0
+    # Active pool sized from load: peak requests in flight / upstream_target_load,
+    # within [pool_min, pool_max]; shrinks only after pool_shrink_after seconds
+    pool_min: int = 10
+    pool_max: int = 200
+    upstream_target_load: int = 4  # Concurrent requests per upstream
+    overload_factor: float = 3.0  # Bench an upstream above this many times its target load
+    pool_shrink_after: float = 120.0
+    pool_refresh_interval: float = 5.0
+    site_refresh: float = 5.0  # Seconds between re-filtering the pool for a target site
+
+class SiteTarget(BaseModel):
+    name: str
+    url: str
+    expect_status: List[int] = [200, 301, 302]
+    # Body substrings that mark a block/captcha page despite a 200 status
+    block_markers: List[str] = []
+
+class SitesConfig(BaseModel):
+    targets: List[SiteTarget] = []
+    ttl: int = 3600  # Seconds a (proxy, site) verdict stays valid
+    timeout: int = 8
+    batch_size: int = 25
+    max_concurrent: int = 20
+
+class GeoIPConfig(BaseModel):
+    # Local GeoLite2 databases, resolved relative to the working directory like database.path
+    country_db: Optional[str] = "data/GeoLite2-Country.mmdb"
+    city_db: Optional[str] = "data/GeoLite2-City.mmdb"
+    asn_db: Optional[str] = "data/GeoLite2-ASN.mmdb"
+    cache_size: int = 65536
+    online_fallback: bool = True  # Ask ip-api.com for IPs the local databases miss
+    cache_ttl: int = 2592000  # Seconds an online answer stays in the geo_cache table (30 days)
+    share_prefix: bool = True  # Answer from any cached IP in the same /24
+    batch_concurrency: int = 4  # ip-api batch chunks kept in flight
+    batch_retries: int = 5
+
+class SchedulerConfig(BaseModel):
+    workers: int = 50  # Concurrent re-checks
+    page_size: int = 500  # Rows per keyset page pulled from the due index
+    # Base re-check interval in seconds per latency tier (see scripts/segment_pool.py)
+    tier_intervals: Dict[str, int] = {"fast": 900, "medium": 1800, "slow": 3600}
+    min_interval: int = 120
+    max_interval: int = 21600
+    jitter: float = 0.1  # +/- fraction applied to every interval
+    idle_poll: float = 5.0  # Max seconds to sleep when nothing is due
+    # Tiered re-checks: a protocol handshake every time, the full validation this often
+    full_check_interval: int = 21600
+    handshake_timeout: float = 3.0
+    handshake_target: Optional[str] = None  # host:port to tunnel to, defaults to the first judge on 443
+
+class HealthConfig(BaseModel):
+    prior: float = 0.5  # Success rate assumed with no (or fully decayed) evidence
+    alpha_min: float = 0.1  # Floor of the success EWMA smoothing factor
+    latency_alpha: float = 0.3
+    decay_half_life: int = 21600  # Seconds for old evidence to lose half its weight
+    confidence_k: float = 3.0  # Samples at which the estimate is trusted halfway
+    latency_ref_ms: int = 2000  # Latency that halves the speed factor
+    latency_weight: float = 0.3  # Share of the score that depends on speed
+    max_seed_samples: int = 10  # Confidence granted to lifetime counters on migration
+    evict_below: int = 25  # Cleanup threshold for the monitor
+    strict_evict_below: int = 50  # Cleanup threshold for one-shot --reverify
+    evict_min_samples: int = 3
+    gateway_min_score: int = 50  # Gateway pool admission and eviction
+    # Quarantine: failing proxies are re-checked with exponential backoff instead of deleted
+    quarantine_after: int = 3  # Consecutive failures
+    release_after: int = 2  # Consecutive successes to return to the active pool
+    quarantine_base_s: int = 600
+    quarantine_max_s: int = 86400
+    archive_after_days: int = 7  # In quarantine this long without recovering -> proxies_archive
+
+class BreakerConfig(BaseModel):
+    # Circuit breakers per /24 and per ISP: correlated route failures pause the group
+    enabled: bool = True
+    window_s: int = 120  # Sliding window of route outcomes per group
+    min_failures: int = 8  # Route failures in the window to trip a /24
+    isp_min_failures: int = 40  # ... and an ISP
+    failure_ratio: float = 0.8  # Share of the window's outcomes that must be failures
+    cooldown_s: int = 300  # First pause, doubled after every failed canary round
+    max_cooldown_s: int = 3600
+    canaries: int = 2  # Checks let through when half-open
+    canary_wait_s: int = 60
+
+class ShardingConfig(BaseModel):
+    # Sharded --monitor: worker processes split (ip, port) hash partitions via leases in the DB
+    processes: int = 1  # Worker processes started by --monitor
+    partitions: int = 64
+    heartbeat_s: int = 10
+    lease_ttl: int = 30  # A worker missing heartbeats this long is dead; its partitions move
 
 class Settings(BaseModel):
     database: DatabaseConfig
     scanning: ScanningConfig
     verification: VerificationConfig
     rotation: RotationConfig
+    gateway: GatewayConfig = GatewayConfig()
+    sites: SitesConfig = SitesConfig()
+    geoip: GeoIPConfig = GeoIPConfig()
+    scheduler: SchedulerConfig = SchedulerConfig()
+    health: HealthConfig = HealthConfig()
+    breaker: BreakerConfig = BreakerConfig()
+    sharding: ShardingConfig = ShardingConfig()
 
 def load_settings(path: str = None) -> Settings:
     if path is None:
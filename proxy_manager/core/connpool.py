@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from proxy_manager.core.config import settings
+from proxy_manager.core.relay import open_direct, open_tunnel, proxy_url
+
+logger = logging.getLogger(__name__)
+
+class PooledConnection:
+    """One upstream stream pair that can carry several HTTP requests in turn."""
+    __slots__ = ("proxy", "key", "reader", "writer", "created", "last_used", "uses")
+
+    def __init__(self, proxy: Dict[str, Any], key: tuple, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.proxy = proxy
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.created = self.last_used = time.monotonic()
+        self.uses = 0
+
+    def usable(self, now: float, idle_timeout: float) -> bool:
+        """Still open and not idle for too long."""
+        return now - self.last_used < idle_timeout and not self.reader.at_eof() and not self.writer.is_closing()
+
+class UpstreamPool:
+    """
+    Keep-alive connections for plain HTTP forwarding, per upstream proxy.
+    HTTP upstreams take absolute-form requests for any host, so their
+    connections are shared across destinations; SOCKS upstreams need a
+    tunnel per origin, so those are keyed by (proxy, host, port). Each
+    upstream holds at most max_per_upstream connections (idle plus in use);
+    idle ones expire after idle_timeout.
+    """
+    def __init__(self, connect_timeout: float, buffer_size: int = 2 ** 16):
+        cfg = settings.gateway
+        self.connect_timeout = connect_timeout
+        self.buffer_size = buffer_size
+        self.max_per_upstream = cfg.pool_max_per_upstream
+        self.idle_timeout = cfg.pool_idle_timeout
+        self._idle: Dict[tuple, Deque[PooledConnection]] = {}
+        self._slots: Dict[str, asyncio.Semaphore] = {}
+        self.stats = {"opened": 0, "reused": 0, "expired": 0, "evicted": 0}
+
+    @staticmethod
+    def key(proxy: Dict[str, Any], host: str, port: int) -> tuple:
+        url = proxy_url(proxy)
+        return (url,) if proxy["protocol"] == "http" else (url, host, port)
+
+    def idle_count(self) -> int:
+        return sum(len(conns) for conns in self._idle.values())
+
+    def _pop_idle(self, key: tuple) -> Optional[PooledConnection]:
+        conns = self._idle.get(key)
+        now = time.monotonic()
+        while conns:
+            conn = conns.pop()  # Most recently used first, the likeliest to still be open
+            if conn.usable(now, self.idle_timeout):
+                return conn
+            self.stats["expired"] += 1
+            self.discard(conn)
+        return None
+
+    def _evict_idle(self, url: str) -> bool:
+        """Closes the oldest idle connection of an upstream to free a slot for another destination."""
+        oldest = None
+        for key, conns in self._idle.items():
+            if key[0] == url and conns and (oldest is None or conns[0].last_used < oldest.last_used):
+                oldest = conns[0]
+        if oldest is None:
+            return False
+        self._idle[oldest.key].popleft()
+        self.stats["evicted"] += 1
+        self.discard(oldest)
+        return True
+
+    async def acquire(self, proxy: Dict[str, Any], host: str, port: int) -> PooledConnection:
+        """An idle connection for this upstream/destination, or a new one once a slot is free."""
+        key = self.key(proxy, host, port)
+        conn = self._pop_idle(key)
+        if conn is not None:
+            self.stats["reused"] += 1
+            conn.uses += 1
+            return conn
+
+        url = key[0]
+        slots = self._slots.setdefault(url, asyncio.Semaphore(self.max_per_upstream))
+        if slots.locked():
+            self._evict_idle(url)
+        await asyncio.wait_for(slots.acquire(), self.connect_timeout)
+        try:
+            if proxy["protocol"] == "http":
+                reader, writer = await open_direct(proxy, self.connect_timeout, self.buffer_size)
+            else:
+                reader, writer = await open_tunnel(proxy, host, port, self.connect_timeout, self.buffer_size)
+        except BaseException:
+            slots.release()
+            raise
+        self.stats["opened"] += 1
+        conn = PooledConnection(proxy, key, reader, writer)
+        conn.uses = 1
+        return conn
+
+    def release(self, conn: PooledConnection, reusable: bool):
+        """Hands a connection back after a complete response; anything else closes it."""
+        if not reusable or conn.writer.is_closing():
+            self.discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.setdefault(conn.key, deque()).append(conn)
+
+    def discard(self, conn: PooledConnection):
+        conn.writer.close()
+        slots = self._slots.get(conn.key[0])
+        if slots is not None:
+            slots.release()
+
+    def expire(self) -> int:
+        """Closes idle connections past idle_timeout or closed by the other end."""
+        now = time.monotonic()
+        expired = 0
+        for key in list(self._idle):
+            conns = self._idle[key]
+            keep = deque()
+            for conn in conns:
+                if conn.usable(now, self.idle_timeout):
+                    keep.append(conn)
+                else:
+                    self.discard(conn)
+                    expired += 1
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        self.stats["expired"] += expired
+        return expired
+
+    def close(self):
+        for conns in self._idle.values():
+            for conn in conns:
+                self.discard(conn)
+        self._idle.clear()
+
+Opener = Callable[[str, int], Awaitable[Optional[Tuple[Dict[str, Any], asyncio.StreamReader, asyncio.StreamWriter]]]]
+
+class WarmTunnels:
+    """
+    Spare, already-handshaken CONNECT tunnels for the most requested
+    destinations. Demand is counted per (host, port) and halved every
+    refill, so the set follows current traffic; tunnels older than
+    max_age are dropped before upstreams or origins time them out.
+    """
+    def __init__(self, opener: Opener):
+        cfg = settings.gateway
+        self.opener = opener
+        self.destinations = cfg.warm_destinations
+        self.per_destination = cfg.warm_per_destination
+        self.max_age = cfg.warm_max_age
+        self.demand: Dict[Tuple[str, int], float] = {}
+        self._spare: Dict[Tuple[str, int], Deque[tuple]] = {}
+        self.stats = {"hits": 0, "misses": 0, "opened": 0, "expired": 0}
+
+    def note(self, host: str, port: int):
+        self.demand[(host, port)] = self.demand.get((host, port), 0.0) + 1.0
+
+    def take(self, host: str, port: int) -> Optional[Tuple[Dict[str, Any], asyncio.StreamReader, asyncio.StreamWriter]]:
+        """A live spare tunnel to host:port as (proxy, reader, writer), if there is one."""
+        spare = self._spare.get((host, port))
+        now = time.monotonic()
+        while spare:
+            born, proxy, reader, writer = spare.popleft()
+            if now - born < self.max_age and not reader.at_eof() and not writer.is_closing():
+                self.stats["hits"] += 1
+                return proxy, reader, writer
+            self.stats["expired"] += 1
+            writer.close()
+        if self.destinations:
+            self.stats["misses"] += 1
+        return None
+
+    def _expire(self, now: float):
+        for dest in list(self._spare):
+            spare = self._spare[dest]
+            while spare and (now - spare[0][0] >= self.max_age or spare[0][2].at_eof()):
+                spare.popleft()[3].close()
+                self.stats["expired"] += 1
+            if not spare:
+                del self._spare[dest]
+
+    async def _open(self, dest: Tuple[str, int]):
+        try:
+            opened = await self.opener(*dest)
+        except Exception as e:
+            logger.debug(f"Warm tunnel to {dest[0]}:{dest[1]} failed: {e}")
+            return
+        if opened is not None:
+            self.stats["opened"] += 1
+            self._spare.setdefault(dest, deque()).append((time.monotonic(),) + tuple(opened))
+
+    async def refill(self):
+        """Tops up spares for the top destinations and lets demand decay."""
+        self._expire(time.monotonic())
+        popular = sorted(self.demand, key=self.demand.get, reverse=True)[:self.destinations]
+        wanted = [dest for dest in popular if self.demand[dest] >= 1.0
+                  for _ in range(self.per_destination - len(self._spare.get(dest, ())))]
+        await asyncio.gather(*(self._open(dest) for dest in wanted))
+        self.demand = {dest: count / 2 for dest, count in self.demand.items() if count / 2 >= 0.25}
+
+    def close(self):
+        for spare in self._spare.values():
+            for entry in spare:
+                entry[3].close()
+        self._spare.clear()
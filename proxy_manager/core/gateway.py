@@ -1,145 +1,646 @@
 import asyncio
 import logging
 import sys
-import aiohttp
-from aiohttp import web
-from proxy_manager.core.storage import StorageManager
-import aiohttp_socks
-from aiohttp_socks import ProxyConnector, ProxyType
 import random
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from proxy_manager.core.storage import StorageManager
+from proxy_manager.core.sites import SiteCompatChecker
+from proxy_manager.core import health
+from proxy_manager.core.config import settings
+from proxy_manager.core.connpool import UpstreamPool, WarmTunnels
+from proxy_manager.core.activepool import PoolManager
+from proxy_manager.core.passive import PassiveHealth
+from proxy_manager.core.rotation import make_selector
+from proxy_manager.core.relay import (
+    BadRequest, SourceError, IDEMPOTENT_METHODS, parse_head, parse_status, forward_head, split_authority, open_tunnel, splice, proxy_url,
+    header_value, proxy_auth_user, wants_keep_alive, body_framing, response_head, copy_body,
+    read_socks_request, socks_reply, socks_error_code, SOCKS5_OK, SOCKS5_FAILURE, SOCKS5_HOST_UNREACHABLE,
+)
 
 logger = logging.getLogger(__name__)
 
+class UpstreamError(Exception):
+    """An upstream failed a request after it was sent, so retrying it may repeat it."""
+    def __init__(self, message: str, timed_out: bool = False):
+        super().__init__(message)
+        self.timed_out = timed_out
+
+class ClientError(Exception):
+    """The client failed while its request body was being streamed upstream; not the upstream's fault."""
+
 class ProxyGateway:
-    def __init__(self, host: str = "127.0.0.1", port: int = 8888):
-        self.host = host
-        self.port = port
-        self.storage = StorageManager()
-        self.app = web.Application()
-        self.app.router.add_route('*', '/{tail:.*}', self.handle_request)
-        self.runner = None
-        self.site = None
-        self._proxy_pool = []
-        self._pool_lock = asyncio.Lock()
-        self._failed_attempts = {}
+    """
+    Local HTTP proxy on raw asyncio streams. CONNECT requests get a tunnel
+    through an upstream (SOCKS5, SOCKS4a or HTTP CONNECT), taken from the
+    warm spares when one is ready, and bytes are spliced both ways without
+    being parsed. Plain HTTP requests reuse pooled keep-alive connections
+    to the upstream. A second listener speaks SOCKS5/SOCKS4a and relays
+    through the same pool. Failed upstreams are failed over to others
+    within a retry budget, so clients see far fewer 502s.
+    """
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None, storage: StorageManager = None,
+                 socks_port: Optional[int] = None):
+        cfg = settings.gateway
+        self.host = host or cfg.host
+        self.port = port or cfg.port
+        self.socks_port = cfg.socks_port if socks_port is None else socks_port  # 0 disables the listener
+        self.remote_dns = cfg.remote_dns
+        self.socks_server = None
+        self.storage = storage or StorageManager()
+        self.sites = SiteCompatChecker(self.storage)
+        self.server = None
+        self.connect_timeout = cfg.connect_timeout
+        self.header_timeout = cfg.header_timeout
+        self.buffer_size = cfg.buffer_size
+        self.max_header_bytes = cfg.max_header_bytes
+        self.client_idle_timeout = cfg.client_idle_timeout
+        self.response_timeout = cfg.response_timeout
+        self.warm_interval = cfg.warm_interval
+        self.retry_attempts = max(1, cfg.retry_attempts)
+        self.retry_budget = cfg.retry_budget
+        self.retry_body_bytes = cfg.retry_body_bytes
+        self.hedge_after = cfg.hedge_after
+        self.upstreams = UpstreamPool(self.connect_timeout, self.buffer_size)
+        self.warm = WarmTunnels(self._open_warm)
+        self.stats = {"connections": 0, "active": 0, "tunnels": 0, "forwarded": 0, "socks": 0, "errors": 0,
+                      "bytes_up": 0, "bytes_down": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0,
+                      "probes": 0, "sweep_s": 0.0}
+        self.min_score = settings.health.gateway_min_score
+        self.pool = PoolManager(self.storage, make_selector(), self.min_score)
+        self.probe_interval = cfg.probe_interval
+        self.probe_jitter = cfg.probe_jitter
+        self.probe_concurrency = cfg.probe_concurrency
+        self.probe_timeout = cfg.probe_timeout
+        self.pool_refresh_interval = cfg.pool_refresh_interval
+        self.site_refresh = cfg.site_refresh
+        self._site_synced: Dict[str, float] = {}  # Site name -> monotonic time its pool view was rebuilt
+        self._probe_at: Dict[str, float] = {}  # Upstream URL -> monotonic time of its next ping
+        self.passive_flush_interval = cfg.passive_flush_interval
+        self.passive = PassiveHealth(self.storage, cfg.probe_idle_after)
 
     async def _health_monitor(self):
-        """Background task that pings active gateway proxies."""
+        """
+        Background task that keeps the pool sized and topped up and pings
+        active gateway proxies. Each upstream has its own jittered probe
+        time, due ones are pinged probe_concurrency at a time, and upstreams
+        carrying traffic are skipped (they are scored from it, see
+        _flush_passive). Evictions and load surges wake the loop early so
+        the pool is refreshed right away.
+        """
         while True:
+            # Cleared before the refresh so evictions and surges during the sweep still wake us
+            self.pool.wakeup.clear()
             try:
-                # 1. Fill pool if empty
-                async with self._pool_lock:
-                    if not self._proxy_pool:
-                        proxies = await self.storage.get_proxies(limit=10) # Top 10 Elite
-                        self._proxy_pool = [p for p in proxies if p['health_score'] > 50]
-                        logger.info(f"Loaded {len(self._proxy_pool)} proxies into active gateway pool.")
-
-                # 2. Check health of current pool
-                async with self._pool_lock:
-                    pool_copy = list(self._proxy_pool)
-                
-                for proxy in pool_copy:
-                    proxy_url = f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}"
-                    is_alive = await self._ping_proxy(proxy_url)
-                    
-                    if not is_alive:
-                        self._failed_attempts[proxy_url] = self._failed_attempts.get(proxy_url, 0) + 1
-                        if self._failed_attempts[proxy_url] >= 3:
-                            logger.warning(f"Evicting DEAD proxy from gateway: {proxy_url} (3 consecutive failures)")
-                            async with self._pool_lock:
-                                if proxy in self._proxy_pool:
-                                    self._proxy_pool.remove(proxy)
-                            # Update DB health negatively
-                            await self.storage.update_health(proxy['ip'], proxy['port'], working=False)
-                    else:
-                        self._failed_attempts[proxy_url] = 0 # reset on success
-                
+                now = time.monotonic()
+                for proxy in await self.pool.refresh():
+                    self._schedule_probe(proxy, now)
+                members = {proxy_url(p): p for p in self.pool.members}
+                self._probe_at = {url: at for url, at in self._probe_at.items() if url in members}
+                due = [p for url, p in members.items() if self._probe_at.get(url, 0) <= now]
+                for proxy in due:
+                    self._schedule_probe(proxy, now)
+                due = [p for p in due if self.passive.idle(p)]
+                if due:
+                    await self._sweep(due)
             except Exception as e:
                 logger.error(f"Gateway health monitor error: {e}")
-            
-            await asyncio.sleep(15) # Check every 15s
+
+            upcoming = min(self._probe_at.values(), default=time.monotonic() + self.probe_interval)
+            upcoming = min(upcoming, time.monotonic() + self.pool_refresh_interval)
+            try:
+                await asyncio.wait_for(self.pool.wakeup.wait(), max(0.5, upcoming - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def _schedule_probe(self, proxy: Dict, now: float):
+        """Next ping in probe_interval, spread by probe_jitter so probes don't bunch up."""
+        spread = self.probe_interval * self.probe_jitter
+        self._probe_at[proxy_url(proxy)] = now + self.probe_interval + random.uniform(-spread, spread)
+
+    async def _sweep(self, due):
+        """Pings `due` with bounded parallelism and records how long the round took."""
+        slots = asyncio.Semaphore(self.probe_concurrency)
+
+        async def probe(proxy):
+            async with slots:
+                start = time.perf_counter()
+                is_alive = await self._ping_proxy(proxy_url(proxy))
+                latency = (time.perf_counter() - start) * 1000 if is_alive else None
+            # Same health model as the lifecycle: one miss dents a proven proxy, it doesn't evict it.
+            # Scored against the stored row, which the monitor may have moved on (or quarantined) since.
+            self.stats["probes"] += 1
+            await self._rescore(proxy, await self.storage.record_outcomes(proxy, [(is_alive, latency)]))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(probe(p) for p in due))
+        self.stats["sweep_s"] = round(time.perf_counter() - started, 3)
+        logger.debug(f"Probed {len(due)} gateway proxies in {self.stats['sweep_s']}s")
+
+    async def _flush_passive(self):
+        """Folds outcomes of real requests into storage and the pool ranking."""
+        while True:
+            await asyncio.sleep(self.passive_flush_interval)
+            try:
+                for proxy, score in await self.passive.flush():
+                    await self._rescore(proxy, score)
+            except Exception as e:
+                logger.error(f"Gateway passive health error: {e}")
+
+    async def _rescore(self, proxy: Dict, score: int):
+        """New health for a pooled proxy: re-rank it, or evict it below gateway_min_score."""
+        if self.pool.rescore(proxy, score):
+            self._probe_at.pop(proxy_url(proxy), None)
 
     async def _ping_proxy(self, proxy_url):
         """Strict CONNECT ping to ensure proxy is still routing."""
         try:
              from curl_cffi.requests import AsyncSession
              proxies = {"http": proxy_url, "https": proxy_url}
-             async with AsyncSession(proxies=proxies, impersonate="chrome120", timeout=5) as session:
+             async with AsyncSession(proxies=proxies, impersonate="chrome120", timeout=self.probe_timeout) as session:
                  res = await session.get("https://www.google.com")
                  return res.status_code == 200
         except Exception:
              return False
 
-    async def get_best_proxy(self):
-        """Get a proxy from the pre-validated healthy pool."""
-        async with self._pool_lock:
-            if not self._proxy_pool:
-                return None
-            return random.choice(self._proxy_pool)
+    def set_pool(self, pool):
+        """Replaces the active pool outright (normally PoolManager sizes and fills it)."""
+        self.pool.set(pool)
+        members = {proxy_url(p) for p in self.pool.members}
+        self._probe_at = {url: at for url, at in self._probe_at.items() if url in members}
 
-    async def handle_request(self, request):
-        # This is a simple HTTP forwarder. 
-        # For full proxy support (CONNECT method for HTTPS), aiohttp web server is tricky.
-        # But let's implement a basic forwarder for HTTP requests.
-        # For CONNECT (HTTPS), we need to hijack the socket.
-        
-        proxy_data = await self.get_best_proxy()
-        if not proxy_data:
-            return web.Response(status=503, text="No proxies available")
+    def metrics(self):
+        """Gateway counters plus those of the active pool, connection pool, warm tunnels and passive health."""
+        return {**self.stats, "pool": self.pool.metrics(), "upstreams": dict(self.upstreams.stats),
+                "warm": dict(self.warm.stats), "passive": dict(self.passive.stats)}
 
-        target_url = str(request.url)
-        method = request.method
-        
-        # Construct proxy URL
-        pk_proto = proxy_data['protocol']
-        pk_ip = proxy_data['ip']
-        pk_port = proxy_data['port']
-        proxy_address = f"{pk_proto}://{pk_ip}:{pk_port}"
-        
-        logger.info(f"Forwarding {method} {target_url} via {proxy_address}")
+    async def get_best_proxy(self, host: str = None, session: Optional[str] = None):
+        """
+        Get a proxy from the pre-validated healthy pool with the configured
+        rotation strategy (`session` keys sticky placement). If `host`
+        belongs to a configured target site, prefer proxies with a fresh
+        passing verdict for that site: the pool keeps a view of those,
+        re-filtered every site_refresh seconds, that the same strategy picks
+        from. The caller hands the proxy back with self.pool.release() once
+        its request or tunnel is done.
+        """
+        site = self.sites.site_for_host(host)
+        if site:
+            now = time.monotonic()
+            synced = self._site_synced.get(site.name)
+            if synced is None or now - synced >= self.site_refresh:
+                self._site_synced[site.name] = now
+                self.pool.set_view(site.name, await self.sites.good_pool(list(self.pool.members), site))
+            proxy = self.pool.select(session, view=site.name)
+            if proxy is not None:
+                return proxy
+            # Nothing in the active pool is known-good yet, ask storage directly
+            stored = await self.storage.get_proxies_for_site(site.name, self.sites.ttl, limit=10)
+            good = [p for p in stored if p['health_score'] >= self.min_score]
+            if good:
+                proxy = self._pick(good)
+                self.pool.hold(proxy)
+                return proxy
 
+        return self.pool.select(session)
+
+    @staticmethod
+    def _pick(pool):
+        """Random choice weighted by current (time-decayed) health."""
+        weights = [max(1, health.score(p)) for p in pool]
+        return random.choices(pool, weights=weights, k=1)[0]
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        One client connection. CONNECT turns it into a spliced tunnel; plain
+        HTTP requests are forwarded one by one over pooled keep-alive
+        upstream connections for as long as the client keeps it open.
+        """
+        self.stats["connections"] += 1
+        self.stats["active"] += 1
+        peer = writer.get_extra_info("peername")
         try:
-            connector = ProxyConnector.from_url(proxy_address)
-            async with aiohttp.ClientSession(connector=connector) as session:
-                # Reconstruct headers (excluding hop-by-hop)
-                headers = {k: v for k, v in request.headers.items() if k.lower() not in ['host', 'connection', 'upgrade', 'proxy-connection']}
-                
-                # Stream body if POST
-                data = await request.read()
-                
-                async with session.request(method, target_url, headers=headers, data=data) as resp:
-                    # Stream response back
-                    response = web.StreamResponse(status=resp.status, reason=resp.reason)
-                    # Forward headers
-                    for k, v in resp.headers.items():
-                        if k.lower() not in ['content-encoding', 'content-length', 'transfer-encoding', 'connection']:
-                            response.headers[k] = v
-                    
-                    await response.prepare(request)
-                    
-                    async for chunk in resp.content.iter_chunked(1024):
-                        await response.write(chunk)
-                        
-                    await response.write_eof()
-                    return response
+            timeout = self.header_timeout
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+                    method, target, version, headers = parse_head(head)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except (asyncio.LimitOverrunError, ValueError, BadRequest) as e:
+                    await self._reply(writer, 400, "Bad Request", str(e))
+                    return
 
+                session = proxy_auth_user(headers) or (peer[0] if peer else None)
+                if method == b"CONNECT":
+                    await self._tunnel(reader, writer, target, session)
+                    return
+                if not await self._forward(reader, writer, method, target, version, headers, session):
+                    return
+                timeout = self.client_idle_timeout
         except Exception as e:
+            self.stats["errors"] += 1
             logger.error(f"Gateway error: {e}")
-            return web.Response(status=502, text=f"Bad Gateway: {e}")
+        finally:
+            self.stats["active"] -= 1
+            writer.close()
+
+    async def _tunnel(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, target: bytes,
+                      session: Optional[str] = None):
+        """
+        CONNECT: a warm spare tunnel if one is ready (unless the rotation
+        pins sessions to proxies), else a fresh one through the pool with
+        failover and hedging.
+        """
+        try:
+            host, port = split_authority(target.decode("latin-1"), 443)
+        except BadRequest as e:
+            await self._reply(writer, 400, "Bad Request", str(e))
+            return
+
+        self.warm.note(host, port)
+        warm = None if self.pool.selector.keyed else self.warm.take(host, port)
+        if warm is not None:
+            picked = warm[0], warm[1:]
+            self.pool.hold(warm[0])
+        else:
+            try:
+                picked = await self._failover(host, session, lambda proxy: self._open_upstream(proxy, host, port),
+                                              discard=lambda upstream: upstream[1].close(), hedge=True)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"No upstream reached {host}:{port}: {e}")
+                await self._reply(writer, 502, "Bad Gateway", f"Bad Gateway: {e}")
+                return
+            if picked is None:
+                await self._reply(writer, 503, "Service Unavailable", "No proxies available")
+                return
+
+        proxy_data, upstream = picked
+        try:
+            logger.debug(f"CONNECT {host}:{port} via {proxy_url(proxy_data)}{' (warm)' if warm else ''}")
+            self.stats["tunnels"] += 1
+            writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+            await self._relay(reader, writer, upstream)
+        finally:
+            self.pool.release(proxy_data)
+
+    async def _forward(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                       method: bytes, target: bytes, version: bytes, headers, session: Optional[str] = None) -> bool:
+        """
+        Forwards one plain HTTP request and its response, framing both
+        bodies so the upstream connection can go back to the pool. Returns
+        whether the client connection stays open for another request.
+
+        Connect errors fail over to another upstream for any request.
+        Errors after the request went out are retried only for idempotent
+        methods whose body is empty or small enough to have been buffered
+        (retry_body_bytes); those requests may also be hedged.
+        """
+        try:
+            host, port, _ = forward_head(method, target, version, headers, absolute=True)
+            request_body = body_framing(headers)
+        except BadRequest as e:
+            await self._reply(writer, 400, "Bad Request", str(e))
+            return False
+        client_keep = wants_keep_alive(version, headers)
+        if (header_value(headers, b"expect") or b"").lower() == b"100-continue":
+            # Answer the expectation here; the upstream then just gets the body
+            headers = [(k, v) for k, v in headers if k.lower() != b"expect"]
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        body = None
+        if request_body[0] == "length" and request_body[1] <= self.retry_body_bytes:
+            try:
+                body = await asyncio.wait_for(reader.readexactly(request_body[1]), self.header_timeout)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return False
+        replayable = method.upper() in IDEMPOTENT_METHODS and (request_body[0] == "none" or body is not None)
+
+        try:
+            picked = await self._failover(
+                host, session,
+                lambda proxy: self._send(reader, proxy, host, port, method, target, version, headers, request_body, body),
+                discard=lambda sent: self.upstreams.discard(sent[0]), hedge=replayable,
+                retryable=lambda e: not isinstance(e, ClientError) and (replayable or not isinstance(e, UpstreamError)))
+        except ClientError as e:
+            logger.debug(f"Client gave up mid-request for {host}: {e}")
+            return False
+        except Exception as e:
+            self.stats["errors"] += 1
+            timed_out = isinstance(e, UpstreamError) and e.timed_out
+            await self._reply(writer, 504 if timed_out else 502, "Gateway Timeout" if timed_out else "Bad Gateway",
+                              str(e) if timed_out else f"Bad Gateway: {e}")
+            return False
+        if picked is None:
+            await self._reply(writer, 503, "Service Unavailable", "No proxies available")
+            return False
+
+        proxy_data, (conn, interim, response, resp_version, status, resp_headers) = picked
+        try:
+            for head in interim:
+                writer.write(head)
+            framing = body_framing(resp_headers, method, status)
+            client_keep = client_keep and framing[0] != "eof"
+            writer.write(response_head(response, client_keep))
+            try:
+                received = await copy_body(conn.reader, writer, framing, self.buffer_size)
+            except BaseException:
+                self.upstreams.discard(conn)
+                raise
+            self.upstreams.release(conn, framing[0] != "eof" and wants_keep_alive(resp_version, resp_headers))
+            self.stats["forwarded"] += 1
+            self.stats["bytes_down"] += received
+            return client_keep
+        finally:
+            self.pool.release(proxy_data)
+
+    async def _send(self, reader: asyncio.StreamReader, proxy_data: Dict, host: str, port: int, method: bytes,
+                    target: bytes, version: bytes, headers, request_body, body: Optional[bytes]):
+        """
+        Sends one request over a pooled connection to `proxy_data` and reads
+        up to the final response head: (conn, interim heads, head, version,
+        status, headers). Failures once the request went out are raised as
+        UpstreamError, failures reading the client's body as ClientError;
+        connect errors propagate as they are.
+        """
+        _, _, head = forward_head(method, target, version, headers,
+                                  absolute=proxy_data["protocol"] == "http", keep_alive=True)
+        for attempt in range(2):
+            conn = await self.upstreams.acquire(proxy_data, host, port)
+            try:
+                conn.writer.write(head)
+                if body is not None:
+                    conn.writer.write(body)
+                    self.stats["bytes_up"] += len(body)
+                else:
+                    try:
+                        self.stats["bytes_up"] += await copy_body(reader, conn.writer, request_body, self.buffer_size)
+                    except SourceError as e:
+                        raise ClientError(f"request body: {e}") from e
+                interim = []
+                response = await asyncio.wait_for(conn.reader.readuntil(b"\r\n\r\n"), self.response_timeout)
+                resp_version, status, resp_headers = parse_status(response)
+                while 100 <= status < 200:
+                    # Interim responses go through ahead of the final one
+                    interim.append(response)
+                    response = await asyncio.wait_for(conn.reader.readuntil(b"\r\n\r\n"), self.response_timeout)
+                    resp_version, status, resp_headers = parse_status(response)
+                return conn, interim, response, resp_version, status, resp_headers
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                self.upstreams.discard(conn)
+                if conn.uses > 1 and (request_body[0] == "none" or body is not None) and attempt == 0:
+                    continue  # The pooled connection was closed while idle; nothing was lost, try a fresh one
+                raise UpstreamError(f"upstream closed ({e})")
+            except asyncio.TimeoutError:
+                self.upstreams.discard(conn)
+                raise UpstreamError("Upstream timed out", timed_out=True)
+            except (asyncio.LimitOverrunError, BadRequest) as e:
+                self.upstreams.discard(conn)
+                raise UpstreamError(str(e))
+            except BaseException:
+                self.upstreams.discard(conn)
+                raise
+
+    async def _next_proxy(self, host: str, session: Optional[str], tried: set):
+        """A proxy not in `tried` (and adds it), or None. Retries drop the session so sticky picks can move."""
+        for _ in range(3):
+            proxy_data = await self.get_best_proxy(host, None if tried else session)
+            if proxy_data is None:
+                return None
+            url = proxy_url(proxy_data)
+            if url not in tried:
+                tried.add(url)
+                return proxy_data
+            self.pool.release(proxy_data)
+        return None
+
+    async def _failover(self, host: str, session: Optional[str], attempt: Callable[[Dict], Awaitable],
+                        discard: Callable[[Any], None], hedge: bool = False,
+                        retryable: Callable[[BaseException], bool] = lambda e: True):
+        """
+        Runs `attempt(proxy)` on up to retry_attempts different upstreams,
+        starting new ones only within retry_budget seconds. A failure the
+        `retryable` rule allows moves on to the next upstream; with `hedge`
+        and hedge_after set, a second upstream is raced once the first has
+        not answered in time, and the loser is handed to `discard`.
+
+        Returns (proxy, result) with the proxy still held in the pool,
+        None if no upstream was available at all, or raises the last error.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.retry_budget
+        pending: Dict[asyncio.Task, Dict] = {}
+        started: Dict[asyncio.Task, float] = {}
+        hedges = set()
+        tried = set()
+        error = None
+
+        def start(proxy_data):
+            task = asyncio.ensure_future(attempt(proxy_data))
+            started[task] = loop.time()
+            pending[task] = proxy_data
+            return task
+
+        try:
+            while True:
+                can_start = len(tried) < self.retry_attempts and loop.time() < deadline
+                if not pending:
+                    proxy_data = await self._next_proxy(host, session, tried) if can_start else None
+                    if proxy_data is None:
+                        if error is not None:
+                            raise error
+                        return None
+                    if error is not None:
+                        self.stats["failovers"] += 1
+                    start(proxy_data)
+                    continue
+
+                hedging = hedge and self.hedge_after > 0 and len(pending) == 1 and can_start
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if hedging else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    proxy_data = await self._next_proxy(host, None, tried)
+                    if proxy_data is None:
+                        hedge = False  # Nobody to race against, keep waiting
+                    else:
+                        self.stats["hedges"] += 1
+                        hedges.add(start(proxy_data))
+                    continue
+
+                winner = None
+                for task in done:
+                    proxy_data = pending.pop(task)
+                    self._observe(task, proxy_data, started[task])
+                    if task.exception() is None and winner is None:
+                        winner = proxy_data, task.result()
+                        if task in hedges:
+                            self.stats["hedge_wins"] += 1
+                        continue
+                    self.pool.release(proxy_data)
+                    if task.exception() is None:
+                        discard(task.result())
+                        continue
+                    error = task.exception()
+                    logger.debug(f"Upstream {proxy_url(proxy_data)} failed for {host}: {error}")
+                    if not retryable(error):
+                        raise error
+                if winner is not None:
+                    return winner
+        finally:
+            for task, proxy_data in pending.items():
+                task.cancel()
+                task.add_done_callback(lambda t, p=proxy_data, t0=started[task]: self._drop(t, p, t0, discard))
+
+    def _drop(self, task: asyncio.Task, proxy_data: Dict, started: float, discard: Callable[[Any], None]):
+        """Done callback for a cancelled attempt that may still have finished first."""
+        self.pool.release(proxy_data)
+        if not task.cancelled():
+            self._observe(task, proxy_data, started)
+            if task.exception() is None:
+                discard(task.result())
+
+    def _observe(self, task: asyncio.Task, proxy_data: Dict, started: float):
+        """Passive health sample from a finished attempt: latency up to the tunnel or response head."""
+        if task.exception() is None:
+            self.passive.record(proxy_data, True, (asyncio.get_running_loop().time() - started) * 1000)
+        elif not isinstance(task.exception(), ClientError):
+            self.passive.record(proxy_data, False)
+
+    async def handle_socks_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One SOCKS5/SOCKS4a client: CONNECT through a pooled upstream, then splice."""
+        self.stats["connections"] += 1
+        self.stats["active"] += 1
+        try:
+            try:
+                version, host, port = await asyncio.wait_for(read_socks_request(reader, writer), self.header_timeout)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                    ConnectionError, ValueError, BadRequest) as e:
+                logger.debug(f"SOCKS handshake rejected: {e}")
+                return
+
+            if not self.remote_dns:
+                try:
+                    host = await self._resolve(host, port)
+                except OSError as e:
+                    logger.debug(f"SOCKS: cannot resolve {host}: {e}")
+                    writer.write(socks_reply(version, SOCKS5_HOST_UNREACHABLE))
+                    return
+
+            peer = writer.get_extra_info("peername")
+            try:
+                picked = await self._failover(host, peer[0] if peer else None,
+                                              lambda proxy: self._open_upstream(proxy, host, port),
+                                              discard=lambda upstream: upstream[1].close(), hedge=True)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning(f"No upstream reached {host}:{port}: {e}")
+                writer.write(socks_reply(version, socks_error_code(e)))
+                return
+            if picked is None:
+                writer.write(socks_reply(version, SOCKS5_FAILURE))
+                return
+
+            proxy_data, upstream = picked
+            try:
+                logger.debug(f"SOCKS{version} {host}:{port} via {proxy_url(proxy_data)}")
+                self.stats["socks"] += 1
+                writer.write(socks_reply(version, SOCKS5_OK))
+                await self._relay(reader, writer, upstream)
+            finally:
+                self.pool.release(proxy_data)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"SOCKS gateway error: {e}")
+        finally:
+            self.stats["active"] -= 1
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    @staticmethod
+    async def _resolve(host: str, port: int) -> str:
+        """Local DNS for SOCKS clients when remote_dns is off; the upstream then only sees an address."""
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        return infos[0][4][0]
+
+    async def _relay(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, upstream):
+        up, down = await splice((reader, writer), upstream, self.buffer_size)
+        self.stats["bytes_up"] += up
+        self.stats["bytes_down"] += down
+
+    async def _open_upstream(self, proxy_data: Dict, host: str, port: int):
+        """Fresh tunnel to host:port through `proxy_data` (CONNECT and SOCKS clients)."""
+        return await open_tunnel(proxy_data, host, port, self.connect_timeout, self.buffer_size)
+
+    async def _open_warm(self, host: str, port: int):
+        """WarmTunnels opener: a tunnel through the proxy the next client would get."""
+        proxy_data = await self.get_best_proxy(host)
+        if not proxy_data:
+            return None
+        started = time.perf_counter()
+        try:
+            upstream = await self._open_upstream(proxy_data, host, port)
+            self.passive.record(proxy_data, True, (time.perf_counter() - started) * 1000)
+            return (proxy_data,) + tuple(upstream)
+        except Exception:
+            self.passive.record(proxy_data, False)
+            raise
+        finally:
+            self.pool.release(proxy_data)  # Counted again by _tunnel if a client takes it
+
+    async def _maintain_connections(self):
+        """Expires idle upstream connections and keeps spare tunnels topped up."""
+        while True:
+            await asyncio.sleep(self.warm_interval)
+            try:
+                self.upstreams.expire()
+                await self.warm.refill()
+            except Exception as e:
+                logger.error(f"Gateway connection upkeep error: {e}")
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, status: int, reason: str, text: str):
+        body = text.encode("utf-8", "replace")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
 
     async def start(self):
         logger.info(f"Starting Local Proxy Gateway on {self.host}:{self.port}")
-        self.runner = web.AppRunner(self.app)
-        await self.runner.setup()
-        self.site = web.TCPSite(self.runner, self.host, self.port)
-        await self.site.start()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 limit=self.max_header_bytes)
+        if self.socks_port:
+            logger.info(f"Starting SOCKS5/SOCKS4a listener on {self.host}:{self.socks_port}")
+            self.socks_server = await asyncio.start_server(self.handle_socks_client, self.host, self.socks_port)
+            await self.socks_server.start_serving()
         
-        # Start health monitor background task
-        asyncio.create_task(self._health_monitor())
+        # Start health monitor, passive health and connection upkeep background tasks
+        monitor = asyncio.create_task(self._health_monitor())
+        passive = asyncio.create_task(self._flush_passive())
+        upkeep = asyncio.create_task(self._maintain_connections())
         
         # Keep running
-        while True:
-            await asyncio.sleep(3600)
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            monitor.cancel()
+            passive.cancel()
+            upkeep.cancel()
+            await self.sites.close()
+            await self.passive.flush()
+            self.upstreams.close()
+            self.warm.close()
+            if self.socks_server is not None:
+                self.socks_server.close()
+            await self.storage.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -1,81 +1,402 @@
 import aiohttp
+import asyncio
 import logging
-from typing import Dict, Any, Optional
+import os
+import time
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+from proxy_manager.core.config import settings
+from proxy_manager.core.storage import StorageManager
+
+try:
+    import maxminddb
+except ImportError:  # Offline lookups are optional, ip-api remains available
+    maxminddb = None
 
 logger = logging.getLogger(__name__)
 
+def _unknown() -> Dict[str, Any]:
+    return {
+        "country": "XX",
+        "country_name": "Unknown",
+        "region": "",
+        "city": "",
+        "isp": "Unknown",
+        "org": "",
+        "asn": 0
+    }
+
+class MMDBResolver:
+    """
+    Offline resolver over local GeoLite2 Country/City/ASN databases.
+    Readers are memory-mapped, so a lookup is a few page reads; results are
+    kept in an LRU cache because the same proxies are resolved repeatedly.
+    """
+    def __init__(self, country_db: Optional[str] = None, city_db: Optional[str] = None,
+                 asn_db: Optional[str] = None, cache_size: int = 65536):
+        self.country_reader = self._open(country_db)
+        self.city_reader = self._open(city_db)
+        self.asn_reader = self._open(asn_db)
+        self._cached_lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @staticmethod
+    def _open(path: Optional[str]):
+        if not path or maxminddb is None or not os.path.exists(path):
+            return None
+        try:
+            return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        except Exception as e:
+            logger.warning(f"Could not open GeoIP database {path}: {e}")
+            return None
+
+    @property
+    def available(self) -> bool:
+        return bool(self.country_reader or self.city_reader or self.asn_reader)
+
+    def _lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        geo = self.city_reader.get(ip) if self.city_reader else None
+        if geo is None and self.country_reader:
+            geo = self.country_reader.get(ip)
+        asn = self.asn_reader.get(ip) if self.asn_reader else None
+        if not geo and not asn:
+            return None
+
+        result = _unknown()
+        if geo:
+            country = geo.get("country") or geo.get("registered_country") or {}
+            result["country"] = country.get("iso_code", "XX")
+            result["country_name"] = country.get("names", {}).get("en", "Unknown")
+            subdivisions = geo.get("subdivisions") or []
+            if subdivisions:
+                result["region"] = subdivisions[0].get("names", {}).get("en", "")
+            result["city"] = (geo.get("city") or {}).get("names", {}).get("en", "")
+        if asn:
+            result["isp"] = asn.get("autonomous_system_organization", "Unknown")
+            result["org"] = result["isp"]
+            result["asn"] = asn.get("autonomous_system_number", 0)
+        return result
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Returns geo data for `ip`, or None if no local database knows it."""
+        try:
+            result = self._cached_lookup(ip)
+        except ValueError:  # Not an IP address
+            return None
+        # Callers may annotate the dict, hand out a copy of the cached one
+        return dict(result) if result else None
+
+    def close(self):
+        for reader in (self.country_reader, self.city_reader, self.asn_reader):
+            if reader:
+                reader.close()
+
+_shared_resolver: Optional[MMDBResolver] = None
+
+def get_resolver() -> MMDBResolver:
+    """Process-wide resolver so validator, lifecycle and scripts share one cache."""
+    global _shared_resolver
+    if _shared_resolver is None:
+        cfg = settings.geoip
+        _shared_resolver = MMDBResolver(cfg.country_db, cfg.city_db, cfg.asn_db, cfg.cache_size)
+        if not _shared_resolver.available:
+            logger.info("No local GeoLite2 databases found, GeoIP will use ip-api.com only.")
+    return _shared_resolver
+
+_GEO_FIELDS = ("country", "country_name", "region", "city", "isp", "org", "asn")
+
+def _prefix24(ip: str) -> Optional[str]:
+    parts = ip.split(".")
+    if len(parts) != 4:
+        return None
+    return ".".join(parts[:3])
+
+class GeoCache:
+    """
+    Persistent cache for online GeoIP answers (geo_cache table) with a warm
+    in-memory layer loaded on first use. Country and ISP almost never differ
+    inside a /24, so with `share_prefix` a cached neighbour answers for the
+    whole prefix and repeat runs hardly touch ip-api.com.
+    """
+    def __init__(self, storage: Optional[StorageManager] = None, ttl: Optional[int] = None,
+                 share_prefix: Optional[bool] = None):
+        self.storage = storage or StorageManager()
+        self.ttl = settings.geoip.cache_ttl if ttl is None else ttl
+        self.share_prefix = settings.geoip.share_prefix if share_prefix is None else share_prefix
+        self._by_ip: Dict[str, Dict[str, Any]] = {}
+        self._by_prefix: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+
+    def _remember(self, entry: Dict[str, Any]):
+        self._by_ip[entry["ip"]] = entry
+        if entry.get("prefix24"):
+            self._by_prefix[entry["prefix24"]] = entry
+
+    async def load(self):
+        """Loads every unexpired row into memory once per process."""
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            await self.storage.init_db()
+            await self.storage.prune_geo_cache(self.ttl)
+            rows = await self.storage.get_geo_cache(self.ttl)
+            for row in rows:
+                self._remember(row)
+            self._loaded = True
+            logger.info(f"GeoIP cache warmed with {len(rows)} entries ({len(self._by_prefix)} /24 prefixes).")
+
+    def get(self, ip: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        entry = self._by_ip.get(ip)
+        if entry and now - entry["resolved_at"] < self.ttl:
+            self.hits += 1
+            return {k: entry[k] for k in _GEO_FIELDS}
+        if self.share_prefix:
+            prefix = _prefix24(ip)
+            entry = self._by_prefix.get(prefix) if prefix else None
+            if entry and now - entry["resolved_at"] < self.ttl:
+                self.prefix_hits += 1
+                return {k: entry[k] for k in _GEO_FIELDS}
+        self.misses += 1
+        return None
+
+    async def put_many(self, results: Dict[str, Dict[str, Any]]):
+        """Caches successful answers in memory and persists them in one transaction."""
+        now = int(time.time())
+        rows = []
+        for ip, geo in results.items():
+            if geo.get("country", "XX") == "XX":
+                continue  # Never cache failures, retry them next run
+            row = {k: geo.get(k) for k in _GEO_FIELDS}
+            row.update(ip=ip, prefix24=_prefix24(ip), resolved_at=now)
+            self._remember(row)
+            rows.append(row)
+        await self.storage.save_geo_cache(rows)
+
+def _parse_ip_api(item: Dict[str, Any]) -> Dict[str, Any]:
+    result = _unknown()
+    if item.get("status") == "success":
+        result.update({
+            "country": item.get("countryCode", "XX"),
+            "country_name": item.get("country", "Unknown"),
+            "region": item.get("regionName", ""),
+            "city": item.get("city", ""),
+            "isp": item.get("isp", "Unknown"),
+            "org": item.get("org", "")
+        })
+    return result
+
+class IpApiBatchClient:
+    """
+    Pipelined client for the ip-api.com batch endpoint.
+    Keeps up to `max_in_flight` chunks outstanding while the advertised
+    budget (X-Rl: requests left in the window, X-Ttl: seconds until it
+    resets) allows, pauses exactly until the window resets when it runs
+    out, and requeues chunks that hit HTTP 429 or a transient error.
+    Every requested IP appears in the returned map.
+    """
+    URL = "http://ip-api.com/batch"
+    FIELDS = "query,status,country,countryCode,regionName,city,isp,org"
+
+    def __init__(self, session: aiohttp.ClientSession, url: str = URL, chunk_size: int = 100,
+                 max_in_flight: int = 4, max_retries: int = 5, window_limit: int = 15):
+        self.session = session
+        self.url = url
+        self.chunk_size = chunk_size  # ip-api accepts at most 100 queries per batch
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self._window_limit = window_limit  # Free tier: 15 batch requests per minute
+        self._remaining = window_limit
+        self._reset_at = 0.0
+        self._in_flight = 0
+        self._lock = asyncio.Lock()
+        self.failed: set = set()
+        self.throttled = 0
+        self.requests = 0
+
+    async def _acquire(self):
+        """Waits until the current rate-limit window has budget for one request."""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                if self._remaining <= 0 and now >= self._reset_at:
+                    self._remaining = max(1, self._window_limit - self._in_flight)
+                if self._remaining > 0:
+                    self._remaining -= 1
+                    self._in_flight += 1
+                    return
+                wait = self._reset_at - now
+            await asyncio.sleep(wait)
+
+    async def _release(self, headers, status: int):
+        async with self._lock:
+            self._in_flight -= 1
+            now = time.monotonic()
+            rl = headers.get("X-Rl")
+            ttl = headers.get("X-Ttl")
+            if ttl is not None:
+                self._reset_at = now + int(ttl)
+            if rl is not None:
+                rl = int(rl)
+                self._window_limit = max(self._window_limit, rl + 1)
+                # X-Rl already counts this request; budget still held by in-flight ones is ours too
+                self._remaining = min(self._remaining, max(0, rl - self._in_flight))
+            if status == 429:
+                self.throttled += 1
+                self._remaining = 0
+                if ttl is None:
+                    self._reset_at = now + 60
+
+    async def _post(self, chunk: List[str]):
+        """
+        Sends one chunk. Returns (items, throttled): items is None when the
+        chunk has to be retried, throttled tells whether that was a 429.
+        """
+        await self._acquire()
+        headers, status = {}, 0
+        try:
+            payload = [{"query": ip, "fields": self.FIELDS} for ip in chunk]
+            async with self.session.post(self.url, json=payload) as response:
+                headers, status = response.headers, response.status
+                self.requests += 1
+                if status == 200:
+                    return await response.json(), False
+                if status != 429:
+                    logger.warning(f"Batch lookup failed: {status}")
+        except Exception as e:
+            logger.warning(f"Batch lookup exception: {e}")
+        finally:
+            await self._release(headers, status)
+        return None, status == 429
+
+    async def resolve(self, ips: List[str]) -> Dict[str, Dict[str, Any]]:
+        results: Dict[str, Dict[str, Any]] = {}
+        queue: asyncio.Queue = asyncio.Queue()
+        for i in range(0, len(ips), self.chunk_size):
+            queue.put_nowait((ips[i:i + self.chunk_size], 0))
+
+        async def worker():
+            while True:
+                chunk, attempts = await queue.get()
+                try:
+                    items, throttled = await self._post(chunk)
+                    if items is not None:
+                        for item in items:
+                            results[item.get("query")] = _parse_ip_api(item)
+                        # Anything the API silently left out goes back in the queue
+                        leftover = [ip for ip in chunk if ip not in results]
+                        if leftover and attempts < self.max_retries:
+                            queue.put_nowait((leftover, attempts + 1))
+                        elif leftover:
+                            self.failed.update(leftover)
+                    elif throttled:
+                        queue.put_nowait((chunk, attempts))  # Not the chunk's fault, _acquire waits out X-Ttl
+                    elif attempts < self.max_retries:
+                        await asyncio.sleep(min(30, 2 ** attempts))
+                        queue.put_nowait((chunk, attempts + 1))
+                    else:
+                        self.failed.update(chunk)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_in_flight)]
+        try:
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        for ip in ips:
+            results.setdefault(ip, _unknown())
+        logger.info(f"ip-api batch: {len(ips)} IPs in {self.requests} requests, "
+                    f"{self.throttled} throttled, {len(self.failed)} unresolved.")
+        return results
+
 class GeoIPManager:
-    def __init__(self):
+    def __init__(self, resolver: Optional[MMDBResolver] = None, online_fallback: Optional[bool] = None,
+                 cache: Optional[GeoCache] = None):
         self.api_url = "http://ip-api.com/json/"
-        # Rate limit for free API is 45 requests per minute.
-        # We should probably use a batch endpoint or cache.
-        # But for now, simple implementation.
+        # Local MMDB files answer first. The free ip-api tier is limited to
+        # 45 requests per minute, so it is only used for misses.
+        self.resolver = resolver or get_resolver()
+        self.online_fallback = settings.geoip.online_fallback if online_fallback is None else online_fallback
+        # Online answers are persisted so repeat runs skip the API
+        self.cache = cache or GeoCache()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
 
-    async def lookup(self, ip: str) -> Dict[str, Any]:
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def lookup_offline(self, ip: str) -> Optional[Dict[str, Any]]:
+        return self.resolver.lookup(ip)
+
+    async def lookup(self, ip: str, allow_online: bool = True) -> Dict[str, Any]:
         """
         Resolve GeoIP data for a single IP.
         Returns dict with country, isp, etc.
         """
+        result = self.resolver.lookup(ip)
+        if result:
+            return result
+        await self.cache.load()
+        result = self.cache.get(ip)
+        if result:
+            return result
+        if not (allow_online and self.online_fallback):
+            return _unknown()
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.api_url}{ip}?fields=status,country,countryCode,isp,org") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data.get("status") == "success":
-                            return {
-                                "country": data.get("countryCode", "XX"),
-                                "country_name": data.get("country", "Unknown"),
-                                "isp": data.get("isp", "Unknown"),
-                                "org": data.get("org", "")
-                            }
+            session = self._get_session()
+            async with session.get(f"{self.api_url}{ip}?fields=status,country,countryCode,regionName,city,isp,org") as response:
+                if response.status == 200:
+                    data = await response.json()
+                    if data.get("status") == "success":
+                        result = _parse_ip_api(data)
+                        await self.cache.put_many({ip: result})
+                        return result
         except Exception as e:
             logger.warning(f"GeoIP lookup failed for {ip}: {e}")
-        
-        return {
-            "country": "XX",
-            "country_name": "Unknown",
-            "isp": "Unknown",
-            "org": ""
-        }
-
-    async def lookup_batch(self, ips: list[str]) -> Dict[str, Dict[str, Any]]:
+
+        return _unknown()
+
+    async def lookup_batch(self, ips: list[str], allow_online: bool = True) -> Dict[str, Dict[str, Any]]:
         """
         Resolve GeoIP data for a list of IPs using batch endpoint.
         Returns dict keyed by query IP.
         """
         results = {}
-        # Chunk IPs into batches of 100 (API limit)
-        chunks = [ips[i:i + 100] for i in range(0, len(ips), 100)]
-        
-        async with aiohttp.ClientSession() as session:
-            for chunk in chunks:
-                try:
-                    # ip-api batch endpoint: POST /batch
-                    # Body: [{"query": "1.1.1.1"}, ...] or just list of IPs if just fields?
-                    # Batch format: JSON array of objects or strings? 
-                    # Doc: http://ip-api.com/batch -> supports list of dicts.
-                    # payload = [{"query": ip, "fields": "query,status,country,countryCode,isp,org"} for ip in chunk]
-                    
-                    payload = [{"query": ip, "fields": "query,status,country,countryCode,isp,org"} for ip in chunk]
-                    
-                    async with session.post("http://ip-api.com/batch", json=payload) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            for item in data:
-                                original_ip = item.get("query")
-                                if item.get("status") == "success":
-                                    results[original_ip] = {
-                                        "country": item.get("countryCode", "XX"),
-                                        "country_name": item.get("country", "Unknown"),
-                                        "isp": item.get("isp", "Unknown"),
-                                        "org": item.get("org", "")
-                                    }
-                                else:
-                                    results[original_ip] = {"country": "XX"}
-                        else:
-                             logger.warning(f"Batch lookup failed: {response.status}")
-                             
-                except Exception as e:
-                    logger.warning(f"Batch lookup exception: {e}")
-        
+        misses = []
+        await self.cache.load()
+        for ip in ips:
+            hit = self.resolver.lookup(ip) or self.cache.get(ip)
+            if hit:
+                results[ip] = hit
+            else:
+                misses.append(ip)
+
+        logger.info(f"GeoIP: {len(results)} resolved locally (offline DB or cache), {len(misses)} need an online lookup.")
+        if not misses or not (allow_online and self.online_fallback):
+            return results
+
+        client = IpApiBatchClient(self._get_session(),
+                                  max_in_flight=settings.geoip.batch_concurrency,
+                                  max_retries=settings.geoip.batch_retries)
+        online = await client.resolve(misses)
+        if client.failed:
+            logger.warning(f"GeoIP: {len(client.failed)} IPs unresolved after {client.max_retries} retries, marked XX.")
+
+        await self.cache.put_many(online)
+        results.update(online)
         return results
@@ -0,0 +1,125 @@
+import time
+from typing import Any, Dict, Optional
+
+from proxy_manager.core.config import settings
+
+# Columns of the proxies table owned by the health model
+HEALTH_FIELDS = ("health_score", "ewma_success", "ewma_latency_ms", "health_samples", "health_updated_at",
+                 "state", "consecutive_ok", "consecutive_fails", "quarantined_at")
+
+ACTIVE = "active"
+QUARANTINE = "quarantine"
+
+def _decayed(proxy: Dict[str, Any], now: float):
+    """
+    (success, samples) after time decay: every half-life without news
+    halves the evidence and pulls the success estimate back to the prior.
+    """
+    cfg = settings.health
+    success = proxy.get("ewma_success")
+    samples = proxy.get("health_samples") or 0.0
+    if success is None:
+        return cfg.prior, 0.0
+    elapsed = max(0.0, now - (proxy.get("health_updated_at") or now))
+    keep = 0.5 ** (elapsed / cfg.decay_half_life)
+    return cfg.prior + (success - cfg.prior) * keep, samples * keep
+
+def score(proxy: Dict[str, Any], now: Optional[float] = None) -> int:
+    """
+    0-100 health of a proxy. The EWMA success rate is shrunk towards the
+    prior by a confidence term n / (n + k) over the effective sample count,
+    then scaled down for slow proxies by the EWMA latency.
+    """
+    cfg = settings.health
+    now = time.time() if now is None else now
+    success, samples = _decayed(proxy, now)
+    confidence = samples / (samples + cfg.confidence_k)
+    success = cfg.prior + (success - cfg.prior) * confidence
+
+    latency = proxy.get("ewma_latency_ms")
+    speed = 1.0 if latency is None else cfg.latency_ref_ms / (cfg.latency_ref_ms + latency)
+    return int(round(100 * success * (1 - cfg.latency_weight + cfg.latency_weight * speed)))
+
+def success_rate(proxy: Dict[str, Any], now: Optional[float] = None) -> float:
+    """Decayed EWMA success rate, without the confidence shrink."""
+    return _decayed(proxy, time.time() if now is None else now)[0]
+
+def observe(proxy: Dict[str, Any], ok: bool, latency_ms: Optional[float] = None,
+            now: Optional[float] = None) -> int:
+    """
+    Folds one check outcome into the proxy's health fields (in place) and
+    returns the new health_score. The smoothing factor starts at 1/(n+1),
+    a plain mean over the first few samples, and settles at alpha_min.
+    """
+    cfg = settings.health
+    now = time.time() if now is None else now
+    success, samples = _decayed(proxy, now)
+
+    alpha = max(cfg.alpha_min, 1.0 / (samples + 1))
+    success += alpha * ((1.0 if ok else 0.0) - success)
+    if ok and latency_ms is not None:
+        latency = proxy.get("ewma_latency_ms")
+        proxy["ewma_latency_ms"] = float(latency_ms) if latency is None else latency + cfg.latency_alpha * (latency_ms - latency)
+
+    proxy["ewma_success"] = success
+    proxy["health_samples"] = samples + 1
+    proxy["health_updated_at"] = int(now)
+    proxy["health_score"] = score(proxy, now)
+    _track_state(proxy, ok, now)
+    return proxy["health_score"]
+
+def _track_state(proxy: Dict[str, Any], ok: bool, now: float):
+    """
+    Active -> quarantine after `quarantine_after` consecutive failures (or
+    once the model is confident the proxy is dead); quarantine -> active
+    after `release_after` consecutive successes.
+    """
+    cfg = settings.health
+    if ok:
+        proxy["consecutive_ok"] = (proxy.get("consecutive_ok") or 0) + 1
+        proxy["consecutive_fails"] = 0
+    else:
+        proxy["consecutive_fails"] = (proxy.get("consecutive_fails") or 0) + 1
+        proxy["consecutive_ok"] = 0
+
+    state = proxy.get("state") or ACTIVE
+    if state == ACTIVE and not ok and (proxy["consecutive_fails"] >= cfg.quarantine_after or is_dead(proxy, now=now)):
+        state = QUARANTINE
+        proxy["quarantined_at"] = int(now)
+    elif state == QUARANTINE and ok and proxy["consecutive_ok"] >= cfg.release_after:
+        state = ACTIVE
+        proxy["quarantined_at"] = None
+    proxy["state"] = state
+
+def quarantine_backoff(proxy: Dict[str, Any]) -> float:
+    """Re-check interval in quarantine: doubles with every further failure, capped."""
+    cfg = settings.health
+    extra = max(0, (proxy.get("consecutive_fails") or 0) - cfg.quarantine_after)
+    return min(cfg.quarantine_max_s, cfg.quarantine_base_s * 2 ** min(extra, 32))
+
+def seed_from_counts(proxy: Dict[str, Any], now: Optional[float] = None) -> int:
+    """
+    Initial state for rows that predate the model: Laplace-smoothed success
+    ratio from the lifetime counters, with at most `max_seed_samples` worth
+    of confidence so fresh checks can still move it.
+    """
+    ok = proxy.get("success_count") or 0
+    fail = proxy.get("fail_count") or 0
+    now = time.time() if now is None else now
+    proxy["ewma_success"] = (ok + 1) / (ok + fail + 2)
+    proxy["health_samples"] = float(min(ok + fail, settings.health.max_seed_samples))
+    proxy["ewma_latency_ms"] = proxy.get("response_time_ms")
+    proxy["health_updated_at"] = int(now)
+    proxy["health_score"] = score(proxy, now)
+    proxy.setdefault("state", ACTIVE)
+    proxy.setdefault("consecutive_ok", 0)
+    proxy.setdefault("consecutive_fails", 0)
+    proxy.setdefault("quarantined_at", None)
+    return proxy["health_score"]
+
+def is_dead(proxy: Dict[str, Any], threshold: Optional[int] = None, now: Optional[float] = None) -> bool:
+    """Evict only with enough evidence: a score under the threshold after min samples."""
+    cfg = settings.health
+    threshold = cfg.evict_below if threshold is None else threshold
+    _, samples = _decayed(proxy, time.time() if now is None else now)
+    return samples >= cfg.evict_min_samples and score(proxy, now) < threshold
@@ -1,76 +1,153 @@
-import aiosqlite
 import asyncio
 import logging
 import time
-from typing import List
-from proxy_manager.core.storage import StorageManager
+from typing import List, Optional
+from urllib.parse import urlsplit
+from proxy_manager.core import health
+from proxy_manager.core.breaker import BreakerBoard, CircuitBreaker, ROUTE_FAILURES
+from proxy_manager.core.config import settings
+from proxy_manager.core.scheduler import ReverifyScheduler, next_check_at
+from proxy_manager.core.shards import ShardCoordinator
+from proxy_manager.core.storage import (
+    StorageManager, OUTCOME_OK, OUTCOME_TIMEOUT, OUTCOME_REFUSED, OUTCOME_PROTOCOL, OUTCOME_FAILED,
+)
 from proxy_manager.core.validator import ProxyValidator
+from proxy_manager.core.verifier import LightweightVerifier
 
 logger = logging.getLogger(__name__)
 
+def handshake_outcome(reason: str) -> int:
+    """Maps a LightweightVerifier.handshake() failure reason to a check_history outcome code."""
+    if reason == "timeout":
+        return OUTCOME_TIMEOUT
+    if reason == "refused":
+        return OUTCOME_REFUSED
+    if reason == "closed" or reason.startswith(("socks", "http_connect")):
+        return OUTCOME_PROTOCOL
+    return OUTCOME_FAILED
+
 class LifecycleManager:
-    def __init__(self):
-        self.storage = StorageManager()
-        self.validator = ProxyValidator()
+    def __init__(self, storage: Optional[StorageManager] = None, shards: Optional[ShardCoordinator] = None):
+        self.storage = storage or StorageManager()
+        # Breaker bookkeeping happens here, once per re-check (on the handshake), not in the validator
+        self.breakers = BreakerBoard()
+        self.validator = ProxyValidator(storage=self.storage)
+        # With a coordinator this manager is one of several monitor workers on the same DB
+        self.shards = shards
+        self.scheduler = ReverifyScheduler(self.storage, self._reverify_single, shards=shards)
+        cfg = settings.scheduler
+        self.verifier = LightweightVerifier(timeout=cfg.handshake_timeout)
+        self.full_check_interval = cfg.full_check_interval
+        target = cfg.handshake_target or f"{urlsplit(settings.verification.judges[0]).hostname}:443"
+        host, _, port = target.rpartition(":")
+        self.handshake_target = (host, int(port))
+        self.tier_stats = {"handshake": 0, "handshake_failed": 0, "full": 0, "group_failed": 0}
         self.running = False
 
     async def start_monitor(self, interval: int = 300):
         """
-        Starts the background monitoring loop.
-        Interval: Seconds between checks.
+        Starts the background monitoring loop: the scheduler re-checks
+        proxies continuously as they come due.
+        Interval: Seconds between dead-proxy cleanups.
+        When sharded, only the leader worker runs cleanups.
         """
         self.running = True
-        logger.info(f"Lifecycle Manager started. Checking every {interval}s.")
+        await self.storage.init_db()
+        logger.info(f"Lifecycle Manager started. Cleaning up every {interval}s.")
+        shard_task = None
+        if self.shards is not None:
+            # Claim partitions before the scheduler starts streaming
+            await self.shards.heartbeat(self.scheduler.stats)
+            shard_task = asyncio.create_task(self.shards.run(lambda: self.scheduler.stats))
+            logger.info(f"Monitor worker {self.shards.worker_id} owns {len(self.shards.owned)}/{self.shards.partitions} partitions.")
+        scheduler_task = asyncio.create_task(self.scheduler.run())
         
-        while self.running:
-            try:
-                await self.reverify_proxies()
-                await self.cleanup_dead_proxies()
-            except Exception as e:
-                logger.error(f"Lifecycle error: {e}")
-            
-            await asyncio.sleep(interval)
+        try:
+            while self.running:
+                await asyncio.sleep(interval)
+                try:
+                    if self.shards is None or self.shards.is_leader:
+                        await self.cleanup_dead_proxies()
+                        await self.storage.maintain_history()
+                    self.breakers.prune()
+                    logger.info(f"Scheduler: {self.scheduler.stats}, tiers: {self.tier_stats}, "
+                                f"breakers: {self.breakers.summary()}")
+                except Exception as e:
+                    logger.error(f"Lifecycle error: {e}")
+                if scheduler_task.done():
+                    logger.error(f"Scheduler stopped: {scheduler_task.exception()}")
+                    scheduler_task = asyncio.create_task(self.scheduler.run())
+        finally:
+            self.scheduler.stop()
+            scheduler_task.cancel()
+            await asyncio.gather(scheduler_task, return_exceptions=True)
+            if shard_task is not None:
+                shard_task.cancel()
+                await asyncio.gather(shard_task, return_exceptions=True)
+                await self.shards.release()
+            await self.storage.close()
 
     async def stop(self):
         self.running = False
+        self.scheduler.stop()
+        if self.shards is not None:
+            self.shards.stop()
+        await self.storage.close()
 
-    async def reverify_proxies(self):
+    async def reverify_proxies(self, due_only: bool = False):
         """
-        Fetch proxies that haven't been checked recently and re-validate them.
+        One pass of re-validation, streamed through the scheduler's workers.
+        With due_only, only proxies whose next_check_at has passed.
         """
-        proxies = await self.storage.get_proxies(limit=1000) # Fetch all for now
-        # Ideally, fetch only those with last_checked > X minutes
-        
-        logger.info(f"Re-verifying {len(proxies)} proxies...")
-        
-        sem = asyncio.Semaphore(50)  # Prevent network exhaustion / false timeouts
-        
-        async def sem_reverify_single(proxy):
-            async with sem:
-                await self._reverify_single(proxy)
-                
-        coros = []
-        for proxy in proxies:
-            coros.append(sem_reverify_single(proxy))
-        
-        if coros:
-            await asyncio.gather(*coros)
+        await self.storage.init_db()
+        checked = await self.scheduler.run_once(due_only=due_only)
+        logger.info(f"Re-verified {checked} proxies.")
 
     async def _reverify_single(self, proxy):
+        """
+        Tiered re-check: a protocol handshake through the proxy on every
+        cycle, and the full TLS/anonymity validation only when the handshake
+        passes and the last full one is older than full_check_interval or
+        the proxy just came back from a failure.
+        """
         ip = proxy['ip']
         port = proxy['port']
         protocol = proxy['protocol']
-        
-        # Check current health
-        current_health = proxy['health_score']
-        
-        result = await self.validator.check_proxy(ip, port, protocol, skip_geoip=True)
+        isp = proxy.get('isp')
+
+        # The /24 or ISP is in an outage: park the group instead of timing out on each proxy
+        blocker = self.breakers.acquire(ip, isp)
+        if blocker is not None:
+            await self._park_group(blocker)
+            return
+
+        # A failed handshake counts against health straight away
+        self.tier_stats["handshake"] += 1
+        ok, latency, reason = await self.verifier.handshake(ip, port, protocol, *self.handshake_target)
+        await self.storage.record_check(ip, port, OUTCOME_OK if ok else handshake_outcome(reason), latency)
+        self.breakers.record(ip, isp, not ok and reason in ROUTE_FAILURES)
+        if not ok:
+            self.tier_stats["handshake_failed"] += 1
+            logger.debug(f"Handshake to {ip}:{port} ({protocol}) failed: {reason}")
+            await self._record_failure(proxy)
+            return
+
+        full_due = time.time() - (proxy.get('full_checked_at') or 0) >= self.full_check_interval
+        if not full_due and proxy.get('last_ok', 1):
+            # Handshake latency is not comparable to a full request, so only the outcome counts
+            await self.storage.record_outcome(proxy, True)
+            return
+
+        self.tier_stats["full"] += 1
+        result = await self.validator.check_proxy(ip, port, protocol, skip_geoip=True, isp=isp)
+        await self.storage.record_check(ip, port, OUTCOME_OK if result else OUTCOME_FAILED,
+                                        result['response_time_ms'] if result else None)
         
         if result:
             # It's alive!
-            # Boost health score (max 100)
-            new_health = min(100, current_health + 10)
-            result['health_score'] = new_health
+            health.observe(proxy, True, result['response_time_ms'])
+            for key in health.HEALTH_FIELDS:
+                result[key] = proxy[key]
             result['success_count'] = proxy['success_count'] + 1
             result['fail_count'] = proxy['fail_count']
             
@@ -79,40 +156,60 @@ class LifecycleManager:
             result['isp'] = proxy.get('isp', 'Unknown')
             result['region'] = proxy.get('region', '')
             result['city'] = proxy.get('city', '')
+
+            # Backfill records saved without GeoIP from the local databases
+            if result['country'] in (None, '', 'XX') or result['isp'] in (None, '', 'Unknown'):
+                geo = self.validator.geoip.lookup_offline(ip)
+                if geo:
+                    for key in ('country', 'isp', 'region', 'city'):
+                        if result[key] in (None, '', 'XX', 'Unknown') and geo.get(key):
+                            result[key] = geo[key]
+            if result['isp'] in (None, '', 'Unknown'):
+                result['isp'] = self.validator.ranges.lookup(ip) or 'Unknown'
+            result['next_check_at'] = next_check_at(result)
             
             # Update DB
             await self.storage.save_proxy(result)
-            # logger.debug(f"Proxy {ip}:{port} verified (Health: {new_health})")
+            # logger.debug(f"Proxy {ip}:{port} verified (Health: {result['health_score']})")
         else:
-            # It's dead!
-            # Decrease health
-            new_health = max(0, current_health - 20)
-            
-            # If health drops below threshold, we might rely on cleanup_dead_proxies to remove it
-            # Or just update it here.
-            # We need a method to UPDATE specific fields without overwriting everything if we don't have full object
-            # But save_proxy does REPLACE. So we need full object.
-            # Since check_proxy failed, we don't have new metadata.
-            # We must manually update status in DB.
-            
-            async with aiosqlite.connect(self.storage.db_path) as db:
-                await db.execute("""
-                    UPDATE proxies 
-                    SET health_score = ?, fail_count = fail_count + 1, last_checked = CURRENT_TIMESTAMP
-                    WHERE ip = ? AND port = ?
-                """, (new_health, ip, port))
-                await db.commit()
-            
-            # logger.debug(f"Proxy {ip}:{port} failed (Health: {new_health})")
+            # It's dead! Since the check failed we have no new metadata, so
+            # only the health fields are updated instead of replacing the row;
+            # cleanup_dead_proxies removes it once the model is sure.
+            await self._record_failure(proxy)
+
+    async def _record_failure(self, proxy):
+        """
+        A failed check counts against the proxy's health unless its group's
+        circuit is open: then the outage is the group's, and the proxy is
+        parked with it instead of being pushed towards quarantine.
+        """
+        blocker = self.breakers.blocking(proxy['ip'], proxy.get('isp'))
+        if blocker is None:
+            await self.storage.record_outcome(proxy, False)
+            return
+        self.tier_stats["group_failed"] += 1
+        await self._park_group(blocker)
+
+    async def _park_group(self, blocker: CircuitBreaker):
+        """Moves the group's next_check_at past the breaker's retry time, once per open period."""
+        until = blocker.resume_at(time.time())
+        if blocker.deferred_until >= until:
+            return
+        blocker.deferred_until = until
+        parked = await self.storage.defer_checks(until, **blocker.scope)
+        logger.info(f"Circuit {blocker.key} {blocker.state}: parked {parked} proxies until {until}.")
 
-    async def cleanup_dead_proxies(self, threshold: int = 40):
+    async def cleanup_dead_proxies(self, threshold: Optional[int] = None):
         """
-        Remove proxies with health_score below threshold.
+        Quarantine proxies whose health score is below threshold (health.evict_below
+        by default) once the model has enough samples to be confident, and
+        archive those that stayed in quarantine for archive_after_days.
+        Quarantined proxies keep being re-checked with exponential backoff.
         """
-        async with aiosqlite.connect(self.storage.db_path) as db:
-            await db.execute("DELETE FROM proxies WHERE health_score < ?", (threshold,))
-            deleted = db.total_changes
-            await db.commit()
+        cfg = settings.health
+        threshold = cfg.evict_below if threshold is None else threshold
+        quarantined = await self.storage.quarantine_unhealthy(threshold, cfg.evict_min_samples)
+        archived = await self.storage.archive_quarantined(cfg.archive_after_days * 86400)
         
-        if deleted > 0:
-            logger.info(f"Cleaned up {deleted} dead proxies.")
+        if quarantined or archived:
+            logger.info(f"Quarantined {quarantined} failing proxies, archived {archived} long-dead ones.")
@@ -0,0 +1,56 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from proxy_manager.core.relay import proxy_url
+from proxy_manager.core.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+class PassiveHealth:
+    """
+    Health evidence from the gateway's own traffic. record() is a dict
+    append on the request path; flush() folds each upstream's batch into
+    the stored row through storage.record_outcomes, which re-reads it first
+    (the monitor may have moved it on since the pool loaded it) and leaves
+    quarantined rows alone. Upstreams that carried
+    no traffic for `idle_after` seconds are the only ones worth probing.
+    """
+    def __init__(self, storage: StorageManager, idle_after: float):
+        self.storage = storage
+        self.idle_after = idle_after
+        self._batch: Dict[str, Tuple[Dict[str, Any], List[Tuple[bool, Optional[float]]]]] = {}
+        self.last_seen: Dict[str, float] = {}
+        self.stats = {"ok": 0, "failed": 0, "flushes": 0}
+
+    def record(self, proxy: Dict[str, Any], ok: bool, latency_ms: Optional[float] = None):
+        url = proxy_url(proxy)
+        entry = self._batch.get(url)
+        if entry is None:
+            entry = self._batch[url] = (proxy, [])
+        entry[1].append((ok, latency_ms if ok else None))
+        self.last_seen[url] = time.monotonic()
+        self.stats["ok" if ok else "failed"] += 1
+
+    def idle(self, proxy: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """No real traffic through this upstream for idle_after seconds."""
+        seen = self.last_seen.get(proxy_url(proxy))
+        return seen is None or (time.monotonic() if now is None else now) - seen >= self.idle_after
+
+    def pending(self) -> int:
+        return sum(len(outcomes) for _, outcomes in self._batch.values())
+
+    async def flush(self) -> List[Tuple[Dict[str, Any], int]]:
+        """Applies the batch; returns (proxy, new health score) per upstream touched, 0 for quarantined ones."""
+        batch, self._batch = self._batch, {}
+        scored = []
+        for proxy, outcomes in batch.values():
+            scored.append((proxy, await self.storage.record_outcomes(proxy, outcomes)))
+        if batch:
+            self.stats["flushes"] += 1
+            logger.debug(f"Passive health: {sum(len(o) for _, o in batch.values())} outcomes "
+                         f"for {len(batch)} upstreams")
+        # Forget upstreams long gone from traffic so the map stays bounded
+        horizon = time.monotonic() - 10 * self.idle_after
+        self.last_seen = {url: seen for url, seen in self.last_seen.items() if seen >= horizon}
+        return scored
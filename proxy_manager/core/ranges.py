@@ -0,0 +1,158 @@
+import ipaddress
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RANGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ranges")
+
+def ip_to_int(ip: str) -> Optional[int]:
+    """Dotted IPv4 string to uint32, None for anything else."""
+    try:
+        return int(ipaddress.IPv4Address(ip))
+    except ValueError:
+        return None
+
+def flatten_intervals(intervals: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Turns nested/disjoint (start, end, label) intervals (CIDR prefixes always
+    nest or are disjoint) into sorted non-overlapping ones where the most
+    specific prefix wins. Adjacent pieces with the same label are merged.
+    """
+    out: List[List[int]] = []
+
+    def emit(start, end, label):
+        if start > end:
+            return
+        if out and out[-1][2] == label and out[-1][1] + 1 == start:
+            out[-1][1] = end
+        else:
+            out.append([start, end, label])
+
+    # Outer intervals first for equal starts; on exact duplicates the later one wins
+    ordered = sorted(enumerate(intervals), key=lambda item: (item[1][0], -item[1][1], item[0]))
+    stack: List[Tuple[int, int, int]] = []
+    cursor = 0
+    for _, (start, end, label) in ordered:
+        while stack and stack[-1][1] < start:
+            top = stack.pop()
+            emit(cursor, top[1], top[2])
+            cursor = top[1] + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][2])
+        stack.append((start, end, label))
+        cursor = start
+    while stack:
+        top = stack.pop()
+        emit(cursor, top[1], top[2])
+        cursor = top[1] + 1
+    return [tuple(item) for item in out]
+
+class RangeIndex:
+    """
+    Maps IPs to our internal ISP labels (the ranges/*.txt file names) with an
+    interval index: sorted uint32 start/end arrays searched with bisect, so a
+    lookup is O(log n) over every prefix we maintain. The index is rebuilt
+    when a range file is added, removed or modified.
+    """
+    def __init__(self, ranges_dir: str = RANGES_DIR, check_interval: float = 5.0):
+        self.ranges_dir = ranges_dir
+        self.check_interval = check_interval
+        self.starts = array("I")
+        self.ends = array("I")
+        self.label_ids = array("H")
+        self.labels: List[str] = []
+        self._signature = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def _scan_signature(self):
+        try:
+            entries = sorted(f for f in os.listdir(self.ranges_dir) if f.endswith(".txt"))
+        except FileNotFoundError:
+            return ()
+        sig = []
+        for name in entries:
+            st = os.stat(os.path.join(self.ranges_dir, name))
+            sig.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(sig)
+
+    def reload(self):
+        """Parses every range file and rebuilds the index."""
+        signature = self._scan_signature()
+        intervals = []
+        labels = []
+        for name, _, _ in signature:
+            label_id = len(labels)
+            labels.append(name[:-4])
+            with open(os.path.join(self.ranges_dir, name), "r") as f:
+                for line in f:
+                    line = line.split("#", 1)[0].strip()
+                    if not line:
+                        continue
+                    try:
+                        net = ipaddress.IPv4Network(line, strict=False)
+                    except ValueError:
+                        logger.warning(f"Skipping invalid range '{line}' in {name}")
+                        continue
+                    intervals.append((int(net.network_address), int(net.broadcast_address), label_id))
+
+        flat = flatten_intervals(intervals)
+        self.starts = array("I", (s for s, _, _ in flat))
+        self.ends = array("I", (e for _, e, _ in flat))
+        self.label_ids = array("H", (l for _, _, l in flat))
+        self.labels = labels
+        self._signature = signature
+        self._checked_at = time.monotonic()
+        logger.debug(f"Range index built: {len(intervals)} prefixes from {len(labels)} files -> {len(flat)} intervals")
+
+    def maybe_reload(self):
+        """Rebuilds if any range file changed. Stats the directory at most every `check_interval` seconds."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._scan_signature() != self._signature:
+            logger.info("Range files changed, rebuilding ISP range index.")
+            self.reload()
+
+    def _find(self, value: int) -> Optional[str]:
+        i = bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self.labels[self.label_ids[i]]
+        return None
+
+    def lookup(self, ip: str) -> Optional[str]:
+        """Returns the ISP label owning `ip`, or None if no range file covers it."""
+        self.maybe_reload()
+        value = ip_to_int(ip)
+        if value is None:
+            return None
+        return self._find(value)
+
+    def lookup_many(self, ips: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Resolves a whole batch with one freshness check."""
+        self.maybe_reload()
+        results = {}
+        for ip in ips:
+            if ip in results:
+                continue
+            value = ip_to_int(ip)
+            results[ip] = self._find(value) if value is not None else None
+        return results
+
+    def __len__(self):
+        return len(self.starts)
+
+_shared_index: Optional[RangeIndex] = None
+
+def get_range_index() -> RangeIndex:
+    """Process-wide index shared by import, validation and reporting."""
+    global _shared_index
+    if _shared_index is None:
+        _shared_index = RangeIndex()
+    return _shared_index
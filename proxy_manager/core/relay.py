@@ -0,0 +1,315 @@
+import asyncio
+import base64
+import ipaddress
+import logging
+import socket
+import struct
+from typing import Awaitable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from python_socks import ProxyConnectionError, ProxyTimeoutError
+from python_socks.async_.asyncio import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Connection-scoped headers that must not be passed on to the upstream
+HOP_BY_HOP = {b"connection", b"keep-alive", b"proxy-connection", b"proxy-authorization",
+              b"proxy-authenticate", b"te", b"trailer", b"upgrade"}
+
+# Safe to send twice (RFC 9110 9.2.2), so they may be retried after reaching an upstream
+IDEMPOTENT_METHODS = {b"GET", b"HEAD", b"OPTIONS", b"TRACE", b"PUT", b"DELETE"}
+
+class BadRequest(Exception):
+    """The client sent something we cannot route."""
+
+class SourceError(Exception):
+    """copy_body() lost its source mid-body: closed early or broken chunk framing."""
+
+def proxy_url(proxy: Dict) -> str:
+    return f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}"
+
+def parse_head(head: bytes) -> Tuple[bytes, bytes, bytes, List[Tuple[bytes, bytes]]]:
+    """Splits a request head into (method, target, version, [(name, value), ...])."""
+    lines = head.rstrip(b"\r\n").split(b"\r\n")
+    try:
+        method, target, version = lines[0].split(b" ", 2)
+    except ValueError:
+        raise BadRequest(f"Malformed request line: {lines[0][:100]!r}")
+    headers = []
+    for line in lines[1:]:
+        name, sep, value = line.partition(b":")
+        if not sep:
+            raise BadRequest(f"Malformed header line: {line[:100]!r}")
+        headers.append((name.strip(), value.strip()))
+    return method.upper(), target, version, headers
+
+def split_authority(authority: str, default_port: int) -> Tuple[str, int]:
+    """'host:port', '[v6]:port' or 'host' -> (host, port)."""
+    parsed = urlsplit(f"//{authority}")
+    try:
+        port = parsed.port or default_port
+    except ValueError:
+        raise BadRequest(f"Bad port in {authority!r}")
+    if not parsed.hostname:
+        raise BadRequest(f"No host in {authority!r}")
+    return parsed.hostname, port
+
+def forward_head(method: bytes, target: bytes, version: bytes, headers: List[Tuple[bytes, bytes]],
+                 absolute: bool, keep_alive: bool = False) -> Tuple[str, int, bytes]:
+    """
+    Plain-HTTP request for the upstream: (host, port, head). `absolute` keeps
+    the absolute-form target (for an HTTP proxy upstream), otherwise it is
+    rewritten to origin-form for a tunnel straight to the origin. Hop-by-hop
+    headers are dropped. Without `keep_alive` the upstream is asked to close
+    after the response, so the tunnel can be spliced without parsing where
+    one response ends.
+    """
+    url = urlsplit(target.decode("latin-1"))
+    if url.scheme != "http" or not url.netloc:
+        raise BadRequest(f"Expected an absolute http:// URL, got {target[:100]!r}")
+    host, port = split_authority(url.netloc, 80)
+    if not absolute:
+        target = (url.path or "/").encode("latin-1") + (b"?" + url.query.encode("latin-1") if url.query else b"")
+    lines = [b" ".join((method, target, version))]
+    lines += [name + b": " + value for name, value in headers if name.lower() not in HOP_BY_HOP]
+    lines.append(b"Connection: keep-alive" if keep_alive else b"Connection: close")
+    return host, port, b"\r\n".join(lines) + b"\r\n\r\n"
+
+def header_value(headers: List[Tuple[bytes, bytes]], name: bytes) -> Optional[bytes]:
+    """Last value of a header, case-insensitive."""
+    found = None
+    for key, value in headers:
+        if key.lower() == name:
+            found = value
+    return found
+
+def proxy_auth_user(headers: List[Tuple[bytes, bytes]]) -> Optional[str]:
+    """User name from a Basic Proxy-Authorization header, used as a session key."""
+    value = header_value(headers, b"proxy-authorization")
+    if not value or not value[:6].lower() == b"basic ":
+        return None
+    try:
+        user = base64.b64decode(value[6:].strip(), validate=True).partition(b":")[0]
+    except ValueError:
+        return None
+    return user.decode("utf-8", "replace") or None
+
+def wants_keep_alive(version: bytes, headers: List[Tuple[bytes, bytes]]) -> bool:
+    """Persistent connection per RFC 9112: default on for HTTP/1.1, opt-in for 1.0."""
+    connection = (header_value(headers, b"connection") or b"").lower()
+    if version.upper() == b"HTTP/1.1":
+        return b"close" not in connection
+    return b"keep-alive" in connection
+
+def parse_status(head: bytes) -> Tuple[bytes, int, List[Tuple[bytes, bytes]]]:
+    """Splits a response head into (version, status, headers)."""
+    status_line, _, rest = head.partition(b"\r\n")
+    parts = status_line.split(b" ", 2)
+    try:
+        status = int(parts[1])
+    except (IndexError, ValueError):
+        raise BadRequest(f"Malformed status line: {status_line[:100]!r}")
+    _, _, _, headers = parse_head(b"- - -\r\n" + rest)
+    return parts[0], status, headers
+
+def body_framing(headers: List[Tuple[bytes, bytes]], method: Optional[bytes] = None,
+                 status: Optional[int] = None) -> Tuple[str, int]:
+    """
+    How the body after a head is delimited: ("none", 0), ("length", n),
+    ("chunked", 0) or, for responses only, ("eof", 0) when the sender
+    closes the connection to end it. Pass `status` for a response.
+    """
+    if status is not None and (method == b"HEAD" or 100 <= status < 200 or status in (204, 304)):
+        return "none", 0
+    encoding = header_value(headers, b"transfer-encoding")
+    if encoding is not None and encoding.lower().endswith(b"chunked"):
+        return "chunked", 0
+    length = header_value(headers, b"content-length")
+    if length is not None:
+        try:
+            return "length", int(length)
+        except ValueError:
+            raise BadRequest(f"Bad Content-Length {length[:20]!r}")
+    return ("eof", 0) if status is not None else ("none", 0)
+
+def response_head(head: bytes, keep_alive: bool) -> bytes:
+    """Upstream response head for the client: hop-by-hop headers replaced by our own Connection."""
+    lines = head.rstrip(b"\r\n").split(b"\r\n")
+    kept = [lines[0]] + [line for line in lines[1:] if line.partition(b":")[0].strip().lower() not in HOP_BY_HOP]
+    kept.append(b"Connection: keep-alive" if keep_alive else b"Connection: close")
+    return b"\r\n".join(kept) + b"\r\n\r\n"
+
+async def _pull(read: Awaitable[bytes]) -> bytes:
+    try:
+        return await read
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+        raise SourceError(str(e) or type(e).__name__) from e
+
+async def copy_body(src: asyncio.StreamReader, dst: asyncio.StreamWriter, framing: Tuple[str, int],
+                    size: int = 2 ** 16) -> int:
+    """
+    Copies one message body as framed by body_framing(); chunked bodies are
+    passed through as-is. Failures reading `src` raise SourceError, so the
+    caller can tell them from failures writing to `dst`.
+    """
+    kind, remaining = framing
+    copied = 0
+    if kind == "length":
+        while remaining:
+            data = await _pull(src.read(min(size, remaining)))
+            if not data:
+                raise SourceError(f"closed with {remaining} bytes of the body left")
+            dst.write(data)
+            await dst.drain()
+            copied += len(data)
+            remaining -= len(data)
+    elif kind == "chunked":
+        while True:
+            line = await _pull(src.readuntil(b"\r\n"))
+            dst.write(line)
+            try:
+                chunk = int(line.split(b";", 1)[0].strip() or b"0", 16)
+            except ValueError:
+                raise SourceError(f"bad chunk size {line[:20]!r}")
+            if chunk == 0:
+                # Trailer section up to the empty line
+                while (line := await _pull(src.readuntil(b"\r\n"))) != b"\r\n":
+                    dst.write(line)
+                dst.write(line)
+                break
+            copied += chunk
+            await copy_body(src, dst, ("length", chunk + 2), size)
+        await dst.drain()
+    elif kind == "eof":
+        while data := await _pull(src.read(size)):
+            dst.write(data)
+            await dst.drain()
+            copied += len(data)
+    return copied
+
+async def open_tunnel(proxy: Dict, host: str, port: int, timeout: float,
+                      limit: int = 2 ** 16) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Connects to host:port through the upstream proxy: SOCKS5/SOCKS4a with the
+    name resolved by the upstream, or HTTP CONNECT. Returns an asyncio stream
+    pair over the established tunnel.
+    """
+    sock = await Proxy.from_url(proxy_url(proxy), rdns=True).connect(host, port, timeout=timeout)
+    return await asyncio.open_connection(sock=sock, limit=limit)
+
+async def open_direct(proxy: Dict, timeout: float,
+                      limit: int = 2 ** 16) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Plain TCP connection to an HTTP proxy, for absolute-form forwarding."""
+    return await asyncio.wait_for(asyncio.open_connection(proxy["ip"], proxy["port"], limit=limit), timeout)
+
+# SOCKS5 reply codes (RFC 1928 section 6)
+SOCKS5_OK = 0
+SOCKS5_FAILURE = 1
+SOCKS5_HOST_UNREACHABLE = 4
+SOCKS5_REFUSED = 5
+SOCKS5_TTL_EXPIRED = 6
+SOCKS5_COMMAND_UNSUPPORTED = 7
+SOCKS5_ADDRESS_UNSUPPORTED = 8
+
+def socks_reply(version: int, code: int) -> bytes:
+    """Reply to a SOCKS5 or SOCKS4 request; the bound address is always reported as 0.0.0.0:0."""
+    if version == 4:
+        return bytes((0, 0x5A if code == SOCKS5_OK else 0x5B)) + bytes(6)
+    return bytes((5, code, 0, 1)) + bytes(6)
+
+def socks_error_code(exc: BaseException) -> int:
+    """SOCKS5 reply code for a failure to open the upstream tunnel."""
+    if isinstance(exc, (ProxyTimeoutError, asyncio.TimeoutError, TimeoutError)):
+        return SOCKS5_TTL_EXPIRED
+    if isinstance(exc, ConnectionRefusedError):
+        return SOCKS5_REFUSED
+    if isinstance(exc, (ProxyConnectionError, OSError)):
+        return SOCKS5_HOST_UNREACHABLE
+    return SOCKS5_FAILURE
+
+async def _read_cstring(reader: asyncio.StreamReader, limit: int = 255) -> bytes:
+    value = await reader.readuntil(b"\0")
+    if len(value) > limit + 1:
+        raise BadRequest("SOCKS4 field too long")
+    return value[:-1]
+
+async def read_socks_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Tuple[int, str, int]:
+    """
+    Inbound SOCKS5 (no authentication) or SOCKS4/4a handshake up to the
+    CONNECT request. Returns (version, host, port); host stays a name when
+    the client sent one, so the upstream can resolve it. Unsupported
+    requests are answered with the matching error and raise BadRequest.
+    """
+    version = (await reader.readexactly(1))[0]
+    if version == 4:
+        command, port, address = struct.unpack("!BH4s", await reader.readexactly(7))
+        await _read_cstring(reader)  # User id, ignored
+        if address[:3] == b"\0\0\0" and address[3]:
+            host = (await _read_cstring(reader)).decode("idna")  # SOCKS4a: 0.0.0.x means "name follows"
+        else:
+            host = socket.inet_ntoa(address)
+        if command != 1:
+            writer.write(socks_reply(4, SOCKS5_COMMAND_UNSUPPORTED))
+            raise BadRequest(f"SOCKS4 command {command} not supported")
+        return 4, host, port
+
+    if version != 5:
+        raise BadRequest(f"Not a SOCKS request (first byte {version})")
+    methods = await reader.readexactly((await reader.readexactly(1))[0])
+    if 0 not in methods:
+        writer.write(b"\x05\xff")
+        raise BadRequest("SOCKS5 client offers no unauthenticated method")
+    writer.write(b"\x05\x00")
+
+    _, command, _, atyp = await reader.readexactly(4)
+    if atyp == 1:
+        host = socket.inet_ntoa(await reader.readexactly(4))
+    elif atyp == 3:
+        host = (await reader.readexactly((await reader.readexactly(1))[0])).decode("idna")
+    elif atyp == 4:
+        host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+    else:
+        writer.write(socks_reply(5, SOCKS5_ADDRESS_UNSUPPORTED))
+        raise BadRequest(f"SOCKS5 address type {atyp} not supported")
+    port = struct.unpack("!H", await reader.readexactly(2))[0]
+    if command != 1:
+        writer.write(socks_reply(5, SOCKS5_COMMAND_UNSUPPORTED))
+        raise BadRequest(f"SOCKS5 command {command} not supported")
+    return 5, host, port
+
+async def _pump(src: asyncio.StreamReader, dst: asyncio.StreamWriter, size: int, counter: List[int]):
+    try:
+        while True:
+            data = await src.read(size)
+            if not data:
+                break
+            counter[0] += len(data)
+            dst.write(data)
+            await dst.drain()
+        if dst.can_write_eof():
+            dst.write_eof()
+    except (ConnectionError, OSError):
+        dst.close()
+
+async def splice(a: Tuple[asyncio.StreamReader, asyncio.StreamWriter],
+                 b: Tuple[asyncio.StreamReader, asyncio.StreamWriter],
+                 buffer_size: int = 2 ** 16, linger: Optional[float] = 30.0) -> Tuple[int, int]:
+    """
+    Copies bytes both ways between two stream pairs until both directions
+    hit EOF, or `linger` seconds after the first one does. The payload is
+    never inspected. Returns (bytes a->b, bytes b->a); both writers are closed.
+    """
+    sent, received = [0], [0]
+    up = asyncio.create_task(_pump(a[0], b[1], buffer_size, sent))
+    down = asyncio.create_task(_pump(b[0], a[1], buffer_size, received))
+    try:
+        done, pending = await asyncio.wait((up, down), return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.wait(pending, timeout=linger)
+    finally:
+        for task in (up, down):
+            task.cancel()
+        await asyncio.gather(up, down, return_exceptions=True)
+        for writer in (a[1], b[1]):
+            writer.close()
+    return sent[0], received[0]
@@ -0,0 +1,285 @@
+import bisect
+import hashlib
+import random
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from proxy_manager.core import health
+from proxy_manager.core.config import settings
+from proxy_manager.core.relay import proxy_url
+
+class Selector:
+    """
+    Picks an upstream from the gateway pool. Members live in a list plus a
+    url -> position map, so adds and removes are O(1) (swap with the last
+    element) and subclasses keep their own index in step through the
+    _added/_removed/_changed hooks. select() never awaits, which makes it
+    atomic on the event loop without a lock.
+
+    Every proxy returned by select() counts as outstanding until release()
+    is called for it; hold() counts a proxy that was picked some other way.
+    """
+    keyed = False  # Whether select() pins a session key to one proxy
+
+    def __init__(self):
+        self._members: List[Dict[str, Any]] = []
+        self._index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._members)
+
+    def __contains__(self, proxy: Dict[str, Any]) -> bool:
+        return proxy_url(proxy) in self._index
+
+    def members(self) -> List[Dict[str, Any]]:
+        return list(self._members)
+
+    def add(self, proxy: Dict[str, Any]):
+        url = proxy_url(proxy)
+        if url in self._index:
+            self.update(proxy)
+            return
+        self._index[url] = len(self._members)
+        self._members.append(proxy)
+        self._added(url, proxy)
+
+    def remove(self, proxy: Dict[str, Any]):
+        url = proxy_url(proxy)
+        pos = self._index.pop(url, None)
+        if pos is None:
+            return
+        last = self._members.pop()
+        if pos < len(self._members):
+            self._members[pos] = last
+            self._index[proxy_url(last)] = pos
+        self._removed(url)
+
+    def update(self, proxy: Dict[str, Any]):
+        """New health figures for a member (the dict may be a fresh copy)."""
+        url = proxy_url(proxy)
+        pos = self._index.get(url)
+        if pos is not None:
+            self._members[pos] = proxy
+            self._changed(url, proxy)
+
+    def sync(self, pool: List[Dict[str, Any]]):
+        """Makes the members match `pool`, touching only what differs."""
+        wanted = {proxy_url(p): p for p in pool}
+        for proxy in [p for p in self._members if proxy_url(p) not in wanted]:
+            self.remove(proxy)
+        for proxy in wanted.values():
+            self.add(proxy)
+
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def hold(self, proxy: Dict[str, Any]):
+        pass
+
+    def release(self, proxy: Dict[str, Any]):
+        pass
+
+    def _added(self, url: str, proxy: Dict[str, Any]):
+        pass
+
+    def _removed(self, url: str):
+        pass
+
+    def _changed(self, url: str, proxy: Dict[str, Any]):
+        pass
+
+class RandomSelector(Selector):
+    """Uniform choice."""
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        return random.choice(self._members) if self._members else None
+
+class RoundRobinSelector(Selector):
+    """Each member in turn."""
+    def __init__(self):
+        super().__init__()
+        self._cursor = -1
+
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not self._members:
+            return None
+        self._cursor = (self._cursor + 1) % len(self._members)
+        return self._members[self._cursor]
+
+class WeightedSelector(Selector):
+    """
+    Choice weighted by health.score (success rate scaled down by latency),
+    sampled with Vose's alias method: one uniform index and one coin flip
+    per pick. The alias table is rebuilt in O(n) on the first pick after a
+    membership or weight change, not on every update.
+    """
+    def __init__(self):
+        super().__init__()
+        self._weights: Dict[str, int] = {}
+        self._prob: List[float] = []
+        self._alias: List[int] = []
+        self._dirty = True
+
+    @staticmethod
+    def weight(proxy: Dict[str, Any]) -> int:
+        return max(1, health.score(proxy))
+
+    def _added(self, url: str, proxy: Dict[str, Any]):
+        self._weights[url] = self.weight(proxy)
+        self._dirty = True
+
+    def _removed(self, url: str):
+        self._weights.pop(url, None)
+        self._dirty = True
+
+    def _changed(self, url: str, proxy: Dict[str, Any]):
+        weight = self.weight(proxy)
+        if weight != self._weights.get(url):
+            self._weights[url] = weight
+            self._dirty = True
+
+    def _rebuild(self):
+        n = len(self._members)
+        weights = [self._weights[proxy_url(p)] for p in self._members]
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        small = [i for i, s in enumerate(scaled) if s < 1.0]
+        large = [i for i, s in enumerate(scaled) if s >= 1.0]
+        prob, alias = [1.0] * n, list(range(n))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s], alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Whatever is left is 1.0 up to rounding
+        self._prob, self._alias = prob, alias
+        self._dirty = False
+
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not self._members:
+            return None
+        if self._dirty:
+            self._rebuild()
+        i = random.randrange(len(self._members))
+        return self._members[i if random.random() < self._prob[i] else self._alias[i]]
+
+class LeastOutstandingSelector(Selector):
+    """
+    The member with the fewest requests in flight. Members sit in buckets
+    by outstanding count and the lowest non-empty count is tracked, so
+    picking and releasing are O(1); ties rotate because a member moves to
+    the back of its new bucket.
+    """
+    def __init__(self):
+        super().__init__()
+        self._counts: Dict[str, int] = {}
+        self._buckets: Dict[int, Dict[str, None]] = {}
+        self._min = 0
+
+    def outstanding(self, proxy: Dict[str, Any]) -> int:
+        return self._counts.get(proxy_url(proxy), 0)
+
+    def _added(self, url: str, proxy: Dict[str, Any]):
+        self._counts[url] = 0
+        self._buckets.setdefault(0, {})[url] = None
+        self._min = 0
+
+    def _removed(self, url: str):
+        count = self._counts.pop(url)
+        bucket = self._buckets[count]
+        del bucket[url]
+        if not bucket:
+            del self._buckets[count]
+            if count == self._min:
+                self._min = min(self._buckets, default=0)
+
+    def _move(self, url: str, delta: int):
+        count = self._counts[url]
+        bucket = self._buckets[count]
+        del bucket[url]
+        if not bucket:
+            del self._buckets[count]
+        moved = count + delta
+        self._counts[url] = moved
+        self._buckets.setdefault(moved, {})[url] = None
+        if moved < self._min or count not in self._buckets and count == self._min:
+            self._min = moved
+
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not self._members:
+            return None
+        url = next(iter(self._buckets[self._min]))
+        self._move(url, 1)
+        return self._members[self._index[url]]
+
+    def hold(self, proxy: Dict[str, Any]):
+        url = proxy_url(proxy)
+        if url in self._counts:
+            self._move(url, 1)
+
+    def release(self, proxy: Dict[str, Any]):
+        url = proxy_url(proxy)
+        if self._counts.get(url, 0) > 0:  # Removed from the pool meanwhile, or never counted
+            self._move(url, -1)
+
+class StickySelector(Selector):
+    """
+    The same upstream for the same session key. New keys are placed on a
+    consistent-hash ring (`replicas` virtual nodes per member), so removing
+    a member only remaps the sessions it held and separate gateway
+    processes agree on the placement; placements are then remembered in
+    an LRU of `max_sessions` keys so repeat lookups are a dict hit and
+    sessions do not move when members join. Without a key it is random.
+    """
+    keyed = True
+
+    def __init__(self, replicas: int = 64, max_sessions: int = 10000):
+        super().__init__()
+        self.replicas = replicas
+        self.max_sessions = max_sessions
+        self._ring: List[Tuple[int, str]] = []
+        self._sessions: "OrderedDict[str, str]" = OrderedDict()
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def _added(self, url: str, proxy: Dict[str, Any]):
+        for replica in range(self.replicas):
+            bisect.insort(self._ring, (self._hash(f"{url}#{replica}"), url))
+
+    def _removed(self, url: str):
+        self._ring = [point for point in self._ring if point[1] != url]
+
+    def select(self, key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if not self._members:
+            return None
+        if key is None:
+            return random.choice(self._members)
+        url = self._sessions.get(key)
+        if url in self._index:
+            self._sessions.move_to_end(key)
+            return self._members[self._index[url]]
+        point = bisect.bisect(self._ring, (self._hash(key),)) % len(self._ring)
+        url = self._ring[point][1]
+        self._sessions[key] = url
+        if len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return self._members[self._index[url]]
+
+STRATEGIES = {
+    "random": RandomSelector,
+    "round_robin": RoundRobinSelector,
+    "weighted": WeightedSelector,
+    "least_outstanding": LeastOutstandingSelector,
+    "sticky": StickySelector,
+}
+
+def make_selector(strategy: Optional[str] = None) -> Selector:
+    """Selector for `strategy`, by default settings.rotation.strategy."""
+    cfg = settings.rotation
+    strategy = strategy or cfg.strategy
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown rotation strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}")
+    if strategy == "sticky":
+        return StickySelector(cfg.sticky_replicas, cfg.sticky_sessions)
+    return STRATEGIES[strategy]()
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from proxy_manager.core import health
+from proxy_manager.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def pool_tier(response_time_ms: Optional[int]) -> str:
+    """Same fast/medium/slow split as scripts/segment_pool.py."""
+    latency = response_time_ms if response_time_ms is not None else 10**6
+    if latency < 1000:
+        return "fast"
+    if latency < 3000:
+        return "medium"
+    return "slow"
+
+def volatility(proxy: Dict[str, Any]) -> float:
+    """
+    0.0 for a proxy that always passes (or always fails), 1.0 for one that
+    flips half the time: 4 * p * (1 - p) over its EWMA success rate, or the
+    lifetime counters for rows the health model has not seen yet.
+    """
+    if proxy.get("ewma_success") is not None:
+        p = health.success_rate(proxy)
+        return 4 * p * (1 - p)
+    ok = proxy.get("success_count") or 0
+    fail = proxy.get("fail_count") or 0
+    if ok + fail == 0:
+        return 1.0  # Nothing known yet, treat as unstable
+    p = fail / (ok + fail)
+    return 4 * p * (1 - p)
+
+def check_interval(proxy: Dict[str, Any]) -> float:
+    """
+    Seconds until `proxy` should be re-checked. Starts from its pool tier's
+    interval, stretches it for healthy proxies, shortens it for proxies that
+    are sliding towards cleanup (so they are confirmed dead quickly) and for
+    volatile ones, then clamps and jitters it so one import does not come
+    due all at the same second. Quarantined proxies use the backoff instead.
+    """
+    cfg = settings.scheduler
+    if proxy.get("state") == health.QUARANTINE:
+        return health.quarantine_backoff(proxy) * random.uniform(1.0 - cfg.jitter, 1.0 + cfg.jitter)
+    interval = cfg.tier_intervals.get(pool_tier(proxy.get("response_time_ms")), cfg.max_interval)
+
+    score = proxy.get("health_score")
+    score = 100 if score is None else score
+    if score >= 80:
+        interval *= 1.5
+    elif score < 40:
+        interval *= 0.5
+
+    interval *= 1.0 - 0.5 * volatility(proxy)
+    interval = min(cfg.max_interval, max(cfg.min_interval, interval))
+    return interval * random.uniform(1.0 - cfg.jitter, 1.0 + cfg.jitter)
+
+def next_check_at(proxy: Dict[str, Any], now: Optional[float] = None) -> int:
+    """Unix time of the next re-check, stored in proxies.next_check_at."""
+    return int((now if now is not None else time.time()) + check_interval(proxy))
+
+class ReverifyScheduler:
+    """
+    Feeds due proxies to a fixed pool of workers. A producer pages through
+    the next_check_at index with a keyset cursor and pushes rows into a
+    bounded queue, so workers stay busy without ever loading the whole
+    table; when nothing is due it sleeps until the earliest next_check_at.
+    The worker callback is responsible for writing the new next_check_at;
+    when it raises, the row is postponed with a backoff that doubles per
+    consecutive error so it does not come straight back around.
+    With a ShardCoordinator, only the hash partitions it owns are streamed.
+    """
+    def __init__(self, storage, check: Callable[[Dict[str, Any]], Awaitable[None]],
+                 workers: Optional[int] = None, page_size: Optional[int] = None, shards=None):
+        cfg = settings.scheduler
+        self.storage = storage
+        self.check = check
+        self.workers = workers or cfg.workers
+        self.page_size = page_size or cfg.page_size
+        self.idle_poll = cfg.idle_poll
+        self.shards = shards
+        self.in_flight = set()
+        self._errors: Dict[tuple, int] = {}  # (ip, port) -> consecutive failed checks
+        self.running = False
+        self.stats = {"checked": 0, "errors": 0, "max_lag_s": 0.0, "sweeps": 0}
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            proxy = await queue.get()
+            try:
+                if proxy is None:
+                    return
+                await self.check(proxy)
+                self.stats["checked"] += 1
+                self._errors.pop((proxy["ip"], proxy["port"]), None)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"Re-check of {proxy['ip']}:{proxy['port']} failed: {e}")
+                await self._postpone(proxy)
+            finally:
+                if proxy is not None:
+                    self.in_flight.discard((proxy["ip"], proxy["port"]))
+                queue.task_done()
+
+    async def _postpone(self, proxy: Dict[str, Any]):
+        """Pushes a proxy whose check raised past its normal interval, doubling per consecutive error."""
+        key = (proxy["ip"], proxy["port"])
+        errors = self._errors[key] = self._errors.get(key, 0) + 1
+        backoff = min(settings.scheduler.max_interval, settings.scheduler.min_interval * 2 ** (errors - 1))
+        try:
+            await self.storage.postpone_check(proxy["ip"], proxy["port"], next_check_at(proxy) + backoff)
+        except Exception as e:
+            logger.error(f"Could not postpone {proxy['ip']}:{proxy['port']}: {e}")
+
+    async def _feed(self, queue: asyncio.Queue, due_only: bool) -> int:
+        """Streams one pass over the due (or all) proxies into the queue. Returns rows queued."""
+        queued = 0
+        now = int(time.time())
+        shard = self.shards.filter() if self.shards is not None else None
+        async for proxy in self.storage.iter_proxies(due_before=now if due_only else None, page_size=self.page_size,
+                                                     shard=shard):
+            key = (proxy["ip"], proxy["port"])
+            if key in self.in_flight:
+                continue
+            if due_only and proxy.get("next_check_at"):
+                self.stats["max_lag_s"] = max(self.stats["max_lag_s"], now - proxy["next_check_at"])
+            self.in_flight.add(key)
+            await queue.put(proxy)  # Blocks while workers are saturated
+            queued += 1
+        self.stats["sweeps"] += 1
+        return queued
+
+    async def run_once(self, due_only: bool = True) -> int:
+        """One pass over the table, waiting for every queued check to finish."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_size)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            queued = await self._feed(queue, due_only)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return queued
+
+    async def run(self):
+        """Keeps re-checking proxies as they come due until stop() is called."""
+        self.running = True
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_size)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        logger.info(f"Re-verification scheduler started with {self.workers} workers.")
+        try:
+            while self.running:
+                queued = await self._feed(queue, due_only=True)
+                if queued:
+                    continue
+                # Nothing due right now: sleep until the next proxy comes due
+                earliest = await self.storage.next_due_time(
+                    shard=self.shards.filter() if self.shards is not None else None)
+                wait = self.idle_poll if earliest is None else earliest - time.time()
+                await asyncio.sleep(min(self.idle_poll, max(1.0, wait)))
+        finally:
+            self.running = False
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from proxy_manager.core.config import settings
+from proxy_manager.core.ranges import ip_to_int
+
+logger = logging.getLogger(__name__)
+
+def partition_of(ip: str, port: int, partitions: int) -> int:
+    """Hash partition of a proxy; same key as storage.shard_clause()."""
+    return ((ip_to_int(ip) or 0) * 65536 + port) % partitions
+
+def _weight(worker_id: str, partition: int) -> int:
+    digest = hashlib.blake2b(f"{worker_id}:{partition}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+def assign_partitions(workers: List[str], partitions: int) -> Dict[str, Set[int]]:
+    """
+    Rendezvous hashing: every partition goes to the live worker with the
+    highest hash weight for it. When a worker joins or dies only the
+    partitions it gains or held move; every worker computes the same
+    answer from the same lease list, so no assignment is ever stored.
+    """
+    owned: Dict[str, Set[int]] = {worker: set() for worker in workers}
+    if not workers:
+        return owned
+    for partition in range(partitions):
+        owner = max(workers, key=lambda worker: _weight(worker, partition))
+        owned[owner].add(partition)
+    return owned
+
+class ShardCoordinator:
+    """
+    Membership of one sharded monitor process. Leases live in the shared
+    database's worker_leases table: each worker renews its own every
+    heartbeat_s along with its completion stats, treats leases younger than
+    lease_ttl as live, and re-derives which partitions it owns from them.
+    The live worker with the smallest id is the leader and runs the
+    table-wide maintenance (cleanup, history rollups).
+    """
+    def __init__(self, storage, worker_id: Optional[str] = None, partitions: Optional[int] = None):
+        cfg = settings.sharding
+        self.storage = storage
+        self.host = socket.gethostname()
+        self.worker_id = worker_id or f"{self.host}-{os.getpid()}"
+        self.partitions = partitions or cfg.partitions
+        self.lease_ttl = cfg.lease_ttl
+        self.heartbeat_s = cfg.heartbeat_s
+        self.owned: FrozenSet[int] = frozenset()
+        self.workers: List[str] = []
+        self.is_leader = False
+        self.running = False
+        self._last_beat: Optional[Tuple[float, int]] = None  # (time, checked) at the previous heartbeat
+
+    def filter(self) -> Tuple[int, FrozenSet[int]]:
+        """The (partitions, owned) shard argument for storage.iter_proxies()."""
+        return self.partitions, self.owned
+
+    def _rate(self, checked: int, now: float) -> float:
+        """Checks completed per second since the previous heartbeat."""
+        last = self._last_beat
+        self._last_beat = (now, checked)
+        if last is None or now <= last[0]:
+            return 0.0
+        return round(max(0, checked - last[1]) / (now - last[0]), 2)
+
+    async def heartbeat(self, stats: Optional[Dict[str, Any]] = None, now: Optional[float] = None) -> bool:
+        """Renews the lease and recomputes ownership. Returns True when the assignment changed."""
+        now = time.time() if now is None else now
+        stats = dict(stats or {})
+        stats["rate"] = self._rate(stats.get("checked", 0), now)
+        await self.storage.heartbeat_worker(self.worker_id, self.host, os.getpid(), len(self.owned), stats, int(now))
+
+        live = [row["worker_id"] for row in await self.storage.get_workers(live_within=self.lease_ttl, now=int(now))]
+        if self.worker_id not in live:
+            live.append(self.worker_id)
+        live.sort()
+        owned = frozenset(assign_partitions(live, self.partitions)[self.worker_id])
+        changed = owned != self.owned or live != self.workers
+        if changed:
+            gone = set(self.workers) - set(live)
+            if self.workers:
+                logger.info(f"Shard rebalance: {len(live)} live workers"
+                            f"{f', lost {sorted(gone)}' if gone else ''}; {self.worker_id} owns {len(owned)}/{self.partitions} partitions.")
+            self.owned = owned
+            self.workers = live
+        self.is_leader = live[0] == self.worker_id
+        return changed
+
+    async def run(self, stats: Callable[[], Dict[str, Any]]):
+        """Heartbeats until stop(); `stats` supplies the scheduler counters to publish."""
+        self.running = True
+        while self.running:
+            try:
+                await self.heartbeat(stats())
+            except Exception as e:
+                # A missed beat only matters after lease_ttl; keep trying
+                logger.error(f"Shard heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_s)
+
+    def stop(self):
+        self.running = False
+
+    async def release(self):
+        """Gives up the lease so the other workers take over its partitions on their next beat."""
+        self.stop()
+        self.owned = frozenset()
+        await self.storage.release_worker(self.worker_id, expired_before=int(time.time()) - 10 * self.lease_ttl)
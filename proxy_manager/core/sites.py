@@ -0,0 +1,166 @@
+import asyncio
+import calendar
+import logging
+import time
+from typing import Dict, List, Optional, Any, Tuple
+from urllib.parse import urlparse
+from proxy_manager.core.config import settings, SiteTarget
+from proxy_manager.core.storage import StorageManager
+
+logger = logging.getLogger(__name__)
+
+class SiteCompatChecker:
+    """
+    Tracks which proxies actually work against the destinations we care about.
+    A proxy that passes the generic validator can still be blocked by a specific
+    site (ISP or datacenter ranges banned, captcha walls), so verdicts are kept
+    per (proxy, site) and cached in storage for `sites.ttl` seconds.
+    """
+    def __init__(self, storage: Optional[StorageManager] = None, targets: Optional[List[SiteTarget]] = None):
+        self.storage = storage or StorageManager()
+        self.targets = targets if targets is not None else settings.sites.targets
+        self.ttl = settings.sites.ttl
+        self.timeout = settings.sites.timeout
+        self.batch_size = settings.sites.batch_size
+        self.sem = asyncio.Semaphore(settings.sites.max_concurrent)
+        # site name -> {(ip, port): (ok, latency_ms, checked_at)}
+        self._verdicts: Dict[str, Dict[Tuple[str, int], Tuple[bool, int, float]]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._in_flight: set = set()
+        self._tasks: set = set()  # Background probes; the loop only keeps weak references to tasks
+
+    def site_for_host(self, host: Optional[str]) -> Optional[SiteTarget]:
+        """Maps a destination host (e.g. m.tokopedia.com) to a configured site."""
+        if not host:
+            return None
+        host = host.lower().rstrip(".")
+        for target in self.targets:
+            site_host = (urlparse(target.url).hostname or "").lower()
+            if site_host.startswith("www."):
+                site_host = site_host[4:]
+            if host == site_host or host.endswith("." + site_host):
+                return target
+        return None
+
+    async def probe(self, proxy: Dict[str, Any], site: SiteTarget) -> Dict[str, Any]:
+        """Fetches the site through the proxy and returns a verdict row."""
+        proxy_url = f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}"
+        verdict = {
+            "ip": proxy["ip"],
+            "port": proxy["port"],
+            "site": site.name,
+            "ok": 0,
+            "status_code": 0,
+            "latency_ms": 0,
+        }
+        try:
+            from curl_cffi.requests import AsyncSession
+            proxies = {"http": proxy_url, "https": proxy_url}
+            async with AsyncSession(proxies=proxies, impersonate="chrome120", timeout=self.timeout) as session:
+                t1 = time.time()
+                response = await session.get(site.url)
+                verdict["latency_ms"] = int((time.time() - t1) * 1000)
+                verdict["status_code"] = response.status_code
+                if response.status_code in site.expect_status:
+                    body = response.text if site.block_markers else ""
+                    if not any(marker in body for marker in site.block_markers):
+                        verdict["ok"] = 1
+        except Exception:
+            pass
+        return verdict
+
+    async def check_batch(self, proxies: List[Dict[str, Any]], site: SiteTarget) -> List[Dict[str, Any]]:
+        """Probes proxies against one site in bounded batches and persists the verdicts."""
+        results = []
+
+        async def sem_probe(proxy):
+            async with self.sem:
+                return await self.probe(proxy, site)
+
+        for i in range(0, len(proxies), self.batch_size):
+            batch = proxies[i:i + self.batch_size]
+            verdicts = await asyncio.gather(*[sem_probe(p) for p in batch])
+            await self.storage.save_site_verdicts(verdicts)
+            now = time.time()
+            cache = self._verdicts.setdefault(site.name, {})
+            for v in verdicts:
+                cache[(v["ip"], v["port"])] = (bool(v["ok"]), v["latency_ms"], now)
+            results.extend(verdicts)
+
+        ok = sum(1 for v in results if v["ok"])
+        logger.info(f"Site check [{site.name}]: {ok}/{len(results)} proxies passed.")
+        return results
+
+    async def _load(self, site: SiteTarget):
+        """Refreshes the in-memory verdict cache for a site from storage."""
+        now = time.time()
+        if now - self._loaded_at.get(site.name, 0) < self.ttl / 2:
+            return
+        rows = await self.storage.get_site_verdicts(site.name, self.ttl)
+        cache = self._verdicts.setdefault(site.name, {})
+        for row in rows:
+            # checked_at is SQLite CURRENT_TIMESTAMP (UTC, 'YYYY-MM-DD HH:MM:SS')
+            checked = calendar.timegm(time.strptime(row["checked_at"], "%Y-%m-%d %H:%M:%S"))
+            cache[(row["ip"], row["port"])] = (bool(row["ok"]), row["latency_ms"] or 0, checked)
+        self._loaded_at[site.name] = now
+
+    def _fresh(self, site: SiteTarget, proxy: Dict[str, Any]) -> Optional[Tuple[bool, int, float]]:
+        entry = self._verdicts.get(site.name, {}).get((proxy["ip"], proxy["port"]))
+        if entry and time.time() - entry[2] < self.ttl:
+            return entry
+        return None
+
+    async def _check_unknown(self, proxies: List[Dict[str, Any]], site: SiteTarget):
+        try:
+            await self.check_batch(proxies, site)
+        except Exception as e:
+            logger.error(f"Site check [{site.name}] failed: {e}")
+        finally:
+            # Also on cancellation, so these proxies are probed again next time
+            for p in proxies:
+                self._in_flight.discard((p["ip"], p["port"], site.name))
+
+    async def good_pool(self, proxies: List[Dict[str, Any]], site: SiteTarget) -> List[Dict[str, Any]]:
+        """
+        Returns the subset of `proxies` known to work for `site`, fastest first.
+        Proxies without a fresh verdict are probed lazily in the background so
+        the caller is never blocked on site checks.
+        """
+        await self._load(site)
+        good = []
+        unknown = []
+        for proxy in proxies:
+            entry = self._fresh(site, proxy)
+            if entry is None:
+                key = (proxy["ip"], proxy["port"], site.name)
+                if key not in self._in_flight:
+                    self._in_flight.add(key)
+                    unknown.append(proxy)
+            elif entry[0]:
+                good.append((entry[1], proxy))
+
+        if unknown:
+            task = asyncio.create_task(self._check_unknown(unknown, site))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        good.sort(key=lambda item: item[0])
+        return [proxy for _, proxy in good]
+
+    async def close(self):
+        """Cancels background probes still running and waits for them to wind down."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def check_all(self, proxies: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Refreshes stale verdicts for every configured site. Returns passes per site."""
+        summary = {}
+        for site in self.targets:
+            await self._load(site)
+            stale = [p for p in proxies if self._fresh(site, p) is None]
+            if stale:
+                await self.check_batch(stale, site)
+            summary[site.name] = sum(1 for p in proxies if (self._fresh(site, p) or (False,))[0])
+        return summary
@@ -1,17 +1,579 @@
 import aiosqlite
 import asyncio
-from typing import List, Optional, Dict, Any
+import ipaddress
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Dict, Any, Tuple
 from proxy_manager.core.config import settings
+from proxy_manager.core import health
+from proxy_manager.core.ranges import ip_to_int
+from proxy_manager.core.scheduler import next_check_at
 import os
 
+logger = logging.getLogger(__name__)
+
+# Hot statements are kept as constants so the SQL text is identical on every
+# call and sqlite3's per-connection statement cache reuses the prepared form.
+SAVE_PROXY_SQL = """
+    INSERT OR REPLACE INTO proxies 
+    (ip, ip_int, port, protocol, anonymity, country, region, city, isp, response_time_ms, last_checked, health_score, success_count, fail_count, next_check_at, full_checked_at, last_ok,
+     ewma_success, ewma_latency_ms, health_samples, health_updated_at, state, consecutive_ok, consecutive_fails, quarantined_at)
+    VALUES (:ip, :ip_int, :port, :protocol, :anonymity, :country, :region, :city, :isp, :response_time_ms, CURRENT_TIMESTAMP, :health_score, :success_count, :fail_count, :next_check_at, :full_checked_at, :last_ok,
+     :ewma_success, :ewma_latency_ms, :health_samples, :health_updated_at, :state, :consecutive_ok, :consecutive_fails, :quarantined_at)
+"""
+# Outcome of a check that did not produce a full validation record. The health
+# fields are absolute, so the flush computes them from the row as stored, read
+# in the same IMMEDIATE transaction (see WriteBehindQueue._merge_marks).
+MARK_CHECKED_SQL = """
+    UPDATE proxies 
+    SET health_score = :health_score, ewma_success = :ewma_success, ewma_latency_ms = :ewma_latency_ms,
+        health_samples = :health_samples, health_updated_at = :health_updated_at,
+        state = :state, consecutive_ok = :consecutive_ok, consecutive_fails = :consecutive_fails, quarantined_at = :quarantined_at,
+        success_count = success_count + :ok_count, fail_count = fail_count + :fail_count,
+        last_ok = :last_ok, last_checked = CURRENT_TIMESTAMP, next_check_at = COALESCE(:next_check_at, next_check_at)
+    WHERE ip = :ip AND port = :port
+"""
+SUBNET_INTEL_SQL = """
+    INSERT INTO subnet_intel (subnet_prefix, isp, total_found, yield_score, last_updated)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(subnet_prefix) DO UPDATE SET 
+        total_found = total_found + excluded.total_found,
+        yield_score = yield_score + excluded.yield_score,
+        last_updated = CURRENT_TIMESTAMP
+"""
+
+# Check history: one append-only row per check, keyed by proxy_id = ip_int * 65536 + port
+OUTCOME_OK = 0
+OUTCOME_TIMEOUT = 1
+OUTCOME_REFUSED = 2
+OUTCOME_PROTOCOL = 3  # Connected but the handshake/validation was rejected
+OUTCOME_FAILED = 4  # Any other failure
+HOUR = 3600
+DAY = 86400
+
+INSERT_HISTORY_SQL = "INSERT INTO check_history (ts, proxy_id, outcome, latency_ms) VALUES (?, ?, ?, ?)"
+ROLLUP_UPSERT = """
+    ON CONFLICT (period, bucket, proxy_id) DO UPDATE SET
+        checks = checks + excluded.checks,
+        ok = ok + excluded.ok,
+        latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count,
+        latency_max = MAX(latency_max, excluded.latency_max)
+"""
+ROLLUP_HOURS_SQL = """
+    INSERT INTO check_rollups (period, bucket, proxy_id, checks, ok, latency_sum, latency_count, latency_max)
+    SELECT 3600, ts / 3600 * 3600, proxy_id, COUNT(*), SUM(outcome = 0),
+           TOTAL(latency_ms), COUNT(latency_ms), MAX(COALESCE(latency_ms, 0))
+    FROM check_history WHERE rowid > ? AND rowid <= ?
+    GROUP BY 2, proxy_id
+""" + ROLLUP_UPSERT
+ROLLUP_DAYS_SQL = """
+    INSERT INTO check_rollups (period, bucket, proxy_id, checks, ok, latency_sum, latency_count, latency_max)
+    SELECT 86400, bucket / 86400 * 86400, proxy_id, SUM(checks), SUM(ok),
+           SUM(latency_sum), SUM(latency_count), MAX(latency_max)
+    FROM check_rollups WHERE period = 3600 AND bucket >= ? AND bucket < ?
+    GROUP BY 2, proxy_id
+""" + ROLLUP_UPSERT
+
+def proxy_id(ip: str, port: int) -> Optional[int]:
+    """Compact integer key for an IPv4 proxy, None for anything else."""
+    value = ip_to_int(ip)
+    return None if value is None else value * 65536 + port
+
+async def _migrate_ip_int(db: aiosqlite.Connection):
+    """Adds proxies.ip_int (the address as an unsigned 32-bit integer) and backfills it."""
+    async with db.execute("PRAGMA table_info(proxies)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if 'ip_int' not in columns:
+        await db.execute("ALTER TABLE proxies ADD COLUMN ip_int INTEGER")
+
+    async with db.execute("SELECT DISTINCT ip FROM proxies WHERE ip_int IS NULL") as cursor:
+        ips = [row[0] for row in await cursor.fetchall()]
+    values = [(ip_to_int(ip), ip) for ip in ips]
+    await db.executemany("UPDATE proxies SET ip_int = ? WHERE ip = ?", [v for v in values if v[0] is not None])
+
+# Indexes follow the access paths actually used by get_proxies, the lifecycle,
+# generate_report.py, export_proxies.py and assess_proxies.py. The partial ones
+# only apply to queries that literally say "health_score > 0".
+PROXY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_proxies_speed ON proxies (response_time_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_protocol_speed ON proxies (protocol, response_time_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_health ON proxies (health_score)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_last_checked ON proxies (last_checked)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_country ON proxies (country, health_score)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_ip_int ON proxies (ip_int, port)",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_live_speed ON proxies (response_time_ms) WHERE health_score > 0",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_live_protocol ON proxies (protocol) WHERE health_score > 0",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_live_anonymity ON proxies (anonymity) WHERE health_score > 0",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_live_isp ON proxies (isp) WHERE health_score > 0",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_live_port ON proxies (port) WHERE health_score > 0",
+]
+
+async def _migrate_next_check_at(db: aiosqlite.Connection):
+    """Adds proxies.next_check_at (unix seconds) for the re-verification scheduler; existing rows are due now."""
+    async with db.execute("PRAGMA table_info(proxies)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if 'next_check_at' not in columns:
+        await db.execute("ALTER TABLE proxies ADD COLUMN next_check_at INTEGER NOT NULL DEFAULT 0")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_proxies_due ON proxies (next_check_at, ip, port)")
+
+async def _migrate_check_tiers(db: aiosqlite.Connection):
+    """Tracks when a proxy last passed the full validation and whether its last check passed."""
+    async with db.execute("PRAGMA table_info(proxies)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    if 'full_checked_at' not in columns:
+        await db.execute("ALTER TABLE proxies ADD COLUMN full_checked_at INTEGER NOT NULL DEFAULT 0")
+    if 'last_ok' not in columns:
+        await db.execute("ALTER TABLE proxies ADD COLUMN last_ok INTEGER NOT NULL DEFAULT 1")
+
+CHECK_HISTORY_SCHEMA = [
+    # Rows are appended in time order, so rowid order is time order: rollups
+    # and retention work on rowid ranges instead of needing an index on ts.
+    """CREATE TABLE IF NOT EXISTS check_history (
+        ts INTEGER NOT NULL,
+        proxy_id INTEGER NOT NULL,
+        outcome INTEGER NOT NULL,
+        latency_ms INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_check_history_proxy ON check_history (proxy_id, ts)",
+    """CREATE TABLE IF NOT EXISTS check_rollups (
+        period INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        proxy_id INTEGER NOT NULL,
+        checks INTEGER NOT NULL,
+        ok INTEGER NOT NULL,
+        latency_sum INTEGER NOT NULL,
+        latency_count INTEGER NOT NULL,
+        latency_max INTEGER NOT NULL,
+        PRIMARY KEY (period, bucket, proxy_id)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS idx_check_rollups_proxy ON check_rollups (proxy_id, period, bucket)",
+    # Watermarks: last raw rowid rolled into hours, first day not yet rolled into days
+    """CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )""",
+]
+
+async def _migrate_health_model(db: aiosqlite.Connection):
+    """Adds the EWMA health state and seeds it from the lifetime success/fail counters."""
+    async with db.execute("PRAGMA table_info(proxies)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    for column, ddl in (("ewma_success", "REAL"), ("ewma_latency_ms", "REAL"),
+                        ("health_samples", "REAL NOT NULL DEFAULT 0"), ("health_updated_at", "INTEGER NOT NULL DEFAULT 0")):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE proxies ADD COLUMN {column} {ddl}")
+
+    async with db.execute("SELECT ip, port, success_count, fail_count, response_time_ms FROM proxies") as cursor:
+        rows = [dict(zip(("ip", "port", "success_count", "fail_count", "response_time_ms"), row)) for row in await cursor.fetchall()]
+    for row in rows:
+        health.seed_from_counts(row)
+    await db.executemany(
+        "UPDATE proxies SET ewma_success = :ewma_success, ewma_latency_ms = :ewma_latency_ms, health_samples = :health_samples, "
+        "health_updated_at = :health_updated_at, health_score = :health_score WHERE ip = :ip AND port = :port",
+        rows,
+    )
+
+QUARANTINE_SCHEMA = [
+    "ALTER TABLE proxies ADD COLUMN state TEXT NOT NULL DEFAULT 'active'",
+    "ALTER TABLE proxies ADD COLUMN consecutive_ok INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE proxies ADD COLUMN consecutive_fails INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE proxies ADD COLUMN quarantined_at INTEGER",
+    "CREATE INDEX IF NOT EXISTS idx_proxies_quarantine ON proxies (quarantined_at) WHERE state = 'quarantine'",
+    # Proxies that stayed dead for archive_after_days; kept so they can be retried without a rescan
+    """CREATE TABLE IF NOT EXISTS proxies_archive (
+        ip TEXT,
+        port INTEGER,
+        ip_int INTEGER,
+        protocol TEXT,
+        anonymity TEXT,
+        country TEXT,
+        isp TEXT,
+        success_count INTEGER,
+        fail_count INTEGER,
+        quarantined_at INTEGER,
+        archived_at INTEGER,
+        PRIMARY KEY (ip, port)
+    )""",
+]
+
+# One row per sharded monitor process; a lease is live while heartbeat_at is
+# within sharding.lease_ttl (see core/shards.py).
+WORKER_LEASES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS worker_leases (
+        worker_id TEXT PRIMARY KEY,
+        host TEXT,
+        pid INTEGER,
+        started_at INTEGER,
+        heartbeat_at INTEGER,
+        partitions INTEGER DEFAULT 0,
+        checked INTEGER DEFAULT 0,
+        errors INTEGER DEFAULT 0,
+        rate REAL DEFAULT 0,
+        max_lag_s REAL DEFAULT 0
+    )""",
+]
+
+def shard_clause(shard) -> str:
+    """
+    SQL filter for a (partitions, owned) hash partition of proxies, on the
+    same key as proxy_id(). Only integers are interpolated.
+    """
+    partitions, owned = shard
+    members = ",".join(str(int(p)) for p in sorted(owned)) or "NULL"
+    return f"((COALESCE(ip_int, 0) * 65536 + port) % {int(partitions)}) IN ({members})"
+
+# Ordered schema migrations, tracked in PRAGMA user_version. Each entry is
+# (version, description, list of SQL statements or an async callable(db)).
+MIGRATIONS = [
+    (1, "integer IP column", _migrate_ip_int),
+    (2, "query indexes on proxies", PROXY_INDEXES + ["ANALYZE proxies"]),
+    (3, "re-verification due times", _migrate_next_check_at),
+    (4, "tiered re-check state", _migrate_check_tiers),
+    (5, "check history and rollups", CHECK_HISTORY_SCHEMA),
+    (6, "EWMA health model", _migrate_health_model),
+    (7, "quarantine state and archive", QUARANTINE_SCHEMA),
+    (8, "sharded monitor leases", WORKER_LEASES_SCHEMA),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+class WriteBehindQueue:
+    """
+    Buffers proxy writes in memory, coalesced per (ip, port), and flushes
+    them with executemany in one transaction every `flush_rows` rows or
+    `flush_interval_ms` milliseconds, whichever comes first. A later
+    save_proxy supersedes earlier pending writes for the same proxy, and
+    repeated check outcomes for one proxy collapse into a single UPDATE.
+    """
+    def __init__(self, storage: "StorageManager", flush_rows: int, flush_interval_ms: int):
+        self.storage = storage
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.saves: Dict[tuple, Dict[str, Any]] = {}
+        self.marks: Dict[tuple, Dict[str, Any]] = {}  # key -> counters, next check and the outcomes to replay
+        self.subnets: Dict[str, List[Any]] = {}       # prefix -> [isp, found, events]
+        self.history: List[tuple] = []                # (ts, proxy_id, outcome, latency_ms), appended in order
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.stats = {"flushes": 0, "rows": 0, "last_batch": 0, "max_batch": 0,
+                      "last_flush_ms": 0.0, "max_flush_ms": 0.0, "total_flush_ms": 0.0,
+                      "errors": 0}
+
+    def __len__(self):
+        return len(self.saves) + len(self.marks) + len(self.subnets) + len(self.history)
+
+    def _ensure_task(self):
+        if not self.storage.write_behind:
+            return
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if len(self):
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Write-behind flush failed: {e}")
+
+    async def _after_enqueue(self):
+        self._ensure_task()
+        size = len(self)
+        if size >= self.flush_rows * 4:
+            # Far behind: make the producer wait for the flush (backpressure)
+            await self.flush()
+        elif size >= self.flush_rows:
+            self._wakeup.set()
+
+    def forget(self, key: tuple):
+        for pending in (self.saves, self.marks):
+            pending.pop(key, None)
+
+    async def save(self, data: Dict[str, Any]):
+        key = (data["ip"], data["port"])
+        # The replace overwrites anything queued before it
+        self.marks.pop(key, None)
+        self.saves[key] = data
+        await self._after_enqueue()
+
+    async def mark(self, key: tuple, state: Dict[str, Any], ok: bool, next_check: Optional[int] = None,
+                   latency_ms: Optional[float] = None, at: Optional[float] = None):
+        """
+        Queues a check outcome. Other processes may have moved the row on
+        since `state` was read, so the outcome itself is queued and replayed
+        onto the stored row at flush time; only a row still pending insert
+        takes `state`'s health fields as they are.
+        """
+        saved = self.saves.get(key)
+        if saved is not None:
+            # Fold into the pending row instead of queueing an UPDATE after it
+            saved.update({name: state.get(name) for name in health.HEALTH_FIELDS})
+            saved["success_count" if ok else "fail_count"] += 1
+            saved["last_ok"] = int(ok)
+            if next_check is not None:
+                saved["next_check_at"] = next_check
+            return await self._after_enqueue()
+        entry = self.marks.get(key)
+        if entry is None:
+            entry = self.marks[key] = {"ip": key[0], "port": key[1], "ok_count": 0, "fail_count": 0,
+                                       "next_check_at": None, "outcomes": []}
+        entry["outcomes"].append((ok, latency_ms, time.time() if at is None else at))
+        entry["ok_count" if ok else "fail_count"] += 1
+        entry["last_ok"] = int(ok)
+        if next_check is not None:
+            entry["next_check_at"] = next_check
+        await self._after_enqueue()
+
+    async def subnet(self, prefix: str, isp: str, found: int):
+        entry = self.subnets.get(prefix)
+        if entry is None:
+            self.subnets[prefix] = [isp, found, 1]
+        else:
+            entry[1] += found
+            entry[2] += 1
+        await self._after_enqueue()
+
+    async def check(self, row: tuple):
+        self.history.append(row)
+        await self._after_enqueue()
+
+    async def flush(self):
+        """Writes everything pending in one transaction."""
+        async with self._flush_lock:
+            saves, self.saves = self.saves, {}
+            marks, self.marks = self.marks, {}
+            subnets, self.subnets = self.subnets, {}
+            history, self.history = self.history, []
+            batch = len(saves) + len(marks) + len(subnets) + len(history)
+            if not batch:
+                return
+
+            t0 = time.perf_counter()
+            try:
+                async with self.storage._write() as db:
+                    if marks and not db.in_transaction:
+                        # Hold the write lock from the read to the UPDATE so no other process slips in between
+                        await db.execute("BEGIN IMMEDIATE")
+                    if saves:
+                        await db.executemany(SAVE_PROXY_SQL, list(saves.values()))
+                        # A rediscovered proxy leaves the archive
+                        await db.executemany("DELETE FROM proxies_archive WHERE ip = ? AND port = ?", list(saves))
+                    if marks:
+                        await db.executemany(MARK_CHECKED_SQL, await self._merge_marks(db, marks))
+                    if subnets:
+                        await db.executemany(SUBNET_INTEL_SQL, [
+                            (prefix, isp, found, float(events)) for prefix, (isp, found, events) in subnets.items()
+                        ])
+                    if history:
+                        await db.executemany(INSERT_HISTORY_SQL, history)
+                    await db.commit()
+            except Exception:
+                self.stats["errors"] += 1
+                self._requeue(saves, marks, subnets)
+                self.history[:0] = history
+                raise
+
+            elapsed = (time.perf_counter() - t0) * 1000
+            st = self.stats
+            st["flushes"] += 1
+            st["rows"] += batch
+            st["last_batch"] = batch
+            st["max_batch"] = max(st["max_batch"], batch)
+            st["last_flush_ms"] = round(elapsed, 2)
+            st["max_flush_ms"] = round(max(st["max_flush_ms"], elapsed), 2)
+            st["total_flush_ms"] += elapsed
+
+    async def _merge_marks(self, db, marks: Dict[tuple, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        MARK_CHECKED_SQL parameters: each mark's outcomes replayed through the
+        health model onto the stored row, so health written meanwhile by
+        other processes is built on rather than overwritten. Rows deleted
+        meanwhile are dropped.
+        """
+        columns = ", ".join(health.HEALTH_FIELDS)
+        keys = list(marks)
+        stored = {}
+        for i in range(0, len(keys), 400):
+            chunk = keys[i:i + 400]
+            where = " OR ".join(["(ip = ? AND port = ?)"] * len(chunk))
+            params = [value for key in chunk for value in key]
+            async with db.execute(f"SELECT ip, port, {columns} FROM proxies WHERE {where}", params) as cursor:
+                for row in await cursor.fetchall():
+                    stored[(row["ip"], row["port"])] = dict(row)
+        merged = []
+        for key, mark in marks.items():
+            row = stored.get(key)
+            if row is None:
+                continue
+            for ok, latency_ms, at in mark["outcomes"]:
+                # Never move health_updated_at backwards past a newer write
+                health.observe(row, ok, latency_ms, now=max(at, row.get("health_updated_at") or 0))
+            params = {name: row[name] for name in health.HEALTH_FIELDS}
+            params.update({name: mark[name] for name in ("ip", "port", "ok_count", "fail_count", "last_ok",
+                                                         "next_check_at")})
+            merged.append(params)
+        return merged
+
+    def _requeue(self, saves, marks, subnets):
+        """Puts a failed batch back underneath anything queued since."""
+        for key, data in saves.items():
+            self.saves.setdefault(key, data)
+        for key, mark in marks.items():
+            if key in self.saves:
+                continue
+            newer = self.marks.get(key)
+            if newer is None:
+                self.marks[key] = mark
+            else:
+                newer["ok_count"] += mark["ok_count"]
+                newer["fail_count"] += mark["fail_count"]
+                newer["outcomes"][:0] = mark["outcomes"]
+                if newer["next_check_at"] is None:
+                    newer["next_check_at"] = mark["next_check_at"]
+        for prefix, (isp, found, events) in subnets.items():
+            newer = self.subnets.setdefault(prefix, [isp, 0, 0])
+            newer[1] += found
+            newer[2] += events
+
+    def metrics(self) -> Dict[str, Any]:
+        st = dict(self.stats)
+        st["pending"] = len(self)
+        st["avg_batch"] = round(st["rows"] / st["flushes"], 1) if st["flushes"] else 0
+        st["avg_flush_ms"] = round(st["total_flush_ms"] / st["flushes"], 2) if st["flushes"] else 0
+        st["total_flush_ms"] = round(st["total_flush_ms"], 2)
+        return st
+
+    async def stop(self):
+        """Stops the background flusher and writes whatever is left."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        await self.flush()
+
 class StorageManager:
-    def __init__(self, db_path: str = settings.database.path):
+    """
+    Owns one writer connection and a small pool of reader connections to the
+    SQLite database, opened lazily in WAL mode and kept for the lifetime of
+    the manager. Share one instance between components and close it when
+    done (or use it as an async context manager).
+    """
+    def __init__(self, db_path: str = settings.database.path, readers: Optional[int] = None):
         self.db_path = db_path
+        self.num_readers = readers if readers is not None else settings.database.readers
         # Ensure data directory exists
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[aiosqlite.Connection] = []
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        cfg = settings.database
+        self.write_behind = cfg.write_behind
+        self.writes = WriteBehindQueue(self, cfg.flush_rows, cfg.flush_interval_ms)
+
+    async def _connect(self) -> aiosqlite.Connection:
+        cfg = settings.database
+        conn = aiosqlite.connect(self.db_path, cached_statements=256)
+        # Never let a forgotten close() keep the interpreter alive
+        conn.daemon = True
+        db = await conn
+        db.row_factory = aiosqlite.Row
+        await db.execute(f"PRAGMA busy_timeout = {int(cfg.busy_timeout_ms)}")
+        await db.execute("PRAGMA journal_mode = WAL")
+        await db.execute(f"PRAGMA synchronous = {cfg.synchronous}")
+        await db.execute(f"PRAGMA cache_size = -{int(cfg.cache_size_kb)}")
+        await db.execute(f"PRAGMA mmap_size = {int(cfg.mmap_size_mb) * 1024 * 1024}")
+        await db.execute("PRAGMA temp_store = MEMORY")
+        return db
+
+    async def open(self) -> "StorageManager":
+        """Opens the writer and reader connections. Safe to call repeatedly."""
+        if self._writer is not None:
+            return self
+        async with self._open_lock:
+            if self._writer is not None:
+                return self
+            writer = await self._connect()
+            readers: asyncio.Queue = asyncio.Queue()
+            conns = []
+            for _ in range(max(1, self.num_readers)):
+                conn = await self._connect()
+                conns.append(conn)
+                readers.put_nowait(conn)
+            self._reader_conns = conns
+            self._readers = readers
+            self._writer = writer
+        return self
+
+    async def close(self):
+        """Flushes pending writes and closes every connection. The manager reopens lazily if used again."""
+        if self._writer is not None or len(self.writes):
+            await self.writes.stop()
+            if self.writes.stats["flushes"]:
+                logger.info(f"Storage write-behind: {self.writes.metrics()}")
+        writer, self._writer = self._writer, None
+        conns, self._reader_conns = self._reader_conns, []
+        self._readers = None
+        for conn in ([writer] if writer else []) + conns:
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.warning(f"Error closing SQLite connection: {e}")
+
+    async def __aenter__(self) -> "StorageManager":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @asynccontextmanager
+    async def _write(self):
+        """Serialises writers on the single writer connection. Callers commit."""
+        await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    async def flush(self):
+        """Writes every queued change now."""
+        await self.writes.flush()
+
+    async def _queued(self):
+        """Flushes immediately when write-behind is disabled."""
+        if not self.write_behind:
+            await self.writes.flush()
+
+    @asynccontextmanager
+    async def _read(self):
+        """Borrows a reader connection; WAL lets reads run alongside the writer."""
+        await self.open()
+        if len(self.writes):
+            # Read-your-writes: make queued changes visible first
+            await self.writes.flush()
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
 
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._write() as db:
             await db.execute("""
                 CREATE TABLE IF NOT EXISTS proxies (
                     ip TEXT,
@@ -58,8 +620,53 @@ class StorageManager:
                 )
             """)
 
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS site_verdicts (
+                    ip TEXT,
+                    port INTEGER,
+                    site TEXT,
+                    ok INTEGER,
+                    status_code INTEGER,
+                    latency_ms INTEGER,
+                    checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (ip, port, site)
+                )
+            """)
+
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS geo_cache (
+                    ip TEXT PRIMARY KEY,
+                    prefix24 TEXT,
+                    country TEXT,
+                    country_name TEXT,
+                    region TEXT,
+                    city TEXT,
+                    isp TEXT,
+                    org TEXT,
+                    asn INTEGER,
+                    resolved_at INTEGER
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_geo_cache_prefix ON geo_cache (prefix24, resolved_at)")
+
+            await self._migrate(db)
             await db.commit()
 
+    async def _migrate(self, db: aiosqlite.Connection):
+        """Applies every migration newer than the database's user_version, in order."""
+        async with db.execute("PRAGMA user_version") as cursor:
+            current = (await cursor.fetchone())[0]
+        for version, description, step in MIGRATIONS:
+            if version <= current:
+                continue
+            logger.info(f"Migrating database to schema v{version}: {description}")
+            if callable(step):
+                await step(db)
+            else:
+                for sql in step:
+                    await db.execute(sql)
+            await db.execute(f"PRAGMA user_version = {version}")
+
     async def save_proxy(self, proxy_data: Dict[str, Any]):
         # Ensure new fields are present in data or set defaults
         data = proxy_data.copy()
@@ -68,14 +675,23 @@ class StorageManager:
         data.setdefault('city', '')
         data.setdefault('success_count', 1)
         data.setdefault('fail_count', 0)
-        
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT OR REPLACE INTO proxies 
-                (ip, port, protocol, anonymity, country, region, city, isp, response_time_ms, last_checked, health_score, success_count, fail_count)
-                VALUES (:ip, :port, :protocol, :anonymity, :country, :region, :city, :isp, :response_time_ms, CURRENT_TIMESTAMP, :health_score, :success_count, :fail_count)
-            """, data)
-            await db.commit()
+        data['ip_int'] = ip_to_int(data['ip'])
+        # A saved record comes from a full validation
+        data.setdefault('full_checked_at', int(time.time()))
+        data.setdefault('last_ok', 1)
+        if data.get('ewma_success') is None:
+            # First sighting: one successful observation
+            health.observe(data, True, data.get('response_time_ms'))
+        data.setdefault('state', health.ACTIVE)
+        data.setdefault('consecutive_ok', 0)
+        data.setdefault('consecutive_fails', 0)
+        data.setdefault('quarantined_at', None)
+        if data.get('next_check_at') is None:
+            data['next_check_at'] = next_check_at(data)
+
+        # Queued; written by the next write-behind flush
+        await self.writes.save(data)
+        await self._queued()
 
     async def get_proxies(self, protocol: Optional[str] = None, limit: int = 100) -> List[Any]:
         query = "SELECT * FROM proxies"
@@ -87,41 +703,410 @@ class StorageManager:
         query += " ORDER BY response_time_ms ASC LIMIT ?"
         params.append(limit)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def get_proxies_in_range(self, cidr: str, min_health: int = 1, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Proxies inside an IPv4 network (e.g. '182.253.0.0/16'), via an index range scan on ip_int."""
+        net = ipaddress.IPv4Network(cidr, strict=False)
+        query = """
+            SELECT * FROM proxies
+            WHERE ip_int BETWEEN ? AND ? AND health_score >= ?
+            ORDER BY ip_int, port LIMIT ?
+        """
+        params = (int(net.network_address), int(net.broadcast_address), min_health, limit)
+        async with self._read() as db:
+            async with db.execute(query, params) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def iter_proxies(self, due_before: Optional[int] = None, page_size: int = 500, shard=None):
+        """
+        Streams proxies in pages with a keyset cursor: each page is a short
+        indexed range read, so nothing holds a reader or the whole table in
+        memory. With `due_before`, yields only rows whose next_check_at has
+        passed, most overdue first; otherwise every row in key order.
+        With `shard` = (partitions, owned), only rows of the owned hash partitions.
+        """
+        only = f" AND {shard_clause(shard)}" if shard is not None else ""
+        if due_before is not None:
+            first = f"SELECT * FROM proxies WHERE next_check_at <= ?{only} ORDER BY next_check_at, ip, port LIMIT ?"
+            rest = (f"SELECT * FROM proxies WHERE next_check_at <= ? AND (next_check_at, ip, port) > (?, ?, ?){only} "
+                    "ORDER BY next_check_at, ip, port LIMIT ?")
+            params = (due_before,)
+        else:
+            first = f"SELECT * FROM proxies WHERE 1{only} ORDER BY ip, port LIMIT ?"
+            rest = f"SELECT * FROM proxies WHERE (ip, port) > (?, ?){only} ORDER BY ip, port LIMIT ?"
+            params = ()
+
+        last = None
+        while True:
+            async with self._read() as db:
+                if last is None:
+                    cursor = await db.execute(first, params + (page_size,))
+                else:
+                    cursor = await db.execute(rest, params + last + (page_size,))
+                rows = [dict(row) for row in await cursor.fetchall()]
+                await cursor.close()
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            tail = rows[-1]
+            last = (tail["next_check_at"], tail["ip"], tail["port"]) if due_before is not None else (tail["ip"], tail["port"])
+
+    async def next_due_time(self, shard=None) -> Optional[int]:
+        """Earliest next_check_at in the table (or in `shard`), None when it is empty."""
+        where = f" WHERE {shard_clause(shard)}" if shard is not None else ""
+        async with self._read() as db:
+            async with db.execute(f"SELECT MIN(next_check_at) FROM proxies{where}") as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def heartbeat_worker(self, worker_id: str, host: str, pid: int, partitions: int = 0,
+                               stats: Optional[Dict[str, Any]] = None, now: Optional[int] = None):
+        """Renews a monitor worker's lease and publishes its completion stats."""
+        stats = stats or {}
+        now = int(time.time()) if now is None else now
+        async with self._write() as db:
+            await db.execute("""
+                INSERT INTO worker_leases (worker_id, host, pid, started_at, heartbeat_at, partitions, checked, errors, rate, max_lag_s)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET
+                    heartbeat_at = excluded.heartbeat_at, partitions = excluded.partitions, checked = excluded.checked,
+                    errors = excluded.errors, rate = excluded.rate, max_lag_s = excluded.max_lag_s
+            """, (worker_id, host, pid, now, now, partitions, stats.get("checked", 0), stats.get("errors", 0),
+                  stats.get("rate", 0.0), stats.get("max_lag_s", 0.0)))
+            await db.commit()
+
+    async def get_workers(self, live_within: Optional[int] = None, now: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Worker leases by id; with `live_within`, only those that heartbeated in the last that many seconds."""
+        now = int(time.time()) if now is None else now
+        query, params = "SELECT * FROM worker_leases", ()
+        if live_within is not None:
+            query, params = query + " WHERE heartbeat_at >= ?", (now - live_within,)
+        async with self._read() as db:
+            async with db.execute(query + " ORDER BY worker_id", params) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def release_worker(self, worker_id: str, expired_before: Optional[int] = None):
+        """Drops a worker's lease (so its partitions move at once), plus any lease older than `expired_before`."""
+        async with self._write() as db:
+            await db.execute("DELETE FROM worker_leases WHERE worker_id = ? OR heartbeat_at < ?",
+                             (worker_id, expired_before if expired_before is not None else 0))
+            await db.commit()
+
     async def delete_proxy(self, ip: str, port: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        self.writes.forget((ip, port))
+        async with self._write() as db:
             await db.execute("DELETE FROM proxies WHERE ip = ? AND port = ?", (ip, port))
             await db.commit()
 
-    async def update_health(self, ip: str, port: int, working: bool):
-        """Updates health score of a proxy based on success/failure."""
-        async with aiosqlite.connect(self.db_path) as db:
-            if working:
-                await db.execute("UPDATE proxies SET health_score = MIN(100, health_score + 10), success_count = success_count + 1 WHERE ip = ? AND port = ?", (ip, port))
+    async def get_proxy(self, ip: str, port: int) -> Optional[Dict[str, Any]]:
+        async with self._read() as db:
+            async with db.execute("SELECT * FROM proxies WHERE ip = ? AND port = ?", (ip, port)) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
+
+    async def get_healthiest(self, limit: int = 100, min_score: int = 0) -> List[Dict[str, Any]]:
+        """Active (not quarantined) proxies by descending health_score, through idx_proxies_health."""
+        query = "SELECT * FROM proxies WHERE health_score >= ? AND state = 'active' ORDER BY health_score DESC LIMIT ?"
+        async with self._read() as db:
+            async with db.execute(query, (min_score, limit)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def record_outcome(self, proxy: Dict[str, Any], ok: bool, latency_ms: Optional[float] = None,
+                             next_check: Optional[int] = None) -> int:
+        """
+        Applies one check outcome to `proxy` with the health model (updating
+        the dict in place) and queues it with a re-check time derived from
+        the new state. Returns the new score. The stored row gets the same
+        outcome replayed onto whatever it holds at flush time, which only
+        matches `proxy` if nobody else wrote the row since it was read.
+        """
+        now = time.time()
+        score = health.observe(proxy, ok, latency_ms, now=now)
+        if next_check is None:
+            next_check = next_check_at(proxy)
+        await self.writes.mark((proxy["ip"], proxy["port"]), proxy, ok, next_check, latency_ms, now)
+        await self._queued()
+        return score
+
+    async def record_outcomes(self, proxy: Dict[str, Any], outcomes: List[Tuple[bool, Optional[float]]]) -> int:
+        """
+        Outcomes seen by a process that only holds a cached copy of the row
+        (the gateway pool): re-reads the row, applies them to it and copies
+        the new health fields into `proxy`. Rows that are gone or
+        quarantined are left alone and score 0, so the caller drops them.
+        """
+        stored = await self.get_proxy(proxy["ip"], proxy["port"])
+        if stored is None:
+            return 0
+        score = stored["health_score"]
+        if stored["state"] != health.QUARANTINE:
+            for ok, latency_ms in outcomes:
+                score = await self.record_outcome(stored, ok, latency_ms)
+        proxy.update({name: stored[name] for name in health.HEALTH_FIELDS})
+        return 0 if stored["state"] == health.QUARANTINE else score
+
+    async def update_health(self, ip: str, port: int, working: bool, latency_ms: Optional[float] = None) -> Optional[int]:
+        """Health update for callers that do not hold the row; reads it first."""
+        proxy = await self.get_proxy(ip, port)
+        if proxy is None:
+            return None
+        return await self.record_outcome(proxy, working, latency_ms)
+
+    async def delete_unhealthy(self, threshold: int, min_samples: float = 0) -> int:
+        """
+        Deletes proxies with health_score below `threshold` that have at least
+        `min_samples` of evidence behind it. Returns the number removed.
+        """
+        await self.writes.flush()
+        async with self._write() as db:
+            cursor = await db.execute("DELETE FROM proxies WHERE health_score < ? AND health_samples >= ?", (threshold, min_samples))
+            await db.commit()
+            return cursor.rowcount
+
+    async def record_check(self, ip: str, port: int, outcome: int, latency_ms: Optional[int] = None,
+                           ts: Optional[int] = None):
+        """Appends one check result (an OUTCOME_* code) to check_history."""
+        pid = proxy_id(ip, port)
+        if pid is None:
+            return
+        await self.writes.check((int(ts if ts is not None else time.time()), pid, outcome, latency_ms))
+        await self._queued()
+
+    async def _get_state(self, db, name: str, default: int = 0) -> int:
+        async with db.execute("SELECT value FROM rollup_state WHERE name = ?", (name,)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else default
+
+    async def rollup_history(self, now: Optional[int] = None) -> Dict[str, int]:
+        """
+        Folds finished hours of raw check_history into hourly rollups and
+        finished days of hourly rollups into daily ones. Incremental: each
+        pass starts at the watermark left by the previous one.
+        """
+        now = int(now if now is not None else time.time())
+        hour_start = now // HOUR * HOUR
+        day_start = now // DAY * DAY
+        await self.writes.flush()
+        async with self._write() as db:
+            rolled_rowid = await self._get_state(db, "hourly_rowid")
+            # Last raw row of a finished hour; scans forward from the watermark only
+            async with db.execute(
+                "SELECT rowid FROM check_history WHERE rowid > ? AND ts >= ? ORDER BY rowid LIMIT 1",
+                (rolled_rowid, hour_start),
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                upto = row[0] - 1
             else:
-                await db.execute("UPDATE proxies SET health_score = MAX(0, health_score - 20), fail_count = fail_count + 1 WHERE ip = ? AND port = ?", (ip, port))
+                async with db.execute("SELECT MAX(rowid) FROM check_history") as cursor:
+                    upto = (await cursor.fetchone())[0] or 0
+            hourly = 0
+            if upto > rolled_rowid:
+                cursor = await db.execute(ROLLUP_HOURS_SQL, (rolled_rowid, upto))
+                hourly = cursor.rowcount
+                await db.execute("INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('hourly_rowid', ?)", (upto,))
+
+            daily = 0
+            first_day = await self._get_state(db, "daily_from", -1)
+            if first_day < 0:
+                async with db.execute("SELECT MIN(bucket) FROM check_rollups WHERE period = 3600") as cursor:
+                    oldest = (await cursor.fetchone())[0]
+                first_day = oldest // DAY * DAY if oldest is not None else day_start
+            if first_day < day_start:
+                cursor = await db.execute(ROLLUP_DAYS_SQL, (first_day, day_start))
+                daily = cursor.rowcount
+            await db.execute("INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('daily_from', ?)",
+                             (max(first_day, day_start),))
+            await db.commit()
+        return {"hourly": hourly, "daily": daily}
+
+    async def prune_history(self, now: Optional[int] = None) -> Dict[str, int]:
+        """Applies the retention windows for raw rows, hourly and daily rollups."""
+        cfg = settings.database
+        now = int(now if now is not None else time.time())
+        await self.writes.flush()
+        async with self._write() as db:
+            rolled_rowid = await self._get_state(db, "hourly_rowid")
+            # Raw rows go once they are both expired and already rolled up
+            async with db.execute(
+                "SELECT rowid FROM check_history WHERE ts >= ? ORDER BY rowid LIMIT 1",
+                (now - cfg.history_raw_hours * HOUR,),
+            ) as cursor:
+                row = await cursor.fetchone()
+            keep_from = min(row[0] if row else rolled_rowid + 1, rolled_rowid + 1)
+            raw = await db.execute("DELETE FROM check_history WHERE rowid < ?", (keep_from,))
+            hourly = await db.execute("DELETE FROM check_rollups WHERE period = 3600 AND bucket < ?",
+                                      (now - cfg.history_hourly_days * DAY,))
+            daily = await db.execute("DELETE FROM check_rollups WHERE period = 86400 AND bucket < ?",
+                                     (now - cfg.history_daily_days * DAY,))
             await db.commit()
+        return {"raw": raw.rowcount, "hourly": hourly.rowcount, "daily": daily.rowcount}
+
+    async def maintain_history(self, now: Optional[int] = None):
+        """Rollup then retention; called periodically by the lifecycle monitor."""
+        rolled = await self.rollup_history(now)
+        pruned = await self.prune_history(now)
+        if any(rolled.values()) or any(pruned.values()):
+            logger.info(f"Check history: rolled up {rolled}, pruned {pruned}")
+
+    async def get_proxy_stability(self, ip: str, port: int, window: int = DAY,
+                                  now: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Checks, passes, uptime and latency of one proxy over the last `window`
+        seconds: hourly rollups for the rolled part plus the raw rows not
+        rolled up yet, both through the proxy_id indexes.
+        """
+        pid = proxy_id(ip, port)
+        now = int(now if now is not None else time.time())
+        since = now - window
+        totals = {"checks": 0, "ok": 0, "latency_sum": 0, "latency_count": 0}
+        if pid is not None:
+            async with self._read() as db:
+                rolled_rowid = await self._get_state(db, "hourly_rowid")
+                async with db.execute(
+                    "SELECT COALESCE(SUM(checks), 0), COALESCE(SUM(ok), 0), COALESCE(SUM(latency_sum), 0), "
+                    "COALESCE(SUM(latency_count), 0) FROM check_rollups "
+                    "WHERE proxy_id = ? AND period = 3600 AND bucket >= ?",
+                    (pid, since // HOUR * HOUR),
+                ) as cursor:
+                    rolled = await cursor.fetchone()
+                async with db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(outcome = 0), 0), TOTAL(latency_ms), COUNT(latency_ms) "
+                    "FROM check_history WHERE proxy_id = ? AND ts >= ? AND rowid > ?",
+                    (pid, since, rolled_rowid),
+                ) as cursor:
+                    recent = await cursor.fetchone()
+            for key, a, b in zip(totals, rolled, recent):
+                totals[key] = int(a) + int(b)
+        checks = totals["checks"]
+        return {
+            "checks": checks,
+            "ok": totals["ok"],
+            "uptime": round(totals["ok"] / checks, 4) if checks else None,
+            "avg_latency_ms": round(totals["latency_sum"] / totals["latency_count"]) if totals["latency_count"] else None,
+        }
+
+    async def get_isp_availability(self, isp: Optional[str] = None, window: int = 7 * DAY, period: int = HOUR,
+                                   now: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Pool availability per time bucket (hourly or daily rollups), for one
+        ISP label or every proxy: [{bucket, checks, ok, uptime}], oldest first.
+        """
+        now = int(now if now is not None else time.time())
+        query = """
+            SELECT r.bucket, SUM(r.checks) AS checks, SUM(r.ok) AS ok
+            FROM check_rollups r
+        """
+        params: List[Any] = []
+        if isp:
+            query += " JOIN proxies p ON p.ip_int = r.proxy_id / 65536 AND p.port = r.proxy_id % 65536"
+        query += " WHERE r.period = ? AND r.bucket >= ?"
+        params += [period, now - window]
+        if isp:
+            query += " AND p.isp = ?"
+            params.append(isp)
+        query += " GROUP BY r.bucket ORDER BY r.bucket"
+        async with self._read() as db:
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+        return [
+            {"bucket": r[0], "checks": r[1], "ok": r[2], "uptime": round(r[2] / r[1], 4) if r[1] else None}
+            for r in rows
+        ]
+
+    async def get_hour_of_day_profile(self, isp: Optional[str] = None, window: int = 14 * DAY,
+                                      now: Optional[int] = None) -> Dict[int, float]:
+        """Uptime by UTC hour of day over the window: when a pool tends to be online."""
+        by_hour: Dict[int, List[int]] = {}
+        for row in await self.get_isp_availability(isp, window, HOUR, now):
+            hour = row["bucket"] % DAY // HOUR
+            acc = by_hour.setdefault(hour, [0, 0])
+            acc[0] += row["ok"]
+            acc[1] += row["checks"]
+        return {hour: round(ok / checks, 4) for hour, (ok, checks) in sorted(by_hour.items()) if checks}
+
+    async def defer_checks(self, until: int, cidr: Optional[str] = None, isp: Optional[str] = None) -> int:
+        """
+        Pushes next_check_at of every proxy inside `cidr` (or with `isp`) that
+        is due before `until` out to `until`, so the scheduler stops streaming
+        a group whose circuit breaker is open. Returns the rows moved.
+        """
+        if cidr is not None:
+            net = ipaddress.IPv4Network(cidr, strict=False)
+            where, params = "ip_int BETWEEN ? AND ?", (int(net.network_address), int(net.broadcast_address))
+        elif isp is not None:
+            where, params = "isp = ?", (isp,)
+        else:
+            raise ValueError("defer_checks needs a cidr or an isp")
+        await self.writes.flush()
+        async with self._write() as db:
+            cursor = await db.execute(
+                f"UPDATE proxies SET next_check_at = ? WHERE {where} AND next_check_at < ?",
+                (until, *params, until),
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def postpone_check(self, ip: str, port: int, until: int):
+        """Moves one proxy's next_check_at out to `until` without recording an outcome."""
+        await self.writes.flush()
+        async with self._write() as db:
+            await db.execute("UPDATE proxies SET next_check_at = ? WHERE ip = ? AND port = ? AND next_check_at < ?",
+                             (until, ip, port, until))
+            await db.commit()
+
+    async def quarantine_unhealthy(self, threshold: int, min_samples: float = 0) -> int:
+        """
+        Moves active proxies scoring below `threshold` (with at least
+        `min_samples` of evidence) into quarantine. Returns how many moved.
+        """
+        await self.writes.flush()
+        async with self._write() as db:
+            cursor = await db.execute(
+                "UPDATE proxies SET state = 'quarantine', quarantined_at = CAST(strftime('%s', 'now') AS INTEGER) "
+                "WHERE state = 'active' AND health_score < ? AND health_samples >= ?",
+                (threshold, min_samples),
+            )
+            await db.commit()
+            return cursor.rowcount
+
+    async def archive_quarantined(self, max_age: int) -> int:
+        """
+        Moves proxies quarantined for longer than `max_age` seconds from
+        proxies to proxies_archive. Returns how many were archived.
+        """
+        await self.writes.flush()
+        cutoff = int(time.time()) - max_age
+        async with self._write() as db:
+            await db.execute("""
+                INSERT OR REPLACE INTO proxies_archive
+                (ip, port, ip_int, protocol, anonymity, country, isp, success_count, fail_count, quarantined_at, archived_at)
+                SELECT ip, port, ip_int, protocol, anonymity, country, isp, success_count, fail_count, quarantined_at,
+                       CAST(strftime('%s', 'now') AS INTEGER)
+                FROM proxies WHERE state = 'quarantine' AND quarantined_at < ?
+            """, (cutoff,))
+            cursor = await db.execute("DELETE FROM proxies WHERE state = 'quarantine' AND quarantined_at < ?", (cutoff,))
+            await db.commit()
+            return cursor.rowcount
+
+    async def get_archived(self, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Archived proxies, most recently archived first, e.g. to retry them without a rescan."""
+        async with self._read() as db:
+            async with db.execute("SELECT * FROM proxies_archive ORDER BY archived_at DESC LIMIT ?", (limit,)) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
 
     async def update_subnet_intel(self, ip: str, isp: str, found_count: int = 1):
         """Records productive subnets to prioritize future scanning."""
         parts = ip.split('.')
         if len(parts) == 4:
             subnet_prefix = f"{parts[0]}.{parts[1]}.{parts[2]}.0/24"
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute("""
-                    INSERT INTO subnet_intel (subnet_prefix, isp, total_found, yield_score, last_updated)
-                    VALUES (?, ?, ?, 1.0, CURRENT_TIMESTAMP)
-                    ON CONFLICT(subnet_prefix) DO UPDATE SET 
-                        total_found = total_found + ?,
-                        yield_score = yield_score + 1.0,
-                        last_updated = CURRENT_TIMESTAMP
-                """, (subnet_prefix, isp, found_count, found_count))
-                await db.commit()
+            await self.writes.subnet(subnet_prefix, isp, found_count)
+            await self._queued()
 
     async def get_top_subnets(self, isp: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
         """Returns the most productive /24 subnets for targeted deep scans."""
@@ -133,9 +1118,72 @@ class StorageManager:
         query += " ORDER BY yield_score DESC LIMIT ?"
         params.append(limit)
         
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._read() as db:
             async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
 
+    async def save_site_verdicts(self, verdicts: List[Dict[str, Any]]):
+        """Stores (proxy, site) compatibility verdicts in a single transaction."""
+        if not verdicts:
+            return
+        async with self._write() as db:
+            await db.executemany("""
+                INSERT OR REPLACE INTO site_verdicts
+                (ip, port, site, ok, status_code, latency_ms, checked_at)
+                VALUES (:ip, :port, :site, :ok, :status_code, :latency_ms, CURRENT_TIMESTAMP)
+            """, verdicts)
+            await db.commit()
+
+    async def get_site_verdicts(self, site: str, ttl: int) -> List[Dict[str, Any]]:
+        """Returns verdicts for a site that are younger than `ttl` seconds."""
+        query = """
+            SELECT ip, port, site, ok, status_code, latency_ms, checked_at
+            FROM site_verdicts
+            WHERE site = ? AND checked_at >= datetime('now', ?)
+        """
+        async with self._read() as db:
+            async with db.execute(query, (site, f"-{int(ttl)} seconds")) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def get_proxies_for_site(self, site: str, ttl: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """Returns proxies with a fresh passing verdict for `site`, fastest first."""
+        query = """
+            SELECT p.*, v.latency_ms AS site_latency_ms
+            FROM proxies p
+            JOIN site_verdicts v ON v.ip = p.ip AND v.port = p.port
+            WHERE v.site = ? AND v.ok = 1 AND v.checked_at >= datetime('now', ?) AND p.state = 'active'
+            ORDER BY v.latency_ms ASC LIMIT ?
+        """
+        async with self._read() as db:
+            async with db.execute(query, (site, f"-{int(ttl)} seconds", limit)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def save_geo_cache(self, entries: List[Dict[str, Any]]):
+        """Upserts resolved GeoIP records. `resolved_at` is a unix timestamp."""
+        if not entries:
+            return
+        async with self._write() as db:
+            await db.executemany("""
+                INSERT OR REPLACE INTO geo_cache
+                (ip, prefix24, country, country_name, region, city, isp, org, asn, resolved_at)
+                VALUES (:ip, :prefix24, :country, :country_name, :region, :city, :isp, :org, :asn, :resolved_at)
+            """, entries)
+            await db.commit()
+
+    async def get_geo_cache(self, max_age: int) -> List[Dict[str, Any]]:
+        """Returns every cached GeoIP record younger than `max_age` seconds."""
+        query = "SELECT * FROM geo_cache WHERE resolved_at >= strftime('%s', 'now') - ?"
+        async with self._read() as db:
+            async with db.execute(query, (max_age,)) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def prune_geo_cache(self, max_age: int) -> int:
+        """Deletes expired GeoIP records. Returns the number removed."""
+        async with self._write() as db:
+            cursor = await db.execute("DELETE FROM geo_cache WHERE resolved_at < strftime('%s', 'now') - ?", (max_age,))
+            await db.commit()
+            return cursor.rowcount
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Phases of a single proxied request, in the order they happen
+PHASES = ["tcp_connect_ms", "proxy_handshake_ms", "tls_handshake_ms", "first_byte_ms", "total_ms"]
+
+# libcurl error codes (CURLE_*) we map to failure classes.
+# Kept numeric so this module can be imported without curl_cffi installed.
+_CURLE_COULDNT_RESOLVE_PROXY = 5
+_CURLE_COULDNT_RESOLVE_HOST = 6
+_CURLE_COULDNT_CONNECT = 7
+_CURLE_OPERATION_TIMEDOUT = 28
+_CURLE_SSL_CONNECT_ERROR = 35
+_CURLE_GOT_NOTHING = 52
+_CURLE_SEND_ERROR = 55
+_CURLE_RECV_ERROR = 56
+_CURLE_PROXY = 97
+
+def new_record(ip: str, port: int, protocol: str, stage: str, url: str) -> Dict[str, Any]:
+    """Creates an empty timing record for one validation attempt."""
+    return {
+        "ts": round(time.time(), 3),
+        "ip": ip,
+        "port": port,
+        "protocol": protocol,
+        "stage": stage,
+        "url": url,
+        "tcp_connect_ms": None,
+        "proxy_handshake_ms": None,
+        "tls_handshake_ms": None,
+        "first_byte_ms": None,
+        "total_ms": None,
+        "status_code": None,
+        "outcome": "ok",
+        "failure_phase": None,
+    }
+
+def fill_phases(record: Dict[str, Any], infos: Dict[Any, Any]):
+    """
+    Fills phase durations from libcurl timing info (cumulative seconds).
+    libcurl does not report proxy negotiation separately: for HTTPS targets the
+    tunnel setup is folded into tls_handshake_ms, for plain HTTP it is the gap
+    between TCP connect and the request being sent.
+    """
+    from curl_cffi.const import CurlInfo
+    connect = infos.get(CurlInfo.CONNECT_TIME) or 0.0
+    appconnect = infos.get(CurlInfo.APPCONNECT_TIME) or 0.0
+    pretransfer = infos.get(CurlInfo.PRETRANSFER_TIME) or 0.0
+    starttransfer = infos.get(CurlInfo.STARTTRANSFER_TIME) or 0.0
+
+    record["tcp_connect_ms"] = int(connect * 1000)
+    if appconnect > 0:
+        record["tls_handshake_ms"] = int(max(0.0, appconnect - connect) * 1000)
+    elif pretransfer > 0:
+        record["proxy_handshake_ms"] = int(max(0.0, pretransfer - connect) * 1000)
+    if starttransfer > 0:
+        record["first_byte_ms"] = int(max(0.0, starttransfer - max(pretransfer, appconnect, connect)) * 1000)
+
+def _timeout_phase(msg: str) -> str:
+    if "ssl" in msg or "tls" in msg:
+        return "tls_handshake"
+    if "socks" in msg or "proxy" in msg or "tunnel" in msg:
+        return "proxy_handshake"
+    if "connection timed out" in msg or "failed to connect" in msg:
+        return "tcp_connect"
+    return "first_byte"
+
+def classify_failure(exc: BaseException) -> Tuple[str, str]:
+    """
+    Maps an exception raised during a proxied request to (failure_class, phase).
+    Classes: refused, reset, timeout, dns, proxy_error, tls_error, empty_reply, error.
+    """
+    msg = str(exc).lower()
+    code = getattr(exc, "code", None)
+
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)) or code == _CURLE_OPERATION_TIMEDOUT:
+        return "timeout", _timeout_phase(msg)
+    if isinstance(exc, ConnectionRefusedError) or "refused" in msg:
+        return "refused", "tcp_connect"
+    if isinstance(exc, ConnectionResetError) or "reset" in msg:
+        return "reset", "tls_handshake" if "ssl" in msg else "first_byte"
+    if code in (_CURLE_COULDNT_RESOLVE_PROXY, _CURLE_COULDNT_RESOLVE_HOST):
+        return "dns", "tcp_connect"
+    if code == _CURLE_COULDNT_CONNECT:
+        return "refused", "tcp_connect"
+    if code == _CURLE_PROXY or (code == _CURLE_RECV_ERROR and "connect" in msg):
+        return "proxy_error", "proxy_handshake"
+    if code == _CURLE_SSL_CONNECT_ERROR:
+        return "tls_error", "tls_handshake"
+    if code == _CURLE_GOT_NOTHING:
+        return "empty_reply", "first_byte"
+    if code in (_CURLE_SEND_ERROR, _CURLE_RECV_ERROR):
+        return "reset", "first_byte"
+    return "error", "unknown"
+
+class TimingSink:
+    """Receives one record per validation attempt. Subclasses decide where it goes."""
+    def emit(self, record: Dict[str, Any]):
+        pass
+
+    def close(self):
+        pass
+
+class NullTimingSink(TimingSink):
+    pass
+
+class JsonlTimingSink(TimingSink):
+    """Appends records to a JSON Lines file for offline analysis."""
+    def __init__(self, path: str, flush_every: int = 100):
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = 0
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fh = open(self.path, "a", encoding="utf-8")
+
+    def emit(self, record: Dict[str, Any]):
+        self._fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self._fh.flush()
+            self._pending = 0
+
+    def close(self):
+        if not self._fh.closed:
+            self._fh.close()
+
+class HistogramTimingSink(TimingSink):
+    """
+    Keeps log2-bucketed latency histograms per phase plus failure counters.
+    Cheap enough to leave on for every candidate; call summary() to read it.
+    """
+    def __init__(self):
+        self.histograms: Dict[str, Dict[int, int]] = {phase: {} for phase in PHASES}
+        self.failures: Dict[str, int] = {}
+        self.attempts = 0
+
+    def emit(self, record: Dict[str, Any]):
+        self.attempts += 1
+        for phase in PHASES:
+            value = record.get(phase)
+            if value is None:
+                continue
+            bucket = max(0, int(value)).bit_length()  # [2^(b-1), 2^b) ms
+            hist = self.histograms[phase]
+            hist[bucket] = hist.get(bucket, 0) + 1
+        if record.get("outcome") != "ok":
+            key = f"{record['outcome']}@{record.get('failure_phase') or 'unknown'}"
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+    def percentile(self, phase: str, pct: float) -> Optional[int]:
+        """Upper bound (ms) of the bucket containing the given percentile."""
+        hist = self.histograms.get(phase, {})
+        total = sum(hist.values())
+        if not total:
+            return None
+        threshold = total * pct / 100.0
+        seen = 0
+        for bucket in sorted(hist):
+            seen += hist[bucket]
+            if seen >= threshold:
+                return (1 << bucket) - 1 if bucket else 0
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "attempts": self.attempts,
+            "phases": {
+                phase: {p: self.percentile(phase, p) for p in (50, 90, 99)}
+                for phase in PHASES
+            },
+            "failures": dict(sorted(self.failures.items(), key=lambda kv: -kv[1])),
+        }
+
+def make_sink(kind: str, path: Optional[str] = None) -> TimingSink:
+    """Builds a sink from the `verification.timing_sink` setting."""
+    if kind == "jsonl":
+        return JsonlTimingSink(path or "data/validator_timings.jsonl")
+    if kind == "histogram":
+        return HistogramTimingSink()
+    return NullTimingSink()
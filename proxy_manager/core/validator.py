@@ -8,121 +8,190 @@ from proxy_manager.core.config import settings
 
 logger = logging.getLogger(__name__)
 
-from proxy_manager.core.geoip import GeoIPManager
+from proxy_manager.core.geoip import GeoIPManager, GeoCache
+from proxy_manager.core.storage import StorageManager
 from proxy_manager.core.judge import AnonymityJudge
+from proxy_manager.core.ranges import get_range_index
+from proxy_manager.core.timing import TimingSink, new_record, fill_phases, classify_failure, make_sink
+from proxy_manager.core.breaker import BreakerBoard
 
 class ProxyValidator:
-    def __init__(self):
+    def __init__(self, timing_sink: Optional[TimingSink] = None, storage: Optional[StorageManager] = None,
+                 breakers: Optional[BreakerBoard] = None):
         self.judges = settings.verification.judges
         self.timeout = aiohttp.ClientTimeout(total=settings.verification.timeout)
-        self.geoip = GeoIPManager()
+        self.geoip = GeoIPManager(cache=GeoCache(storage))
         self.judge = AnonymityJudge()
+        self.ranges = get_range_index()
+        self.timing_sink = timing_sink or make_sink(settings.verification.timing_sink,
+                                                    settings.verification.timing_path)
+        # Optional /24 + ISP circuit breakers; leave None when the caller already does the bookkeeping
+        self.breakers = breakers
 
-    async def check_proxy(self, ip: str, port: int, protocol: str, skip_geoip: bool = False) -> Optional[Dict[str, Any]]:
+    async def _attempt(self, session, record: Dict[str, Any], url: str, ok_status: List[int],
+                       expect_json: bool = False, check=None, timeout: Optional[float] = None):
+        """
+        Runs one GET through the proxy session and fills `record` with phase timings
+        and the outcome. Returns (response, parsed_json) on success, (None, None) otherwise.
+        """
+        t0 = time.perf_counter()
+        response = None
+        data = None
+        try:
+            kwargs = {"timeout": timeout} if timeout else {}
+            response = await session.get(url, **kwargs)
+            record["status_code"] = response.status_code
+            fill_phases(record, getattr(response, "infos", {}) or {})
+            if response.status_code not in ok_status:
+                record["outcome"], record["failure_phase"] = "bad_status", "response"
+            elif expect_json:
+                try:
+                    data = response.json()
+                except ValueError:
+                    record["outcome"], record["failure_phase"] = "non_json", "response"
+                else:
+                    if check is not None and not check(data):
+                        record["outcome"], record["failure_phase"] = "bad_body", "response"
+        except Exception as e:
+            record["outcome"], record["failure_phase"] = classify_failure(e)
+
+        record["total_ms"] = int((time.perf_counter() - t0) * 1000)
+        self.timing_sink.emit(record)
+        if record["outcome"] != "ok":
+            return None, None
+        return response, data
+
+    async def check_proxy(self, ip: str, port: int, protocol: str, skip_geoip: bool = False,
+                          isp: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         Validates a specific proxy protocol (http, socks4, socks5).
         Returns dict with metadata if working, None if failed.
+        Every request made along the way is reported to `self.timing_sink`.
+        With `self.breakers`, checks in a /24 or ISP (`isp`, else our range
+        files) whose circuit is open are skipped and return None.
+        """
+        isp = isp or (self.ranges.lookup(ip) if self.breakers is not None else None)
+        if not self._breaker_allows(ip, port, isp):
+            return None
+        result, route_failed = await self._check(ip, port, protocol, skip_geoip)
+        if self.breakers is not None and route_failed is not None:
+            self.breakers.record(ip, isp, route_failed)
+        return result
+
+    def _breaker_allows(self, ip: str, port: int, isp: Optional[str]) -> bool:
+        if self.breakers is None:
+            return True
+        blocker = self.breakers.acquire(ip, isp)
+        if blocker is not None:
+            logger.debug(f"Skipping {ip}:{port}: circuit {blocker.key} is {blocker.state}")
+            return False
+        return True
+
+    async def _check(self, ip: str, port: int, protocol: str, skip_geoip: bool = False):
+        """
+        check_proxy without the breakers: (result or None, route_failed),
+        route_failed being None when the check never got to Pass 1.
         """
         proxy_url = f"{protocol}://{ip}:{port}"
-        start_time = time.time()
-        
+        route_failed = None
+
+        def record(stage, url):
+            return new_record(ip, port, protocol, stage, url)
+
         try:
             from curl_cffi.requests import AsyncSession
+            from curl_cffi.const import CurlInfo
             proxies = {"http": proxy_url, "https": proxy_url}
-            
+            curl_infos = [CurlInfo.CONNECT_TIME, CurlInfo.APPCONNECT_TIME,
+                          CurlInfo.PRETRANSFER_TIME, CurlInfo.STARTTRANSFER_TIME]
+
             # Increase timeout for TLS emulation. Indonesian proxies frequently need 5-8s for initial handshake
             check_timeout = max(self.timeout.total, 8.0) 
             
-            async with AsyncSession(proxies=proxies, impersonate="chrome120", timeout=check_timeout) as session:
+            async with AsyncSession(proxies=proxies, impersonate="chrome120", timeout=check_timeout,
+                                    curl_infos=curl_infos) as session:
                 is_valid = False
                 latency = 0
                 
                 # Pass 1: Strict HTTPS CONNECT to a major site
-                try:
-                    t1 = time.time()
-                    response = await session.get("https://www.google.com")
-                    if response.status_code in [200, 301, 302]: # Allow redirects
-                        latency = int((time.time() - t1) * 1000)
-                        is_valid = True
-                except Exception:
-                    pass
+                rec = record("connect_https", "https://www.google.com")
+                response, _ = await self._attempt(session, rec, "https://www.google.com", [200, 301, 302]) # Allow redirects
+                # Only "nothing answered" says anything about the route to the group
+                route_failed = rec["outcome"] == "timeout" and rec["failure_phase"] == "tcp_connect"
+                if response is not None:
+                    latency = rec["total_ms"]
+                    is_valid = True
                 
                 # Pass 2: Fallback to HTTP if HTTPS failed (some proxies block HTTPS or Google)
                 # STRICT REQUIREMENT: Response must be JSON. Router login pages return HTML 200 OK.
                 if not is_valid:
-                    try:
-                        t2 = time.time()
-                        http_resp = await session.get("http://httpbin.org/get")
-                        if http_resp.status_code == 200:
-                            # Verify it's actually httpbin by parsing JSON
-                            data = http_resp.json()
-                            if "url" in data and "httpbin.org" in data["url"]:
-                                latency = int((time.time() - t2) * 1000)
-                                is_valid = True
-                    except Exception:
-                        pass
+                    rec = record("connect_http", "http://httpbin.org/get")
+                    # Verify it's actually httpbin by parsing JSON
+                    response, _ = await self._attempt(
+                        session, rec, "http://httpbin.org/get", [200], expect_json=True,
+                        check=lambda data: "url" in data and "httpbin.org" in data["url"])
+                    if response is not None:
+                        latency = rec["total_ms"]
+                        is_valid = True
 
                 if is_valid:
                     
                     # Anonymity Check using curl_cffi with better timeout and fallback
                     anonymity = "unknown"
-                    try:
-                        anon_resp = await session.get("http://httpbin.org/get", timeout=8.0)
-                        if anon_resp.status_code == 200:
-                            data = anon_resp.json()
-                            headers = data.get("headers", {})
-                            proxy_headers = ["Via", "X-Forwarded-For", "X-Forwarded", "Forwarded-For", "Forwarded", "Client-Ip", "X-Real-Ip"]
-                            detected_headers = [h for h in proxy_headers if h in headers or h.lower() in headers]
-                            if detected_headers:
-                                anonymity = "anonymous"
-                            else:
-                                anonymity = "elite"
+                    _, data = await self._attempt(session, record("anonymity", "http://httpbin.org/get"),
+                                                  "http://httpbin.org/get", [200], expect_json=True, timeout=8.0)
+                    if data is not None:
+                        headers = data.get("headers", {})
+                        proxy_headers = ["Via", "X-Forwarded-For", "X-Forwarded", "Forwarded-For", "Forwarded", "Client-Ip", "X-Real-Ip"]
+                        detected_headers = [h for h in proxy_headers if h in headers or h.lower() in headers]
+                        if detected_headers:
+                            anonymity = "anonymous"
                         else:
-                            raise ValueError(f"httpbin returned {anon_resp.status_code}")
-                    except Exception as e:
+                            anonymity = "elite"
+                    else:
                         # Fallback for anonymity check (in case httpbin is blocking/timing out)
-                        try:
-                            fallback_resp = await session.get("https://api.ipify.org?format=json", timeout=8.0)
-                            if fallback_resp.status_code == 200:
+                        for url in ("https://api.ipify.org?format=json", "https://ifconfig.me/ip"):
+                            response, _ = await self._attempt(session, record("anonymity_fallback", url),
+                                                              url, [200], timeout=8.0)
+                            if response is not None:
                                 anonymity = "elite"
-                            else:
-                                raise ValueError("ipify failed")
-                        except Exception:
-                            # Final fallback
-                            try:
-                                final_resp = await session.get("https://ifconfig.me/ip", timeout=8.0)
-                                if final_resp.status_code == 200:
-                                    anonymity = "elite"
-                            except Exception:
-                                pass
+                                break
                     
                     if not skip_geoip:
                         geo_data = await self.geoip.lookup(ip)
-                        country = geo_data.get("country", "XX")
-                        isp = geo_data.get("isp", "Unknown")
                     else:
-                        country = "XX"
-                        isp = "Unknown"
+                        # Local databases cost nothing, only the online lookup is skipped
+                        geo_data = await self.geoip.lookup(ip, allow_online=False)
+                    country = geo_data.get("country", "XX")
+                    region = geo_data.get("region", "")
+                    city = geo_data.get("city", "")
+                    isp = geo_data.get("isp", "Unknown")
+                    if isp in (None, "", "Unknown"):
+                        # Fall back to our own per-ISP range files
+                        isp = self.ranges.lookup(ip) or "Unknown"
 
-                    return {
+                    return ({
                         "ip": ip,
                         "port": port,
                         "protocol": protocol,
                         "anonymity": anonymity,
                         "country": country,
-                        "region": "", 
-                        "city": "",
+                        "region": region,
+                        "city": city,
                         "isp": isp,
                         "response_time_ms": latency,
                         "health_score": 100,
                         "success_count": 1,
                         "fail_count": 0
-                    }
+                    }, route_failed)
         except Exception as e:
-            # logger.debug(f"Strict Proxy check failed for {proxy_url}: {e}")
-            pass
+            # Session setup or GeoIP failed outside of an instrumented request
+            rec = record("session", proxy_url)
+            rec["outcome"], rec["failure_phase"] = classify_failure(e)
+            self.timing_sink.emit(rec)
+            logger.debug(f"Proxy check aborted for {proxy_url}: {e}")
         
-        return None
+        return None, route_failed
 
     async def validate_all_protocols(self, ip: str, port: int) -> List[Dict[str, Any]]:
         """
@@ -133,11 +202,19 @@ class ProxyValidator:
         # Order makes sense: SOCKS5 is best, then SOCKS4, then HTTP
         protocols_to_test = ["socks5", "socks4", "http"]
         
-        tasks = [self.check_proxy(ip, port, proto) for proto in protocols_to_test]
+        # One breaker slot and one route outcome per candidate, not per protocol
+        isp = self.ranges.lookup(ip) if self.breakers is not None else None
+        if not self._breaker_allows(ip, port, isp):
+            return valid_configs
+        tasks = [self._check(ip, port, proto) for proto in protocols_to_test]
         results = await asyncio.gather(*tasks)
         
-        for res in results:
+        for res, _ in results:
             if res:
                 valid_configs.append(res)
+        outcomes = [route_failed for _, route_failed in results if route_failed is not None]
+        if self.breakers is not None and outcomes:
+            # Any protocol getting an answer means the route to the group is up
+            self.breakers.record(ip, isp, all(outcomes))
         
         return valid_configs
@@ -1,6 +1,8 @@
 import asyncio
 import logging
-from typing import Tuple
+import struct
+import time
+from typing import Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -55,7 +57,64 @@ class LightweightVerifier:
 
         except (asyncio.TimeoutError, ConnectionRefusedError, OSError):
             return False
-            
+
+    async def handshake(self, ip: str, port: int, protocol: str, target_host: str, target_port: int = 443) -> Tuple[bool, Optional[int], str]:
+        """
+        Cheap liveness check for a known proxy: asks it to open a tunnel to
+        target_host:target_port using its own protocol (SOCKS5 greeting +
+        CONNECT, SOCKS4a CONNECT, or HTTP CONNECT) and stops as soon as the
+        proxy answers. No TLS and no payload, so it costs one or two round
+        trips. Returns (ok, handshake latency in ms, failure reason).
+        """
+        start = time.perf_counter()
+        writer = None
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=self.timeout)
+            host = target_host.encode("idna")
+            if protocol == "socks5":
+                writer.write(b"\x05\x01\x00")  # Version 5, one method: no auth
+                await writer.drain()
+                reply = await asyncio.wait_for(reader.readexactly(2), timeout=self.timeout)
+                if reply != b"\x05\x00":
+                    return False, None, "socks5_greeting"
+                writer.write(b"\x05\x01\x00\x03" + bytes([len(host)]) + host + struct.pack(">H", target_port))
+                await writer.drain()
+                reply = await asyncio.wait_for(reader.readexactly(2), timeout=self.timeout)
+                if reply[0] != 5 or reply[1] != 0:
+                    return False, None, f"socks5_reply_{reply[1]}"
+            elif protocol == "socks4":
+                # SOCKS4a: 0.0.0.1 as address, hostname after the empty user id
+                writer.write(b"\x04\x01" + struct.pack(">H", target_port) + b"\x00\x00\x00\x01\x00" + host + b"\x00")
+                await writer.drain()
+                reply = await asyncio.wait_for(reader.readexactly(8), timeout=self.timeout)
+                if reply[1] != 0x5A:
+                    return False, None, f"socks4_reply_{reply[1]}"
+            else:
+                authority = f"{target_host}:{target_port}"
+                writer.write(f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n\r\n".encode())
+                await writer.drain()
+                status = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+                parts = status.split()
+                if len(parts) < 2 or not parts[0].startswith(b"HTTP/") or parts[1] != b"200":
+                    return False, None, f"http_connect_{parts[1].decode(errors='replace') if len(parts) > 1 else 'no_status'}"
+            return True, int((time.perf_counter() - start) * 1000), ""
+        except asyncio.TimeoutError:
+            return False, None, "timeout"
+        except asyncio.IncompleteReadError:
+            return False, None, "closed"
+        except (ConnectionRefusedError, ConnectionResetError):
+            return False, None, "refused"
+        except OSError:
+            return False, None, "os_error"
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+
 # Usage:
 # verifier = LightweightVerifier()
 # is_open = await verifier.verify("1.2.3.4", 80)
+# ok, latency_ms, reason = await verifier.handshake("1.2.3.4", 1080, "socks5", "httpbin.org")
@@ -10,6 +10,8 @@ from proxy_manager.core.scanner import MasscanWrapper
 from proxy_manager.core.verifier import LightweightVerifier
 from proxy_manager.core.validator import ProxyValidator
 from proxy_manager.core.storage import StorageManager
+from proxy_manager.core.ranges import get_range_index
+from proxy_manager.core.breaker import BreakerBoard
 
 # Configure logging
 logging.basicConfig(
@@ -64,10 +66,19 @@ async def run_pipeline(targets: List[str], ports: str = None, skip_scan: bool =
                  pass 
 
     logger.info(f"Processing {len(candidates)} candidate proxies.")
+
+    # Attribute candidates to our ISP range files up front
+    ranges = get_range_index()
+    by_isp = {}
+    for label in ranges.lookup_many(c["ip"] for c in candidates).values():
+        by_isp[label or "unattributed"] = by_isp.get(label or "unattributed", 0) + 1
+    if by_isp:
+        breakdown = ", ".join(f"{k}={v}" for k, v in sorted(by_isp.items(), key=lambda kv: -kv[1]))
+        logger.info(f"Candidates by ISP range: {breakdown}")
     
     # 3. Lightweight Verification
     verifier = LightweightVerifier()
-    validator = ProxyValidator()
+    validator = ProxyValidator(storage=storage, breakers=BreakerBoard())
     
     tasks = []
     
@@ -99,19 +110,54 @@ async def run_pipeline(targets: List[str], ports: str = None, skip_scan: bool =
     validation_tasks = [sem_process(c["ip"], c["port"]) for c in candidates]
     if validation_tasks:
         await asyncio.gather(*validation_tasks)
+
+    if hasattr(validator.timing_sink, "summary"):
+        logger.info(f"Validator timing summary: {validator.timing_sink.summary()}")
+    if validator.breakers.stats["tripped"]:
+        logger.info(f"Circuit breakers: {validator.breakers.summary()}")
+    validator.timing_sink.close()
+    await validator.geoip.close()
+    await storage.close()
         
     logger.info("Pipeline complete.")
 
 from proxy_manager.core.lifecycle import LifecycleManager
 from proxy_manager.core.gateway import ProxyGateway
+from proxy_manager.core.sites import SiteCompatChecker
+from proxy_manager.core.shards import ShardCoordinator
+
+def run_monitor_worker(sharded: bool):
+    """Entry point of one --monitor process; sharded workers split the proxies via worker_leases."""
+    storage = StorageManager()
+    lifecycle = LifecycleManager(storage, shards=ShardCoordinator(storage) if sharded else None)
+    try:
+        asyncio.run(lifecycle.start_monitor())
+    except KeyboardInterrupt:
+        logger.info("Monitor stopped.")
+
+async def show_workers():
+    async with StorageManager() as storage:
+        await storage.init_db()
+        workers = await storage.get_workers()
+        live = {w["worker_id"] for w in await storage.get_workers(live_within=settings.sharding.lease_ttl)}
+    if not workers:
+        logger.info("No monitor workers registered.")
+    for w in workers:
+        state = "live" if w["worker_id"] in live else "dead"
+        logger.info(f"  {w['worker_id']:<30} {state:<5} partitions={w['partitions']:<4} checked={w['checked']:<8} "
+                    f"errors={w['errors']:<6} rate={w['rate']}/s max_lag={int(w['max_lag_s'])}s")
 
 def main():
     parser = argparse.ArgumentParser(description="Advanced Proxy Management System")
     parser.add_argument("--scan", action="store_true", help="Run scan and validation pipeline")
     parser.add_argument("--import-file", type=str, help="Import IP:Port list from file and validate")
     parser.add_argument("--monitor", action="store_true", help="Start background lifecycle manager (infinite loop)")
-    parser.add_argument("--serve", action="store_true", help="Start local proxy gateway (localhost:8888)")
+    parser.add_argument("--processes", type=int, help="Monitor worker processes sharing the DB (overrides sharding.processes)")
+    parser.add_argument("--shard", action="store_true", help="Run --monitor as one shard worker, alongside other --monitor runs on the same DB")
+    parser.add_argument("--workers", action="store_true", help="Show sharded monitor workers and their completion rates")
+    parser.add_argument("--serve", action="store_true", help="Start local proxy gateway (HTTP on localhost:8888, SOCKS on :1080)")
     parser.add_argument("--reverify", action="store_true", help="One-shot re-verification of all saved proxies")
+    parser.add_argument("--check-sites", action="store_true", help="Refresh per-site compatibility verdicts for saved proxies")
     parser.add_argument("--targets", type=str, help="Comma separated list of IPs or CIDRs, or path to file")
     parser.add_argument("--ports", type=str, help="Comma separated list of ports (overrides config)")
     
@@ -125,14 +171,28 @@ def main():
              logger.info("Gateway stopped.")
         return
 
+    if args.workers:
+        asyncio.run(show_workers())
+        return
+
     if args.monitor:
         logger.info("Starting Lifecycle Monitor...")
         # Since windows doesn't support easy background daemon without service, we run loop here.
-        lifecycle = LifecycleManager()
+        processes = args.processes or settings.sharding.processes
+        if processes <= 1:
+            run_monitor_worker(sharded=args.shard)
+            return
+        import multiprocessing
+        logger.info(f"Starting {processes} sharded monitor workers.")
+        workers = [multiprocessing.Process(target=run_monitor_worker, args=(True,), daemon=False)
+                   for _ in range(processes)]
+        for proc in workers:
+            proc.start()
         try:
-             asyncio.run(lifecycle.start_monitor())
+            for proc in workers:
+                proc.join()
         except KeyboardInterrupt:
-             logger.info("Monitor stopped.")
+            logger.info("Monitor stopped.")
         return
 
     if args.reverify:
@@ -140,13 +200,29 @@ def main():
         lifecycle = LifecycleManager()
         async def run_reverify():
             await lifecycle.reverify_proxies()
-            # Stricter cleanup threshold for one-shot manual runs. 
-            # If a proxy drops from 100 to 80 on a manual sweep, purge it.
-            await lifecycle.cleanup_dead_proxies(threshold=90)
+            # Stricter cleanup threshold for one-shot manual runs.
+            await lifecycle.cleanup_dead_proxies(threshold=settings.health.strict_evict_below)
+            await lifecycle.storage.close()
         asyncio.run(run_reverify())
         logger.info("Re-verification complete.")
         return
 
+    if args.check_sites:
+        async def run_site_checks():
+            async with StorageManager() as storage:
+                await storage.init_db()
+                checker = SiteCompatChecker(storage)
+                if not checker.targets:
+                    logger.warning("No target sites configured under 'sites.targets' in settings.yaml")
+                    return
+                proxies = await storage.get_proxies(limit=1000)
+                logger.info(f"Checking {len(proxies)} proxies against {len(checker.targets)} target sites...")
+                summary = await checker.check_all(proxies)
+                for name, passed in summary.items():
+                    logger.info(f"  {name:<20}: {passed}/{len(proxies)} compatible")
+        asyncio.run(run_site_checks())
+        return
+
     if args.scan:
         # ... (existing scan logic)
         if not args.targets:
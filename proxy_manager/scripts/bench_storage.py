@@ -0,0 +1,130 @@
+import sys
+import os
+import argparse
+import asyncio
+import random
+import sqlite3
+import tempfile
+import time
+
+# Add project root
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(SCRIPT_DIR)
+PROJECT_ROOT = os.path.dirname(PACKAGE_DIR)
+sys.path.append(PROJECT_ROOT)
+
+from proxy_manager.core.storage import StorageManager
+
+# The proxies table as it existed before schema migrations (no ip_int, no indexes)
+LEGACY_SCHEMA = """
+    CREATE TABLE proxies (
+        ip TEXT, port INTEGER, protocol TEXT, anonymity TEXT, country TEXT,
+        region TEXT, city TEXT, isp TEXT, response_time_ms INTEGER,
+        last_checked TIMESTAMP, health_score INTEGER DEFAULT 100,
+        success_count INTEGER DEFAULT 0, fail_count INTEGER DEFAULT 0,
+        PRIMARY KEY (ip, port)
+    )
+"""
+
+# Representative reads from storage.py and the reporting scripts
+QUERIES = [
+    ("get_proxies (fastest 100)", "SELECT * FROM proxies ORDER BY response_time_ms ASC LIMIT 100"),
+    ("get_proxies(protocol=socks5)", "SELECT * FROM proxies WHERE protocol = 'socks5' ORDER BY response_time_ms ASC LIMIT 100"),
+    ("report: active count", "SELECT COUNT(*) FROM proxies WHERE health_score > 0"),
+    ("report: by ISP", "SELECT isp, COUNT(*) AS cnt FROM proxies WHERE health_score > 0 GROUP BY isp ORDER BY cnt DESC LIMIT 10"),
+    ("export: by anonymity", "SELECT anonymity, COUNT(*) FROM proxies WHERE health_score > 0 GROUP BY anonymity"),
+    ("export: live by speed", "SELECT ip, port, protocol, response_time_ms, anonymity, isp FROM proxies WHERE health_score > 0 ORDER BY response_time_ms ASC LIMIT 200"),
+    ("assess: country=ID", "SELECT ip, port, protocol, response_time_ms, health_score, anonymity, isp FROM proxies WHERE country = 'ID' AND health_score >= 90"),
+    ("lifecycle: stalest 500", "SELECT ip, port FROM proxies ORDER BY last_checked ASC LIMIT 500"),
+    ("subnet /24 (text LIKE)", "SELECT * FROM proxies WHERE ip LIKE '182.253.10.%'"),
+    ("subnet /24 (ip_int range)", "SELECT * FROM proxies WHERE ip_int BETWEEN 3070036480 AND 3070036735"),
+    ("delete_unhealthy candidates", "SELECT COUNT(*) FROM proxies WHERE health_score < 10"),
+]
+
+ISPS = ["biznet", "cbn", "firstmedia", "indihome", "myrepublic", "telkomsel", "tri", "xl", "Unknown"]
+PROTOCOLS = ["http", "https", "socks4", "socks5"]
+ANONYMITY = ["elite", "anonymous", "transparent"]
+COUNTRIES = ["ID"] * 6 + ["SG", "MY", "US", "XX"]
+
+def populate(path: str, rows: int):
+    rng = random.Random(42)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(LEGACY_SCHEMA)
+    batch = []
+    for i in range(rows):
+        ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        if i % 97 == 0:
+            ip = f"182.253.10.{i % 254 + 1}"
+        batch.append((
+            ip, rng.choice((80, 1080, 3128, 8080, 8888)) + i // 300000, rng.choice(PROTOCOLS),
+            rng.choice(ANONYMITY), rng.choice(COUNTRIES), "", "", rng.choice(ISPS),
+            rng.randint(50, 9000), f"2024-01-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00",
+            rng.choice((0, 0, 10, 40, 60, 80, 100)), rng.randint(0, 50), rng.randint(0, 50),
+        ))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT OR REPLACE INTO proxies VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT OR REPLACE INTO proxies VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", batch)
+    conn.commit()
+    conn.close()
+
+def time_queries(path: str, repeat: int):
+    conn = sqlite3.connect(path)
+    results = {}
+    for name, sql in QUERIES:
+        try:
+            conn.execute(sql).fetchall()  # warm the page cache
+        except sqlite3.OperationalError:
+            results[name] = None
+            continue
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(sql).fetchall()
+            best = min(best, time.perf_counter() - t0)
+        results[name] = best * 1000
+    conn.close()
+    return results
+
+async def migrate(path: str):
+    t0 = time.perf_counter()
+    async with StorageManager(path) as storage:
+        await storage.init_db()
+    return time.perf_counter() - t0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark proxies queries before and after the schema migrations")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query, best time is reported")
+    parser.add_argument("--db", help="Keep the benchmark database at this path instead of a temp dir")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.db or os.path.join(tmp, "bench.db")
+        if os.path.exists(path):
+            os.remove(path)
+
+        print(f"⏳ Populating {args.rows:,} rows (legacy schema)...")
+        t0 = time.perf_counter()
+        populate(path, args.rows)
+        print(f"   done in {time.perf_counter() - t0:.1f}s")
+
+        before = time_queries(path, args.repeat)
+        print("⏳ Running init_db migrations (ip_int backfill + indexes)...")
+        print(f"   done in {asyncio.run(migrate(path)):.1f}s")
+        after = time_queries(path, args.repeat)
+
+    print("-" * 72)
+    print(f"{'QUERY':<32} {'BEFORE (ms)':>12} {'AFTER (ms)':>12} {'SPEEDUP':>10}")
+    print("-" * 72)
+    for name, _ in QUERIES:
+        b, a = before[name], after[name]
+        b_txt = f"{b:.2f}" if b is not None else "n/a"
+        speedup = f"{b / a:.0f}x" if b is not None and a else "-"
+        print(f"{name:<32} {b_txt:>12} {a:>12.2f} {speedup:>10}")
+
+if __name__ == "__main__":
+    main()
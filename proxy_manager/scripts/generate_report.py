@@ -11,6 +11,7 @@ PROJECT_ROOT = os.path.dirname(PACKAGE_DIR)
 sys.path.append(PROJECT_ROOT)
 
 from proxy_manager.core.storage import StorageManager
+from proxy_manager.core.ranges import get_range_index
 
 async def generate_report():
     print(f"📊 PROXY REPORT - {datetime.now().strftime('%Y-%m-%d %H:%M')}")
@@ -44,6 +45,18 @@ async def generate_report():
                 print(f"   - {isp_name:<40} : {count}")
         print("-" * 60)
         
+        # 2b. By internal ISP range file (covers rows saved without GeoIP)
+        print("🗺️  BY ISP RANGE FILE:")
+        async with db.execute("SELECT DISTINCT ip FROM proxies WHERE health_score > 0") as cursor:
+            active_ips = [row[0] for row in await cursor.fetchall()]
+        by_range = {}
+        for label in get_range_index().lookup_many(active_ips).values():
+            label = label or "(outside range files)"
+            by_range[label] = by_range.get(label, 0) + 1
+        for label, count in sorted(by_range.items(), key=lambda kv: -kv[1]):
+            print(f"   - {label:<40} : {count}")
+        print("-" * 60)
+
         # 3. By Port (Top 5)
         print("🔌 TOP PORTS:")
         query_port = """
@@ -91,7 +104,26 @@ async def generate_report():
                     print(f"   - {pool.upper():<10} : {count}")
         except Exception:
             print("   (Pool table not found)")
-            
+        print("-" * 60)
+
+    # 6. Availability from the check history rollups
+    print("📈 AVAILABILITY (check history):")
+    try:
+        last_day = await storage.get_isp_availability(window=86400)
+        checks = sum(row["checks"] for row in last_day)
+        if not checks:
+            print("   (No rolled-up checks yet. Run --monitor for a while.)")
+        else:
+            ok = sum(row["ok"] for row in last_day)
+            print(f"   - Last 24h uptime : {ok / checks:.1%} over {checks} checks")
+            profile = await storage.get_hour_of_day_profile()
+            best = sorted(profile.items(), key=lambda kv: -kv[1])[:3]
+            print("   - Best UTC hours  : " + ", ".join(f"{hour:02d}:00 ({uptime:.0%})" for hour, uptime in best))
+    except Exception:
+        print("   (Check history not initialized yet)")
+    finally:
+        await storage.close()
+
     print("="*60)
 
 if __name__ == "__main__":
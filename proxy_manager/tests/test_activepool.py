@@ -0,0 +1,60 @@
+import asyncio
+import sys
+import os
+import tempfile
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.activepool import PoolManager
+from proxy_manager.core.relay import proxy_url
+from proxy_manager.core.rotation import RoundRobinSelector
+from proxy_manager.core.storage import StorageManager
+
+def test_pool_grows_with_load_benches_hot_upstreams_and_shrinks_back():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for i in range(30):
+                await storage.save_proxy({"ip": f"10.0.1.{i}", "port": 3128, "protocol": "http",
+                                          "anonymity": "elite", "country": "ID", "response_time_ms": 100})
+            pool = PoolManager(storage, RoundRobinSelector(), min_score=50)
+            pool.min_size = pool.size = 2
+            pool.max_size, pool.target_load, pool.overload_factor, pool.shrink_after = 10, 2, 2, 0
+
+            assert len(await pool.refresh()) == 2
+            assert pool.stats["refills"] == 1 and pool.stats["refill_ms"] > 0
+
+            # Nine requests in flight on two upstreams: the first one goes over 4 and is benched
+            held = [pool.select() for _ in range(9)]
+            hot = held[0]
+            assert proxy_url(hot) in pool.benched and hot not in pool.selector and pool.wakeup.is_set()
+            assert len(await pool.refresh()) == 4
+            metrics = pool.metrics()
+            assert metrics["target"] == 5 and metrics["active"] == 5 and metrics["size"] == 6
+            assert metrics["inflight"] == 9 and metrics["benched"] == 1
+
+            # Draining back to its target load returns it to rotation
+            hot_held = [p for p in held if p is hot]
+            for proxy in hot_held[:3]:
+                pool.release(proxy)
+            assert not pool.benched and hot in pool.selector
+
+            # Once demand drops the least healthy idle members are retired, down to the minimum
+            for proxy in hot_held[3:] + [p for p in held if p is not hot]:
+                pool.release(proxy)
+            for _ in range(3):
+                await pool.refresh()
+            assert pool.metrics()["inflight"] == 0
+            assert len(pool) == 2 and len(pool.selector) == 2 and pool.stats["retired"] == 4
+
+            # Eviction frees a slot that the next refresh fills from storage
+            assert pool.rescore(pool.members[0], 10) and len(pool) == 1
+            assert len(await pool.refresh()) == 1 and pool.stats["evicted"] == 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_pool_grows_with_load_benches_hot_upstreams_and_shrinks_back()
+    print(">>> TEST SUCCESS: Load-aware gateway pool verified.")
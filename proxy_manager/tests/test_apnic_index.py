@@ -0,0 +1,50 @@
+import sys
+import os
+import tempfile
+
+# Add project root to path to import the utils scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from utils.apnic_parser import refresh_index, DelegatedIndex
+
+SAMPLE = """2|apnic|20240101|5|19830613|20231231|+1000
+# comment line
+apnic|*|ipv4|*|4|summary
+apnic|ID|ipv4|103.2.160.0|1024|20130527|allocated
+apnic|ID|ipv4|103.3.0.0|768|20130527|assigned
+apnic|SG|ipv4|103.4.0.0|256|20130527|allocated
+apnic|ID|ipv6|2001:df0::|48|20130527|allocated
+apnic||ipv4|103.5.0.0|256||reserved
+"""
+
+def test_build_lookup_and_expand():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "delegated-apnic-latest")
+        index_path = os.path.join(tmp, "apnic.idx")
+        with open(source, "w") as f:
+            f.write(SAMPLE)
+
+        assert refresh_index(source, index_path) is True
+        # Same serial: nothing to rebuild
+        assert refresh_index(source, index_path) is False
+
+        index = DelegatedIndex(index_path)
+        try:
+            assert len(index) == 3
+            assert index.serial == 20240101
+            assert index.country_of("103.2.163.255") == "ID"
+            assert index.country_of("103.4.0.9") == "SG"
+            assert index.country_of("103.5.0.1") is None
+            assert index.countries_of(["103.4.0.1", "8.8.8.8", "103.3.2.255"]) == ["SG", None, "ID"]
+            # 768 addresses is not a power of two: exact expansion is a /23 plus a /24
+            assert index.cidrs_for("ID") == ["103.2.160.0/22", "103.3.0.0/23", "103.3.2.0/24"]
+        finally:
+            index.close()
+
+        with open(source, "w") as f:
+            f.write(SAMPLE.replace("20240101", "20240102"))
+        assert refresh_index(source, index_path) is True
+
+if __name__ == "__main__":
+    test_build_lookup_and_expand()
+    print(">>> TEST SUCCESS: Delegated index verified.")
@@ -0,0 +1,123 @@
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.breaker import BreakerBoard, CLOSED, OPEN, HALF_OPEN
+from proxy_manager.core.config import settings
+from proxy_manager.core.lifecycle import LifecycleManager
+from proxy_manager.core.storage import StorageManager
+from proxy_manager.core.validator import ProxyValidator
+
+NOW = 1_700_000_000
+
+def test_trips_probes_canaries_and_recovers():
+    cfg = settings.breaker
+    board = BreakerBoard()
+    # Successes in between keep a /24 closed as long as the failure ratio is low
+    for i in range(cfg.min_failures * 2):
+        board.record(f"10.1.1.{i}", None, route_failed=i % 2 == 0, now=NOW)
+    assert board.acquire("10.1.1.200", now=NOW) is None
+
+    for i in range(cfg.min_failures):
+        board.record(f"10.0.0.{i}", "biznet", route_failed=True, now=NOW + i)
+    blocker = board.acquire("10.0.0.99", "biznet", now=NOW + 10)
+    assert blocker is not None and blocker.key == "net:10.0.0" and blocker.state == OPEN
+    assert board.acquire("10.0.1.1", "biznet", now=NOW + 10) is None  # ISP needs more evidence
+
+    # Cooled down: exactly `canaries` checks go through, and failing they reopen it for longer
+    later = NOW + cfg.min_failures + cfg.cooldown_s
+    assert [board.acquire(f"10.0.0.{i}", now=later) is None for i in range(cfg.canaries + 1)] == [True] * cfg.canaries + [False]
+    assert blocker.state == HALF_OPEN
+    for i in range(cfg.canaries):
+        board.record(f"10.0.0.{i}", None, route_failed=True, now=later)
+    assert blocker.state == OPEN and blocker.cooldown == 2 * cfg.cooldown_s
+
+    later = blocker.retry_at
+    assert board.acquire("10.0.0.5", now=later) is None
+    board.record("10.0.0.5", None, route_failed=False, now=later)
+    assert blocker.state == CLOSED and board.acquire("10.0.0.6", now=later) is None
+    assert board.stats["tripped"] == 2 and board.stats["recovered"] == 1
+
+def test_failures_after_a_run_of_successes_stay_under_the_ratio():
+    cfg = settings.breaker
+    board = BreakerBoard()
+    for i in range(100):
+        board.record(f"10.0.0.{i}", None, route_failed=False, now=NOW)
+    for i in range(cfg.min_failures):
+        board.record(f"10.0.0.{100 + i}", None, route_failed=True, now=NOW + 1)
+    assert board.breakers["net:10.0.0"].state == CLOSED
+    assert board.acquire("10.0.0.250", now=NOW + 2) is None and board.stats["tripped"] == 0
+
+    # Once the successes have left the window the same failures do trip it
+    later = NOW + cfg.window_s + 10
+    for i in range(cfg.min_failures):
+        board.record(f"10.0.0.{i}", None, route_failed=True, now=later)
+    assert board.breakers["net:10.0.0"].state == OPEN
+
+def test_validator_counts_one_outcome_per_candidate():
+    async def run():
+        validator = ProxyValidator(breakers=BreakerBoard())
+
+        async def route_down(ip, port, protocol, skip_geoip=False):
+            return None, True
+        validator._check = route_down
+        for i in range(settings.breaker.min_failures - 1):
+            assert await validator.validate_all_protocols(f"10.0.0.{i}", 8080) == []
+        # Three protocols each, but only one route failure per candidate so far
+        breaker = validator.breakers.breakers["net:10.0.0"]
+        assert breaker.state == CLOSED and len(breaker.events) == settings.breaker.min_failures - 1
+
+        await validator.validate_all_protocols("10.0.0.200", 8080)
+        assert breaker.state == OPEN
+        assert await validator.check_proxy("10.0.0.201", 8080, "http") is None
+        assert validator.breakers.stats["skipped"] == 1
+
+    asyncio.run(run())
+
+def test_outage_parks_the_subnet_instead_of_failing_every_proxy():
+    class DownRoute:
+        def __init__(self):
+            self.calls = 0
+
+        async def handshake(self, ip, port, protocol, host, target_port=443):
+            self.calls += 1
+            return False, None, "timeout"
+
+    async def run(db_path):
+        storage = StorageManager(db_path)
+        await storage.init_db()
+        now = int(time.time())
+        for i in range(40):
+            await storage.save_proxy({
+                "ip": f"10.0.0.{i}", "port": 8080, "protocol": "http", "anonymity": "elite",
+                "country": "ID", "isp": "biznet", "response_time_ms": 100, "health_score": 100,
+                "next_check_at": now - 100 + i,
+            })
+
+        lifecycle = LifecycleManager(storage)
+        lifecycle.verifier = DownRoute()
+        lifecycle.scheduler.workers = 1
+        assert await lifecycle.scheduler.run_once(due_only=True) == 40
+
+        # Only the failures that tripped the breaker were spent (and count against health)
+        assert lifecycle.verifier.calls == settings.breaker.min_failures
+        penalized = [p async for p in storage.iter_proxies() if p["fail_count"]]
+        assert len(penalized) == settings.breaker.min_failures - 1
+        # The rest of the /24 waits for the canaries, nothing is due before that
+        assert [p async for p in storage.iter_proxies(due_before=now + settings.breaker.cooldown_s - 10)] == []
+        await storage.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_trips_probes_canaries_and_recovers()
+    test_failures_after_a_run_of_successes_stay_under_the_ratio()
+    test_validator_counts_one_outcome_per_candidate()
+    test_outage_parks_the_subnet_instead_of_failing_every_proxy()
+    print(">>> TEST SUCCESS: Circuit breakers verified.")
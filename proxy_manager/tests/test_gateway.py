@@ -0,0 +1,418 @@
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.gateway import ProxyGateway
+from proxy_manager.core.rotation import RoundRobinSelector
+from proxy_manager.core.storage import StorageManager
+
+async def fake_http_proxy(reader, writer):
+    """Upstream HTTP proxy: CONNECT opens an echo tunnel, absolute-form GETs echo their head."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    if head.startswith(b"CONNECT tunnel.test:443 "):
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    else:
+        body = head + await reader.readexactly(4) if b"Content-Length: 4" in head else head
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        await writer.drain()
+    writer.close()
+
+def test_connect_tunnel_and_plain_forwarding():
+    async def run(db_path):
+        upstream = await asyncio.start_server(fake_http_proxy, "127.0.0.1", 0)
+        upstream_port = upstream.sockets[0].getsockname()[1]
+        gateway = ProxyGateway(port=1, storage=StorageManager(db_path))
+        gateway.set_pool([{"ip": "127.0.0.1", "port": upstream_port, "protocol": "http", "health_score": 100}])
+        server = await asyncio.start_server(gateway.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            # HTTPS-style tunnel: bytes after the 200 go straight through
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"CONNECT tunnel.test:443 HTTP/1.1\r\nHost: tunnel.test:443\r\n\r\n")
+            assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 200 Connection established\r\n\r\n"
+            payload = os.urandom(300_000)
+            writer.write(payload)
+            assert await reader.readexactly(len(payload)) == payload
+            writer.close()
+
+            # Plain HTTP: hop-by-hop headers dropped, body passed through, upstream kept alive
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST http://plain.test/form?a=1 HTTP/1.1\r\nHost: plain.test\r\n"
+                         b"Proxy-Connection: keep-alive\r\nConnection: close\r\nContent-Length: 4\r\n\r\nbody")
+            response = await reader.read()
+            assert response.startswith(b"HTTP/1.1 200 OK") and b"Connection: close\r\n\r\n" in response
+            assert b"POST http://plain.test/form?a=1 HTTP/1.1" in response and response.endswith(b"body")
+            assert b"Proxy-Connection" not in response and b"Connection: keep-alive" in response
+            writer.close()
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /relative HTTP/1.1\r\n\r\n")
+            assert (await reader.read()).startswith(b"HTTP/1.1 400")
+            assert gateway.stats["tunnels"] == 1 and gateway.stats["forwarded"] == 1
+            assert gateway.stats["bytes_up"] >= len(payload)
+        finally:
+            server.close()
+            upstream.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+async def fake_keepalive_proxy(reader, writer):
+    """Upstream HTTP proxy serving several requests per connection, alternating length and chunked framing."""
+    fake_keepalive_proxy.connections += 1
+    served = 0
+    while True:
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            break
+        served += 1
+        body = b"request %d" % served
+        if served % 2:
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+        else:
+            writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"%x\r\n%s\r\n0\r\n\r\n" % (len(body), body))
+        await writer.drain()
+    writer.close()
+fake_keepalive_proxy.connections = 0
+
+def test_keep_alive_reuses_upstream_connections_and_warm_tunnels():
+    async def run(db_path):
+        upstream = await asyncio.start_server(fake_keepalive_proxy, "127.0.0.1", 0)
+        upstream_port = upstream.sockets[0].getsockname()[1]
+        tunnels = await asyncio.start_server(fake_http_proxy, "127.0.0.1", 0)
+        tunnel_port = tunnels.sockets[0].getsockname()[1]
+        gateway = ProxyGateway(port=1, storage=StorageManager(db_path))
+        gateway.set_pool([{"ip": "127.0.0.1", "port": upstream_port, "protocol": "http", "health_score": 100}])
+        server = await asyncio.start_server(gateway.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            # Three requests on two client connections share one upstream connection
+            for requests in (2, 1):
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                for _ in range(requests):
+                    writer.write(b"GET http://plain.test/ HTTP/1.1\r\nHost: plain.test\r\n\r\n")
+                    head = await reader.readuntil(b"\r\n\r\n")
+                    assert head.startswith(b"HTTP/1.1 200 OK") and b"Connection: keep-alive" in head
+                    if b"chunked" in head:
+                        assert await reader.readuntil(b"0\r\n\r\n") == b"9\r\nrequest 2\r\n0\r\n\r\n"
+                    else:
+                        assert await reader.readexactly(9) in (b"request 1", b"request 3")
+                writer.close()
+            assert fake_keepalive_proxy.connections == 1
+            assert gateway.upstreams.stats["opened"] == 1 and gateway.upstreams.stats["reused"] == 2
+
+            # A requested CONNECT destination gets a spare tunnel for the next client
+            gateway.set_pool([{"ip": "127.0.0.1", "port": tunnel_port, "protocol": "http", "health_score": 100}])
+            gateway.warm.note("tunnel.test", 443)
+            await gateway.warm.refill()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"CONNECT tunnel.test:443 HTTP/1.1\r\nHost: tunnel.test:443\r\n\r\n")
+            assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 200 Connection established\r\n\r\n"
+            writer.write(b"warm")
+            assert await reader.readexactly(4) == b"warm"
+            writer.close()
+            assert gateway.warm.stats["hits"] == 1
+        finally:
+            gateway.upstreams.close()
+            gateway.warm.close()
+            server.close()
+            upstream.close()
+            tunnels.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+async def hanging_up_proxy(reader, writer):
+    """Upstream that takes the request and drops the connection without answering."""
+    await reader.readuntil(b"\r\n\r\n")
+    writer.close()
+
+async def slow_proxy(reader, writer):
+    await asyncio.sleep(0.5)
+    await fake_http_proxy(reader, writer)
+
+def test_failover_and_hedging_across_upstreams():
+    async def run(db_path):
+        servers = [await asyncio.start_server(handler, "127.0.0.1", 0)
+                   for handler in (fake_http_proxy, hanging_up_proxy, slow_proxy)]
+        good, hangs_up, slow = [{"ip": "127.0.0.1", "port": srv.sockets[0].getsockname()[1], "protocol": "http",
+                                 "health_score": 100} for srv in servers]
+        probe = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        refused = {"ip": "127.0.0.1", "port": probe.sockets[0].getsockname()[1], "protocol": "http", "health_score": 100}
+        probe.close()
+        await probe.wait_closed()
+
+        gateway = ProxyGateway(port=1, storage=StorageManager(db_path))
+        gateway.pool.selector = RoundRobinSelector()
+        server = await asyncio.start_server(gateway.handle_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def request(raw):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(raw)
+            response = await reader.read()
+            writer.close()
+            return response
+
+        try:
+            # Connection refused: the tunnel is opened through the next upstream
+            gateway.set_pool([refused, good])
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"CONNECT tunnel.test:443 HTTP/1.1\r\n\r\n")
+            assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 200 Connection established\r\n\r\n"
+            writer.close()
+            assert gateway.stats["failovers"] == 1
+
+            # Dropped after sending: a GET is retried elsewhere, a POST is not
+            gateway.pool.selector = RoundRobinSelector()
+            gateway.set_pool([hangs_up, good])
+            response = await request(b"GET http://plain.test/ HTTP/1.1\r\nConnection: close\r\n\r\n")
+            assert response.startswith(b"HTTP/1.1 200 OK") and gateway.stats["failovers"] == 2
+            response = await request(b"POST http://plain.test/ HTTP/1.1\r\nConnection: close\r\n"
+                                     b"Content-Length: 4\r\n\r\nbody")
+            assert response.startswith(b"HTTP/1.1 502") and gateway.stats["failovers"] == 2
+
+            # A client hanging up mid-body is its own fault: no failover, no 502, no mark on the upstream
+            gateway.retry_body_bytes = 0
+            gateway.set_pool([good, hangs_up])
+            failed, errors = gateway.passive.stats["failed"], gateway.stats["errors"]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST http://plain.test/ HTTP/1.1\r\nContent-Length: 100\r\n\r\npartial")
+            writer.write_eof()
+            assert await reader.read() == b""
+            writer.close()
+            assert gateway.stats["failovers"] == 2 and gateway.stats["errors"] == errors
+            assert gateway.passive.stats["failed"] == failed and gateway.pool.metrics()["inflight"] == 0
+
+            # A slow first upstream is raced by a second one after hedge_after
+            gateway.hedge_after = 0.05
+            gateway.pool.selector = RoundRobinSelector()
+            gateway.set_pool([slow, good])
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"CONNECT tunnel.test:443 HTTP/1.1\r\n\r\n")
+            assert await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 0.4)
+            writer.close()
+            assert gateway.stats["hedges"] == 1 and gateway.stats["hedge_wins"] == 1
+            await asyncio.sleep(0.6)  # Let the losing attempt finish and be closed
+        finally:
+            gateway.upstreams.close()
+            server.close()
+            for srv in servers:
+                srv.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_live_traffic_feeds_health_and_skips_busy_upstreams_in_probes():
+    async def run(db_path):
+        upstream = await asyncio.start_server(fake_http_proxy, "127.0.0.1", 0)
+        probe = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        refused_port, good_port = probe.sockets[0].getsockname()[1], upstream.sockets[0].getsockname()[1]
+        probe.close()
+        await probe.wait_closed()
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for port in (refused_port, good_port, 9):
+                await storage.save_proxy({"ip": "127.0.0.1", "port": port, "protocol": "http", "anonymity": "elite",
+                                          "country": "ID", "response_time_ms": 100})
+            gateway = ProxyGateway(port=1, storage=storage)
+            gateway.pool.selector = RoundRobinSelector()
+            by_port = {p["port"]: p for p in await storage.get_healthiest(limit=3)}
+            refused, good, unused = by_port[refused_port], by_port[good_port], by_port[9]
+            gateway.set_pool([refused, good, unused])
+            server = await asyncio.start_server(gateway.handle_client, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(b"CONNECT tunnel.test:443 HTTP/1.1\r\n\r\n")
+                assert (await reader.readuntil(b"\r\n\r\n")).startswith(b"HTTP/1.1 200")
+                writer.close()
+                assert gateway.passive.stats == {"ok": 1, "failed": 1, "flushes": 0}
+
+                # Only the upstream that saw no traffic is left for active probing
+                assert not gateway.passive.idle(good) and not gateway.passive.idle(refused)
+                assert gateway.passive.idle(unused)
+
+                scored = {p["port"]: score for p, score in await gateway.passive.flush()}
+                assert scored[good_port] > scored[refused_port]
+                stored = await storage.get_proxy("127.0.0.1", good_port)
+                assert stored["last_ok"] == 1 and stored["health_samples"] > 0
+                assert (await storage.get_proxy("127.0.0.1", refused_port))["last_ok"] == 0
+            finally:
+                server.close()
+                upstream.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_passive_health_builds_on_the_monitors_state():
+    async def run(db_path):
+        async with StorageManager(db_path) as monitor, StorageManager(db_path) as storage:
+            await monitor.init_db()
+            for i in range(2):
+                await monitor.save_proxy({"ip": f"10.0.0.{i}", "port": 8080, "protocol": "http",
+                                          "anonymity": "elite", "country": "ID", "response_time_ms": 100})
+            await monitor.flush()
+            gateway = ProxyGateway(port=1, storage=storage)
+            assert len(await gateway.pool.refresh()) == 2
+            dying, healthy = sorted(gateway.pool.members, key=lambda p: p["ip"])
+
+            # The monitor process keeps checking after the pool loaded its copies
+            row = await monitor.get_proxy("10.0.0.0", 8080)
+            for _ in range(4):
+                await monitor.record_outcome(row, False)
+            row = await monitor.get_proxy("10.0.0.1", 8080)
+            for _ in range(4):
+                await monitor.record_outcome(row, True, 120)
+            await monitor.flush()
+            assert row["state"] == "active" and (await monitor.get_proxy("10.0.0.0", 8080))["state"] == "quarantine"
+
+            gateway.passive.record(dying, True, 80)
+            gateway.passive.record(healthy, True, 80)
+            scored = {p["ip"]: score for p, score in await gateway.passive.flush()}
+            await storage.flush()
+
+            # The quarantined row is left as the monitor wrote it, and the pool lets it go
+            stored = await monitor.get_proxy("10.0.0.0", 8080)
+            assert stored["state"] == "quarantine" and stored["consecutive_fails"] == 4 and stored["success_count"] == 1
+            assert scored["10.0.0.0"] == 0 and dying["state"] == "quarantine"
+            await gateway._rescore(dying, scored["10.0.0.0"])
+            assert dying not in gateway.pool
+
+            # The active one gets the sample on top of the monitor's five
+            stored = await monitor.get_proxy("10.0.0.1", 8080)
+            assert round(stored["health_samples"]) == 6 and stored["success_count"] == 6
+            assert scored["10.0.0.1"] == stored["health_score"] and healthy["health_samples"] == stored["health_samples"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_bounded_probe_sweeps_evict_and_refill_incrementally():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for i in range(6):
+                await storage.save_proxy({"ip": f"10.0.0.{i}", "port": 8080, "protocol": "http",
+                                          "anonymity": "elite", "country": "ID", "response_time_ms": 100})
+            gateway = ProxyGateway(port=1, storage=storage)
+            gateway.pool.min_size = gateway.pool.size = 3
+            gateway.probe_concurrency = 2
+            in_flight, peak = 0, 0
+
+            async def ping(url):
+                nonlocal in_flight, peak
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.1)
+                in_flight -= 1
+                return not url.startswith(dead)
+            gateway._ping_proxy = ping
+
+            for proxy in await gateway.pool.refresh():
+                gateway._schedule_probe(proxy, time.monotonic())
+            assert len(gateway.pool) == 3 and len(gateway.pool.selector) == 3
+            now = time.monotonic()
+            spread = gateway.probe_interval * gateway.probe_jitter
+            assert all(abs(at - now - gateway.probe_interval) <= spread + 1 for at in gateway._probe_at.values())
+
+            # One dead proxy out of three, pinged two at a time
+            dead = f"http://{gateway.pool.members[0]['ip']}:"
+            await gateway._sweep(list(gateway.pool.members))
+            assert peak == 2 and 0.15 < gateway.stats["sweep_s"] < 0.5
+            assert len(gateway.pool) == 2 and gateway.pool.stats["evicted"] == 1 and gateway.pool.wakeup.is_set()
+
+            # Only the gap is refilled, and not with the proxy just evicted
+            kept = [p["ip"] for p in gateway.pool.members]
+            await gateway.pool.refresh()
+            ips = [p["ip"] for p in gateway.pool.members]
+            assert ips[:2] == kept and len(ips) == 3 and f"http://{ips[2]}:" != dead
+            assert gateway.pool.stats["added"] == 4
+
+            # A member quarantined by the monitor meanwhile is not probed back to active, just dropped
+            quarantined = gateway.pool.members[0]
+            async with storage._write() as db:
+                await db.execute("UPDATE proxies SET state = 'quarantine', quarantined_at = 1 WHERE ip = ?",
+                                 (quarantined["ip"],))
+                await db.commit()
+            await gateway._sweep([quarantined])
+            stored = await storage.get_proxy(quarantined["ip"], 8080)
+            assert stored["state"] == "quarantine" and stored["quarantined_at"] == 1
+            assert quarantined not in gateway.pool and gateway.pool.stats["evicted"] == 2
+            await gateway.pool.refresh()
+            assert len(gateway.pool) == 3 and quarantined["ip"] not in [p["ip"] for p in gateway.pool.members]
+
+            # In the monitor loop an eviction during a sweep wakes it for the refill right away
+            gateway.probe_interval = gateway.pool_refresh_interval = 60
+            gateway._probe_at.clear()
+            dead = f"http://{ips[2]}:"  # Not pinged yet, so one miss evicts it
+            monitor = asyncio.create_task(gateway._health_monitor())
+            try:
+                for _ in range(40):
+                    await asyncio.sleep(0.05)
+                    if gateway.pool.stats["evicted"] == 3 and len(gateway.pool) == 3:
+                        break
+                assert gateway.pool.stats["evicted"] == 3 and len(gateway.pool) == 3
+            finally:
+                monitor.cancel()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_socks_listener_relays_through_the_pool():
+    async def run(db_path):
+        upstream = await asyncio.start_server(fake_http_proxy, "127.0.0.1", 0)
+        upstream_port = upstream.sockets[0].getsockname()[1]
+        gateway = ProxyGateway(port=1, storage=StorageManager(db_path))
+        gateway.set_pool([{"ip": "127.0.0.1", "port": upstream_port, "protocol": "http", "health_score": 100}])
+        server = await asyncio.start_server(gateway.handle_socks_client, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            # SOCKS5 with a domain name, passed on for the upstream to resolve
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"\x05\x01\x00")
+            assert await reader.readexactly(2) == b"\x05\x00"
+            writer.write(b"\x05\x01\x00\x03\x0btunnel.test\x01\xbb")
+            assert (await reader.readexactly(10))[:2] == b"\x05\x00"
+            writer.write(b"ping")
+            assert await reader.readexactly(4) == b"ping"
+            writer.close()
+
+            # SOCKS4a: 0.0.0.1 plus a hostname after the user id
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"\x04\x01\x01\xbb\x00\x00\x00\x01user\x00tunnel.test\x00")
+            assert (await reader.readexactly(8))[:2] == b"\x00\x5a"
+            writer.write(b"pong")
+            assert await reader.readexactly(4) == b"pong"
+            writer.close()
+
+            # BIND is not supported
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"\x05\x01\x00\x05\x02\x00\x01\x7f\x00\x00\x01\x00\x50")
+            assert (await reader.read())[:4] == b"\x05\x00\x05\x07"
+            assert gateway.stats["socks"] == 2
+        finally:
+            server.close()
+            upstream.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_connect_tunnel_and_plain_forwarding()
+    test_keep_alive_reuses_upstream_connections_and_warm_tunnels()
+    test_failover_and_hedging_across_upstreams()
+    test_live_traffic_feeds_health_and_skips_busy_upstreams_in_probes()
+    test_passive_health_builds_on_the_monitors_state()
+    test_bounded_probe_sweeps_evict_and_refill_incrementally()
+    test_socks_listener_relays_through_the_pool()
+    print(">>> TEST SUCCESS: Gateway HTTP and SOCKS tunnelling and connection reuse verified.")
@@ -0,0 +1,95 @@
+import asyncio
+import sys
+import os
+import time
+import aiohttp
+from aiohttp import web
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.geoip import IpApiBatchClient
+
+class FakeIpApi:
+    """Mimics ip-api.com/batch: a per-window request budget advertised via X-Rl/X-Ttl."""
+    def __init__(self, limit: int, window: float, fail_first: int = 0, drop=()):
+        self.limit = limit
+        self.window = window
+        self.fail_first = fail_first
+        self.drop = set(drop)  # IPs the API silently leaves out of every reply
+        self.window_start = time.monotonic()
+        self.used = 0
+        self.requests = 0
+        self.over_limit = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self.window_start, self.used = now, 0
+        ttl = max(0, int(round(self.window - (now - self.window_start))))
+        if self.used >= self.limit:
+            self.over_limit += 1
+            return web.Response(status=429, headers={"X-Rl": "0", "X-Ttl": str(ttl)})
+        self.used += 1
+        headers = {"X-Rl": str(self.limit - self.used), "X-Ttl": str(ttl)}
+        if self.fail_first > 0:
+            self.fail_first -= 1
+            return web.Response(status=503, headers=headers)
+        payload = await request.json()
+        items = [{"query": q["query"], "status": "success", "countryCode": "ID", "country": "Indonesia",
+                  "isp": "Biznet"} for q in payload if q["query"] not in self.drop]
+        return web.json_response(items, headers=headers)
+
+async def run_batch(ips, server: FakeIpApi, **client_kwargs):
+    app = web.Application()
+    app.router.add_post("/batch", server.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        async with aiohttp.ClientSession() as session:
+            client = IpApiBatchClient(session, url=f"http://127.0.0.1:{port}/batch", **client_kwargs)
+            results = await client.resolve(ips)
+            return client, results
+    finally:
+        await runner.cleanup()
+
+def test_batch_respects_rate_limit_without_gaps():
+    ips = [f"10.0.{i // 250}.{i % 250}" for i in range(20)]
+    server = FakeIpApi(limit=4, window=1)
+    client, results = asyncio.run(run_batch(ips, server, chunk_size=2, max_in_flight=3, window_limit=4))
+
+    assert set(results) == set(ips)
+    assert all(r["country"] == "ID" for r in results.values())
+    assert not client.failed
+    # 10 chunks at 4 per window: paused on X-Ttl rather than hammering the API
+    assert server.over_limit <= 1
+
+def test_batch_retries_transient_errors():
+    ips = [f"10.1.0.{i}" for i in range(6)]
+    server = FakeIpApi(limit=100, window=60, fail_first=2)
+    client, results = asyncio.run(run_batch(ips, server, chunk_size=3, max_in_flight=2, max_retries=3))
+
+    assert set(results) == set(ips)
+    assert all(r["country"] == "ID" for r in results.values())
+    assert not client.failed
+
+def test_batch_gives_up_on_ips_the_api_keeps_dropping():
+    ips = [f"10.2.0.{i}" for i in range(6)]
+    server = FakeIpApi(limit=100, window=60, drop={"10.2.0.4"})
+    client, results = asyncio.run(run_batch(ips, server, chunk_size=3, max_in_flight=2, max_retries=2))
+
+    assert set(results) == set(ips)
+    assert [ip for ip, r in results.items() if r["country"] != "ID"] == ["10.2.0.4"]
+    assert client.failed == {"10.2.0.4"}
+    # Two chunks, then the dropped IP alone until max_retries runs out
+    assert server.requests == 2 + 2
+
+if __name__ == "__main__":
+    test_batch_respects_rate_limit_without_gaps()
+    test_batch_retries_transient_errors()
+    test_batch_gives_up_on_ips_the_api_keeps_dropping()
+    print(">>> TEST SUCCESS: Batch GeoIP client verified.")
@@ -0,0 +1,75 @@
+import sys
+import os
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core import health
+from proxy_manager.core.config import settings
+
+NOW = 1_700_000_000
+
+def run(outcomes, latency=400):
+    proxy = {}
+    for i, ok in enumerate(outcomes):
+        health.observe(proxy, ok, latency if ok else None, now=NOW + i * 60)
+    return proxy
+
+def test_one_timeout_does_not_wipe_a_good_proxy():
+    good = run([True] * 20)
+    before = good["health_score"]
+    health.observe(good, False, now=NOW + 20 * 60)
+    assert before - good["health_score"] < 15
+    assert good["health_score"] > settings.health.gateway_min_score
+    assert not health.is_dead(good, now=NOW + 20 * 60)
+
+def test_flapping_proxy_ranks_below_stable_one():
+    stable = run([True] * 20)
+    flapping = run([True, False] * 10)
+    assert health.score(flapping, NOW + 1200) < settings.health.gateway_min_score < health.score(stable, NOW + 1200)
+    dead = run([False] * 6)
+    assert health.is_dead(dead, now=NOW + 360)
+
+def test_confidence_and_time_decay():
+    # One success is not worth as much as twenty
+    assert run([True])["health_score"] < run([True] * 20)["health_score"]
+    # Evidence fades towards the prior when nobody checks the proxy
+    dead = run([False] * 10)
+    much_later = NOW + 10 * settings.health.decay_half_life
+    assert health.score(dead, NOW + 600) < settings.health.evict_below
+    assert abs(health.success_rate(dead, much_later) - settings.health.prior) < 0.01
+    assert not health.is_dead(dead, now=much_later)
+
+def test_seed_from_lifetime_counters():
+    proxy = {"success_count": 40, "fail_count": 2, "response_time_ms": 300}
+    health.seed_from_counts(proxy, now=NOW)
+    assert proxy["health_samples"] == settings.health.max_seed_samples
+    assert proxy["health_score"] > settings.health.gateway_min_score
+
+def test_quarantine_backoff_and_release():
+    cfg = settings.health
+    proxy = run([True] * 10)
+    for i in range(cfg.quarantine_after):
+        health.observe(proxy, False, now=NOW + 1000 + i)
+    assert proxy["state"] == health.QUARANTINE
+    first = health.quarantine_backoff(proxy)
+    health.observe(proxy, False, now=NOW + 2000)
+    assert health.quarantine_backoff(proxy) == 2 * first
+    for i in range(40):
+        health.observe(proxy, False, now=NOW + 3000 + i)
+    assert health.quarantine_backoff(proxy) == cfg.quarantine_max_s
+
+    # One lucky check is not enough to come back
+    health.observe(proxy, True, 300, now=NOW + 5000)
+    assert proxy["state"] == health.QUARANTINE
+    for i in range(cfg.release_after - 1):
+        health.observe(proxy, True, 300, now=NOW + 5001 + i)
+    assert proxy["state"] == health.ACTIVE and proxy["quarantined_at"] is None
+
+if __name__ == "__main__":
+    test_one_timeout_does_not_wipe_a_good_proxy()
+    test_flapping_proxy_ranks_below_stable_one()
+    test_confidence_and_time_decay()
+    test_seed_from_lifetime_counters()
+    test_quarantine_backoff_and_release()
+    print(">>> TEST SUCCESS: Health model verified.")
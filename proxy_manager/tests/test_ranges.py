@@ -0,0 +1,41 @@
+import sys
+import os
+import tempfile
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.ranges import RangeIndex
+
+def write(path, lines):
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+def test_most_specific_prefix_wins():
+    with tempfile.TemporaryDirectory() as tmp:
+        write(os.path.join(tmp, "biznet.txt"), ["# Biznet", "182.253.0.0/16"])
+        write(os.path.join(tmp, "datacenter.txt"), ["182.253.10.0/24", "103.105.80.0/22", "not-a-range"])
+        index = RangeIndex(tmp)
+
+        assert index.lookup("182.253.10.7") == "datacenter"
+        assert index.lookup("182.253.9.255") == "biznet"
+        assert index.lookup("182.253.11.0") == "biznet"
+        assert index.lookup("103.105.83.255") == "datacenter"
+        assert index.lookup("8.8.8.8") is None
+        assert index.lookup("not-an-ip") is None
+        assert index.lookup_many(["182.253.10.1", "1.1.1.1"]) == {"182.253.10.1": "datacenter", "1.1.1.1": None}
+
+def test_rebuilds_when_range_file_changes():
+    with tempfile.TemporaryDirectory() as tmp:
+        write(os.path.join(tmp, "cbn.txt"), ["202.152.0.0/17"])
+        index = RangeIndex(tmp, check_interval=0)
+        assert index.lookup("10.0.0.1") is None
+
+        write(os.path.join(tmp, "lab.txt"), ["10.0.0.0/8"])
+        assert index.lookup("10.0.0.1") == "lab"
+        assert index.lookup("202.152.1.1") == "cbn"
+
+if __name__ == "__main__":
+    test_most_specific_prefix_wins()
+    test_rebuilds_when_range_file_changes()
+    print(">>> TEST SUCCESS: ISP range index verified.")
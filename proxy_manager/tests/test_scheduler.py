@@ -0,0 +1,93 @@
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.config import settings
+from proxy_manager.core.scheduler import ReverifyScheduler, check_interval
+from proxy_manager.core.storage import StorageManager
+
+def test_interval_follows_health_tier_and_volatility():
+    cfg = settings.scheduler
+    stable_fast = {"response_time_ms": 300, "health_score": 100, "success_count": 50, "fail_count": 0}
+    flaky_fast = dict(stable_fast, health_score=60, success_count=25, fail_count=25)
+    dying_slow = {"response_time_ms": 5000, "health_score": 20, "success_count": 0, "fail_count": 4}
+    for _ in range(20):
+        assert check_interval(stable_fast) > check_interval(flaky_fast)
+        assert cfg.min_interval * (1 - cfg.jitter) <= check_interval(flaky_fast) <= cfg.max_interval * (1 + cfg.jitter)
+        assert check_interval(dying_slow) < check_interval(dict(dying_slow, health_score=100))
+
+def test_streams_only_due_proxies_in_pages():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            now = int(time.time())
+            for i in range(7):
+                await storage.save_proxy({
+                    "ip": f"10.0.0.{i}", "port": 8080, "protocol": "http", "anonymity": "elite",
+                    "country": "ID", "response_time_ms": 100, "health_score": 100,
+                    # Five overdue, two not due for an hour
+                    "next_check_at": now - 100 + i if i < 5 else now + 3600,
+                })
+
+            checked = []
+            async def check(proxy):
+                checked.append(proxy["ip"])
+                await asyncio.sleep(0.01)
+                await storage.record_outcome(proxy, False)
+
+            scheduler = ReverifyScheduler(storage, check, workers=3, page_size=2)
+            assert await scheduler.run_once(due_only=True) == 5
+            assert sorted(checked) == [f"10.0.0.{i}" for i in range(5)]
+            assert scheduler.stats["max_lag_s"] >= 100
+
+            # Everything was rescheduled into the future
+            assert [p async for p in storage.iter_proxies(due_before=now, page_size=2)] == []
+            assert len([p async for p in storage.iter_proxies(page_size=3)]) == 7
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_failing_checks_back_off_instead_of_looping():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            now = int(time.time())
+            for i in range(2):
+                await storage.save_proxy({
+                    "ip": f"10.0.0.{i}", "port": 8080, "protocol": "http", "anonymity": "elite",
+                    "country": "ID", "response_time_ms": 100, "health_score": 100, "next_check_at": now - 10,
+                })
+
+            async def check(proxy):
+                if proxy["ip"] == "10.0.0.0":
+                    raise RuntimeError("verifier crashed")
+                await storage.record_outcome(proxy, True)
+
+            scheduler = ReverifyScheduler(storage, check, workers=2)
+            assert await scheduler.run_once(due_only=True) == 2
+            assert scheduler.stats["errors"] == 1 and scheduler.stats["checked"] == 1
+
+            # The crashing row is not due again, and later than a normal interval
+            cfg = settings.scheduler
+            assert [p async for p in storage.iter_proxies(due_before=now + cfg.min_interval)] == []
+            first = (await storage.get_proxy("10.0.0.0", 8080))["next_check_at"]
+            assert first >= now + cfg.min_interval * (1 - cfg.jitter) + cfg.min_interval
+
+            # Another failure doubles the backoff; rows that pass carry no error count
+            await scheduler._postpone(await storage.get_proxy("10.0.0.0", 8080))
+            assert scheduler._errors[("10.0.0.0", 8080)] == 2
+            assert ("10.0.0.1", 8080) not in scheduler._errors
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_interval_follows_health_tier_and_volatility()
+    test_streams_only_due_proxies_in_pages()
+    test_failing_checks_back_off_instead_of_looping()
+    print(">>> TEST SUCCESS: Re-verification scheduler verified.")
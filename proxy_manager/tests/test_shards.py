@@ -0,0 +1,61 @@
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.config import settings
+from proxy_manager.core.shards import ShardCoordinator, assign_partitions, partition_of
+from proxy_manager.core.storage import StorageManager
+
+def test_rendezvous_moves_only_the_dead_workers_partitions():
+    three = assign_partitions(["a", "b", "c"], 64)
+    assert sorted(p for owned in three.values() for p in owned) == list(range(64))
+    assert all(8 <= len(owned) <= 40 for owned in three.values())
+
+    two = assign_partitions(["a", "c"], 64)
+    assert three["a"] <= two["a"] and three["c"] <= two["c"]
+    assert two["a"] | two["c"] == set(range(64))
+
+def test_workers_split_the_table_and_take_over_from_a_dead_one():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for i in range(50):
+                await storage.save_proxy({"ip": f"10.0.0.{i}", "port": 8080 + i % 3, "protocol": "http",
+                                          "anonymity": "elite", "country": "ID", "response_time_ms": 100})
+            now = int(time.time())
+            a = ShardCoordinator(storage, worker_id="a", partitions=16)
+            b = ShardCoordinator(storage, worker_id="b", partitions=16)
+            await a.heartbeat({"checked": 0}, now=now)
+            await b.heartbeat({"checked": 0}, now=now)
+            await a.heartbeat({"checked": 30}, now=now + 5)
+            assert a.owned.isdisjoint(b.owned) and len(a.owned | b.owned) == 16
+            assert a.is_leader and not b.is_leader
+
+            seen_a = [(p["ip"], p["port"]) async for p in storage.iter_proxies(page_size=7, shard=a.filter())]
+            seen_b = [(p["ip"], p["port"]) async for p in storage.iter_proxies(page_size=7, shard=b.filter())]
+            assert len(seen_a) + len(seen_b) == 50 and not set(seen_a) & set(seen_b)
+            assert all(partition_of(ip, port, 16) in a.owned for ip, port in seen_a)
+
+            workers = {w["worker_id"]: w for w in await storage.get_workers()}
+            assert workers["a"]["checked"] == 30 and workers["a"]["rate"] == 6.0
+
+            # b stops heartbeating: once its lease expires a picks up everything
+            assert await a.heartbeat({"checked": 30}, now=now + settings.sharding.lease_ttl + 1)
+            assert a.owned == frozenset(range(16))
+            assert len([p async for p in storage.iter_proxies(page_size=7, shard=a.filter())]) == 50
+
+            await a.release()
+            assert [w["worker_id"] for w in await storage.get_workers()] == ["b"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_rendezvous_moves_only_the_dead_workers_partitions()
+    test_workers_split_the_table_and_take_over_from_a_dead_one()
+    print(">>> TEST SUCCESS: Sharded monitor workers verified.")
@@ -0,0 +1,209 @@
+import asyncio
+import sys
+import os
+import tempfile
+import time
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.config import SiteTarget
+from proxy_manager.core.gateway import ProxyGateway
+from proxy_manager.core.sites import SiteCompatChecker
+from proxy_manager.core.storage import StorageManager
+
+SHOP = SiteTarget(name="shop", url="https://www.shop.test/")
+NEWS = SiteTarget(name="news", url="https://news.test/")
+
+def make_proxy(i: int, **overrides):
+    proxy = {"ip": f"10.0.0.{i}", "port": 8080, "protocol": "http", "anonymity": "elite",
+             "country": "ID", "response_time_ms": 100, "health_score": 100}
+    proxy.update(overrides)
+    return proxy
+
+def fake_prober(blocked, latency=None):
+    """Stands in for SiteCompatChecker.probe: every proxy passes except `blocked` IPs."""
+    probed = []
+
+    async def probe(proxy, site):
+        probed.append(proxy["ip"])
+        ok = proxy["ip"] not in blocked
+        return {"ip": proxy["ip"], "port": proxy["port"], "site": site.name, "ok": int(ok),
+                "status_code": 200 if ok else 403, "latency_ms": (latency or {}).get(proxy["ip"], 100)}
+    return probe, probed
+
+async def settle(checker):
+    """Waits for good_pool's background probes."""
+    while checker._in_flight:
+        await asyncio.sleep(0.01)
+
+def test_site_for_host_matches_subdomains_only():
+    checker = SiteCompatChecker(storage=StorageManager(":memory:"), targets=[SHOP, NEWS])
+    assert checker.site_for_host("shop.test") is SHOP
+    assert checker.site_for_host("m.shop.test") is SHOP
+    assert checker.site_for_host("WWW.Shop.Test.") is SHOP
+    assert checker.site_for_host("api.news.test") is NEWS
+    assert checker.site_for_host("notshop.test") is None
+    assert checker.site_for_host("shop.test.evil") is None
+    assert checker.site_for_host(None) is None
+
+def test_verdicts_expire_after_ttl():
+    checker = SiteCompatChecker(storage=StorageManager(":memory:"), targets=[SHOP])
+    checker.ttl = 60
+    now = time.time()
+    checker._verdicts["shop"] = {("10.0.0.1", 8080): (True, 50, now - 30), ("10.0.0.2", 8080): (True, 50, now - 90)}
+    assert checker._fresh(SHOP, make_proxy(1)) == (True, 50, now - 30)
+    assert checker._fresh(SHOP, make_proxy(2)) is None
+    assert checker._fresh(SHOP, make_proxy(3)) is None
+    assert checker._fresh(NEWS, make_proxy(1)) is None
+
+def test_good_pool_probes_unknown_proxies_in_the_background():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            checker = SiteCompatChecker(storage, targets=[SHOP])
+            checker.probe, probed = fake_prober({"10.0.0.3"}, latency={"10.0.0.1": 300, "10.0.0.2": 80})
+            proxies = [make_proxy(i) for i in range(1, 4)]
+
+            # Nothing known yet: the caller gets nothing and is not kept waiting on the probes
+            assert await checker.good_pool(proxies, SHOP) == []
+            assert probed == []
+            # Asking again while they run does not probe the same proxies twice
+            assert await checker.good_pool(proxies, SHOP) == []
+            await settle(checker)
+            assert sorted(probed) == ["10.0.0.1", "10.0.0.2", "10.0.0.3"]
+
+            # Passing proxies come back fastest first, the blocked one is left out
+            assert [p["ip"] for p in await checker.good_pool(proxies, SHOP)] == ["10.0.0.2", "10.0.0.1"]
+            assert await checker.good_pool(proxies + [make_proxy(4)], SHOP) != []
+            await settle(checker)
+            assert probed.count("10.0.0.4") == 1 and len(probed) == 4
+
+            # A new checker on the same storage starts from the persisted verdicts
+            fresh = SiteCompatChecker(storage, targets=[SHOP])
+            fresh.probe, reprobed = fake_prober(set())
+            assert [p["ip"] for p in await fresh.good_pool(proxies, SHOP)] == ["10.0.0.2", "10.0.0.1"]
+            await settle(fresh)
+            assert reprobed == []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_background_probes_are_kept_and_cancelled_on_close():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            checker = SiteCompatChecker(storage, targets=[SHOP])
+            started = asyncio.Event()
+
+            async def hanging_probe(proxy, site):
+                started.set()
+                await asyncio.Event().wait()
+            checker.probe = hanging_probe
+
+            assert await checker.good_pool([make_proxy(1)], SHOP) == []
+            await started.wait()
+            assert len(checker._tasks) == 1 and checker._in_flight == {("10.0.0.1", 8080, "shop")}
+
+            # Shutting down cancels the probe, and its proxy is not left marked in flight
+            await checker.close()
+            assert not checker._tasks and not checker._in_flight
+            checker.probe, probed = fake_prober(set())
+            await checker.good_pool([make_proxy(1)], SHOP)
+            await asyncio.gather(*checker._tasks)
+            await asyncio.sleep(0)  # Done callbacks run on the next loop iteration
+            assert probed == ["10.0.0.1"] and not checker._tasks and not checker._in_flight
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_site_verdicts_in_storage():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for i in range(1, 5):
+                await storage.save_proxy(make_proxy(i))
+            await storage.save_proxy(make_proxy(5, state="quarantined"))
+            await storage.flush()
+            await storage.save_site_verdicts([
+                {"ip": f"10.0.0.{i}", "port": 8080, "site": "shop", "ok": int(i != 3),
+                 "status_code": 200 if i != 3 else 403, "latency_ms": 500 - 100 * i}
+                for i in range(1, 6)
+            ] + [{"ip": "10.0.0.3", "port": 8080, "site": "news", "ok": 1, "status_code": 200, "latency_ms": 10}])
+            # Re-checking replaces the previous verdict for the same (proxy, site)
+            await storage.save_site_verdicts([{"ip": "10.0.0.1", "port": 8080, "site": "shop", "ok": 1,
+                                               "status_code": 200, "latency_ms": 50}])
+            async with storage._write() as db:
+                await db.execute("UPDATE site_verdicts SET checked_at = datetime('now', '-2 hours') "
+                                 "WHERE ip = '10.0.0.4' AND site = 'shop'")
+                await db.commit()
+
+            rows = await storage.get_site_verdicts("shop", 3600)
+            assert sorted((r["ip"], r["ok"], r["latency_ms"]) for r in rows) == [
+                ("10.0.0.1", 1, 50), ("10.0.0.2", 1, 300), ("10.0.0.3", 0, 200), ("10.0.0.5", 1, 0)]
+            assert len(await storage.get_site_verdicts("shop", 3 * 3600)) == 5
+
+            # Fresh passing verdicts of active proxies only, fastest first
+            good = await storage.get_proxies_for_site("shop", 3600)
+            assert [(p["ip"], p["site_latency_ms"]) for p in good] == [("10.0.0.1", 50), ("10.0.0.2", 300)]
+            assert [p["ip"] for p in await storage.get_proxies_for_site("shop", 3600, limit=1)] == ["10.0.0.1"]
+            assert [p["ip"] for p in await storage.get_proxies_for_site("news", 3600)] == ["10.0.0.3"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_gateway_rotates_over_the_proxies_good_for_a_site():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            gateway = ProxyGateway(port=1, storage=storage)
+            gateway.sites.targets = [SHOP]
+            gateway.sites.probe, probed = fake_prober({"10.0.0.3"})
+            gateway.set_pool([make_proxy(i) for i in range(1, 5)])
+
+            # No verdicts yet: any pool member while the site checks run
+            proxy = await gateway.get_best_proxy("m.shop.test")
+            assert proxy in gateway.pool
+            gateway.pool.release(proxy)
+            await settle(gateway.sites)
+
+            async def picks(host, n):
+                seen = set()
+                for _ in range(n):
+                    proxy = await gateway.get_best_proxy(host)
+                    seen.add(proxy["ip"])
+                    gateway.pool.release(proxy)
+                return seen
+
+            # The view is rebuilt every site_refresh seconds, not on each request
+            filtered = 0
+            good_pool = gateway.sites.good_pool
+
+            async def counting_good_pool(proxies, site):
+                nonlocal filtered
+                filtered += 1
+                return await good_pool(proxies, site)
+            gateway.sites.good_pool = counting_good_pool
+            gateway._site_synced.clear()
+            assert await picks("shop.test", 30) == {"10.0.0.1", "10.0.0.2", "10.0.0.4"}
+            assert filtered == 1
+            assert gateway.pool.metrics()["inflight"] == 0
+
+            # Requests for other hosts still use the whole pool
+            assert await picks("other.test", 60) == {f"10.0.0.{i}" for i in range(1, 5)}
+
+            # An evicted member leaves the site view at once
+            gateway.pool.rescore(make_proxy(4), 0)
+            assert await picks("shop.test", 30) == {"10.0.0.1", "10.0.0.2"}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_site_for_host_matches_subdomains_only()
+    test_verdicts_expire_after_ttl()
+    test_good_pool_probes_unknown_proxies_in_the_background()
+    test_background_probes_are_kept_and_cancelled_on_close()
+    test_site_verdicts_in_storage()
+    test_gateway_rotates_over_the_proxies_good_for_a_site()
+    print(">>> TEST SUCCESS: Site compatibility verified.")
@@ -0,0 +1,225 @@
+import asyncio
+import sys
+import os
+import sqlite3
+import tempfile
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.storage import StorageManager, SCHEMA_VERSION, OUTCOME_OK, OUTCOME_TIMEOUT
+
+def make_proxy(i: int, **overrides):
+    proxy = {
+        "ip": f"10.0.{i // 256}.{i % 256}",
+        "port": 8080,
+        "protocol": "http",
+        "anonymity": "elite",
+        "country": "ID",
+        "response_time_ms": 100 + i,
+        "health_score": 100,
+    }
+    proxy.update(overrides)
+    return proxy
+
+def test_shared_connections_in_wal_mode():
+    async def run(db_path):
+        async with StorageManager(db_path, readers=2) as storage:
+            await storage.init_db()
+            async with storage._read() as db:
+                async with db.execute("PRAGMA journal_mode") as cursor:
+                    assert (await cursor.fetchone())[0] == "wal"
+
+            # Concurrent writers and readers share the pooled connections
+            await asyncio.gather(
+                *[storage.save_proxy(make_proxy(i)) for i in range(50)],
+                *[storage.get_proxies(limit=5) for _ in range(10)],
+            )
+            proxies = await storage.get_proxies(limit=100)
+            assert len(proxies) == 50
+            assert proxies[0]["response_time_ms"] == 100
+
+            fastest = proxies[0]
+            for _ in range(5):
+                await storage.record_outcome(fastest, False)
+            # The other 49 have a single sample: too little evidence to evict
+            assert await storage.delete_unhealthy(40, min_samples=3) == 1
+        assert storage._writer is None
+
+        # A closed manager reopens lazily
+        assert len(await storage.get_proxies(limit=100)) == 49
+        await storage.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_write_behind_coalesces_updates():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            await storage.save_proxy(make_proxy(1))
+            proxy = await storage.get_proxy("10.0.0.1", 8080)
+            for working in (True, True, True, True, True, False):
+                await storage.record_outcome(proxy, working, 200 if working else None)
+            await storage.update_subnet_intel("10.0.0.1", "Lab", 3)
+            await storage.update_subnet_intel("10.0.0.9", "Lab", 2)
+            # Outcomes for one proxy collapse into one UPDATE, plus one subnet upsert
+            assert len(storage.writes) == 2
+
+            proxies = await storage.get_proxies(limit=10)
+            assert len(storage.writes) == 0
+            assert proxies[0]["health_score"] == proxy["health_score"]
+            assert round(proxies[0]["health_samples"]) == 7
+            assert proxies[0]["success_count"] == 6
+            assert proxies[0]["fail_count"] == 1
+            assert storage.writes.metrics()["flushes"] == 2
+
+            async with storage._read() as db:
+                async with db.execute("SELECT total_found, yield_score FROM subnet_intel") as cursor:
+                    assert tuple(await cursor.fetchone()) == (5, 2.0)
+
+            # Left pending on purpose: close() must flush it
+            await storage.record_outcome(proxy, False)
+
+        async with StorageManager(db_path) as storage:
+            proxies = await storage.get_proxies(limit=10)
+            assert proxies[0]["health_score"] == proxy["health_score"]
+            assert proxies[0]["fail_count"] == 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_init_db_migrates_legacy_schema():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            async with storage._read() as db:
+                async with db.execute("PRAGMA user_version") as cursor:
+                    assert (await cursor.fetchone())[0] == SCHEMA_VERSION
+                async with db.execute("SELECT ip, ip_int FROM proxies ORDER BY ip") as cursor:
+                    assert [tuple(r) for r in await cursor.fetchall()] == [("182.253.10.7", 3070036487), ("8.8.8.8", 134744072)]
+                async with db.execute("EXPLAIN QUERY PLAN SELECT * FROM proxies WHERE health_score > 0 ORDER BY response_time_ms LIMIT 10") as cursor:
+                    assert "idx_proxies_live_speed" in " ".join(str(r[-1]) for r in await cursor.fetchall())
+
+            await storage.save_proxy(make_proxy(3, ip="182.253.200.1"))
+            in_range = await storage.get_proxies_in_range("182.253.0.0/16")
+            assert [p["ip"] for p in in_range] == ["182.253.10.7", "182.253.200.1"]
+
+            # Re-running is a no-op
+            await storage.init_db()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "proxies.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE proxies (ip TEXT, port INTEGER, protocol TEXT, anonymity TEXT, country TEXT, "
+                     "response_time_ms INTEGER, last_checked TIMESTAMP, health_score INTEGER DEFAULT 100, PRIMARY KEY (ip, port))")
+        conn.execute("INSERT INTO proxies (ip, port, protocol, health_score) VALUES ('8.8.8.8', 80, 'http', 100), ('182.253.10.7', 3128, 'http', 90)")
+        conn.commit()
+        conn.close()
+        asyncio.run(run(db_path))
+
+def test_health_writers_in_two_processes_build_on_each_other():
+    async def run(db_path):
+        async with StorageManager(db_path) as monitor, StorageManager(db_path) as gateway:
+            await monitor.init_db()
+            await monitor.save_proxy(make_proxy(1))
+            await monitor.flush()
+            # Both read the row, then each records outcomes on its own copy
+            mine, theirs = await monitor.get_proxy("10.0.0.1", 8080), await gateway.get_proxy("10.0.0.1", 8080)
+            for _ in range(3):
+                await monitor.record_outcome(mine, True, 150)
+            await monitor.flush()
+            for working in (True, False):
+                await gateway.record_outcome(theirs, working, 300 if working else None)
+            await gateway.flush()
+
+            # The later flush replays its two outcomes onto the stored row instead of overwriting it
+            stored = await monitor.get_proxy("10.0.0.1", 8080)
+            assert round(stored["health_samples"]) == 6 and round(theirs["health_samples"]) == 3
+            assert stored["success_count"] == 5 and stored["fail_count"] == 1
+            assert stored["consecutive_fails"] == 1 and stored["last_ok"] == 0
+
+            # Nor does it undo a quarantine decided elsewhere
+            async with monitor._write() as db:
+                await db.execute("UPDATE proxies SET state = 'quarantine', quarantined_at = 1")
+                await db.commit()
+            await gateway.record_outcome(theirs, True, 100)
+            await gateway.flush()
+            stored = await monitor.get_proxy("10.0.0.1", 8080)
+            assert stored["state"] == "quarantine" and stored["quarantined_at"] == 1
+            assert round(stored["health_samples"]) == 7
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_check_history_rollups_and_retention():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            await storage.save_proxy(make_proxy(1, isp="biznet"))
+            day = 1_700_006_400  # A UTC midnight
+            # Two days of hourly checks: the proxy is down between 00:00 and 05:59
+            for hour in range(48):
+                outcome = OUTCOME_TIMEOUT if hour % 24 < 6 else OUTCOME_OK
+                await storage.record_check("10.0.0.1", 8080, outcome, 120 if outcome == OUTCOME_OK else None,
+                                           ts=day + hour * 3600 + 60)
+            now = day + 48 * 3600 + 600
+
+            rolled = await storage.rollup_history(now)
+            assert rolled == {"hourly": 48, "daily": 2}
+            # Incremental: nothing new to fold in
+            assert await storage.rollup_history(now) == {"hourly": 0, "daily": 0}
+
+            await storage.record_check("10.0.0.1", 8080, OUTCOME_OK, 80, ts=now)
+            stability = await storage.get_proxy_stability("10.0.0.1", 8080, window=24 * 3600, now=now)
+            assert stability == {"checks": 25, "ok": 19, "uptime": 0.76, "avg_latency_ms": 118}
+
+            daily = await storage.get_isp_availability("biznet", window=7 * 86400, period=86400, now=now)
+            assert [(r["checks"], r["ok"]) for r in daily] == [(24, 18), (24, 18)]
+            assert await storage.get_isp_availability("cbn", now=now) == []
+            profile = await storage.get_hour_of_day_profile("biznet", now=now)
+            assert profile[3] == 0.0 and profile[12] == 1.0
+
+            # Raw rows older than history_raw_hours are dropped once rolled up
+            pruned = await storage.prune_history(now + 3 * 86400)
+            assert pruned == {"raw": 48, "hourly": 0, "daily": 0}
+            stability = await storage.get_proxy_stability("10.0.0.1", 8080, window=5 * 86400, now=now)
+            assert stability["checks"] == 49
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+def test_quarantine_archive_and_rediscovery():
+    async def run(db_path):
+        async with StorageManager(db_path) as storage:
+            await storage.init_db()
+            for i in range(3):
+                await storage.save_proxy(make_proxy(i))
+            dead = await storage.get_proxy("10.0.0.1", 8080)
+            for _ in range(5):
+                await storage.record_outcome(dead, False)
+            assert dead["state"] == "quarantine"
+            assert sorted(p["ip"] for p in await storage.get_healthiest(limit=10)) == ["10.0.0.0", "10.0.0.2"]
+
+            # Not old enough yet, then archived
+            assert await storage.archive_quarantined(max_age=3600) == 0
+            assert await storage.archive_quarantined(max_age=-1) == 1
+            assert await storage.get_proxy("10.0.0.1", 8080) is None
+            assert [(p["ip"], p["fail_count"]) for p in await storage.get_archived()] == [("10.0.0.1", 5)]
+
+            # Found again by a scan: back in proxies, out of the archive
+            await storage.save_proxy(make_proxy(1))
+            assert (await storage.get_proxy("10.0.0.1", 8080))["state"] == "active"
+            assert await storage.get_archived() == []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "proxies.db")))
+
+if __name__ == "__main__":
+    test_shared_connections_in_wal_mode()
+    test_write_behind_coalesces_updates()
+    test_health_writers_in_two_processes_build_on_each_other()
+    test_init_db_migrates_legacy_schema()
+    test_check_history_rollups_and_retention()
+    test_quarantine_archive_and_rediscovery()
+    print(">>> TEST SUCCESS: Storage connection pool verified.")
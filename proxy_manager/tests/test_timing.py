@@ -0,0 +1,79 @@
+import asyncio
+import sys
+import os
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.timing import classify_failure, new_record, HistogramTimingSink
+from proxy_manager.core.validator import ProxyValidator
+
+class CurlLikeError(Exception):
+    def __init__(self, msg, code):
+        super().__init__(msg)
+        self.code = code
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.infos = {}
+
+    def json(self):
+        import json
+        return json.loads(self.body)
+
+class FakeSession:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    async def get(self, url, **kwargs):
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+def test_classify_failure():
+    assert classify_failure(ConnectionRefusedError()) == ("refused", "tcp_connect")
+    assert classify_failure(asyncio.TimeoutError()) == ("timeout", "first_byte")
+    assert classify_failure(CurlLikeError("Connection timed out after 3001 milliseconds", 28)) == ("timeout", "tcp_connect")
+    assert classify_failure(CurlLikeError("SSL connection timeout", 28)) == ("timeout", "tls_handshake")
+    assert classify_failure(CurlLikeError("Can't complete SOCKS5 connection", 97)) == ("proxy_error", "proxy_handshake")
+    assert classify_failure(CurlLikeError("Recv failure: Connection reset by peer", 56)) == ("reset", "first_byte")
+    assert classify_failure(CurlLikeError("Empty reply from server", 52)) == ("empty_reply", "first_byte")
+
+def test_histogram_sink():
+    sink = HistogramTimingSink()
+    for total in (10, 20, 40, 800):
+        rec = new_record("1.2.3.4", 8080, "http", "connect_http", "http://httpbin.org/get")
+        rec["total_ms"] = total
+        sink.emit(rec)
+    failed = new_record("1.2.3.4", 8080, "http", "connect_http", "http://httpbin.org/get")
+    failed.update(outcome="timeout", failure_phase="tcp_connect", total_ms=3000)
+    sink.emit(failed)
+
+    summary = sink.summary()
+    assert summary["attempts"] == 5
+    assert summary["failures"] == {"timeout@tcp_connect": 1}
+    assert summary["phases"]["total_ms"][50] == 63
+    assert summary["phases"]["tcp_connect_ms"][50] is None
+
+def test_attempt_outcomes():
+    sink = HistogramTimingSink()
+    validator = ProxyValidator(timing_sink=sink)
+
+    async def run(outcome, **kwargs):
+        rec = new_record("1.2.3.4", 8080, "http", "connect_http", "http://httpbin.org/get")
+        result = await validator._attempt(FakeSession(outcome), rec, "http://httpbin.org/get", [200], **kwargs)
+        return rec["outcome"], result[0] is not None
+
+    assert asyncio.run(run(FakeResponse(200, '{"url": "http://httpbin.org/get"}'), expect_json=True)) == ("ok", True)
+    assert asyncio.run(run(FakeResponse(200, "<html>router login</html>"), expect_json=True)) == ("non_json", False)
+    assert asyncio.run(run(FakeResponse(403, ""))) == ("bad_status", False)
+    assert asyncio.run(run(ConnectionResetError())) == ("reset", False)
+    assert sink.attempts == 4
+
+if __name__ == "__main__":
+    test_classify_failure()
+    test_histogram_sink()
+    test_attempt_outcomes()
+    print(">>> TEST SUCCESS: Timing instrumentation verified.")
@@ -0,0 +1,52 @@
+import asyncio
+import sys
+import os
+
+# Add project root to path to import proxy_manager modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+from proxy_manager.core.verifier import LightweightVerifier
+
+async def fake_socks5(reader, writer):
+    assert await reader.readexactly(3) == b"\x05\x01\x00"
+    writer.write(b"\x05\x00")
+    head = await reader.readexactly(5)
+    await reader.readexactly(head[4] + 2)  # hostname + port
+    writer.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+    await writer.drain()
+    writer.close()
+
+async def fake_http(reader, writer):
+    request = await reader.readuntil(b"\r\n\r\n")
+    if request.startswith(b"CONNECT allowed.test:443 "):
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+    else:
+        writer.write(b"HTTP/1.1 403 Forbidden\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+def test_protocol_handshakes():
+    async def run():
+        socks = await asyncio.start_server(fake_socks5, "127.0.0.1", 0)
+        http = await asyncio.start_server(fake_http, "127.0.0.1", 0)
+        socks_port = socks.sockets[0].getsockname()[1]
+        http_port = http.sockets[0].getsockname()[1]
+        verifier = LightweightVerifier(timeout=2)
+        try:
+            ok, latency, reason = await verifier.handshake("127.0.0.1", socks_port, "socks5", "allowed.test")
+            assert ok and latency is not None and reason == ""
+
+            assert (await verifier.handshake("127.0.0.1", http_port, "http", "allowed.test"))[0]
+            assert await verifier.handshake("127.0.0.1", http_port, "http", "blocked.test") == (False, None, "http_connect_403")
+            # Wrong protocol: the HTTP proxy never answers a SOCKS greeting
+            ok, _, reason = await verifier.handshake("127.0.0.1", http_port, "socks5", "allowed.test")
+            assert not ok and reason in ("timeout", "closed")
+        finally:
+            socks.close()
+            http.close()
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    test_protocol_handshakes()
+    print(">>> TEST SUCCESS: Handshake tier verified.")
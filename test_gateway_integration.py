@@ -19,11 +19,8 @@ async def test_gateway():
     gateway = ProxyGateway(port=8899) # Use different port to avoid conflicts
     
     # We need to run gateway.start() but it blocks.
-    # So we wrap it or use app runner directly.
-    runner = aiohttp.web.AppRunner(gateway.app)
-    await runner.setup()
-    site = aiohttp.web.TCPSite(runner, '127.0.0.1', 8899)
-    await site.start()
+    # So we serve its connection handler directly.
+    server = await asyncio.start_server(gateway.handle_client, '127.0.0.1', 8899)
     
     print(">>> Gateway started on 127.0.0.1:8899")
     
@@ -61,7 +58,8 @@ async def test_gateway():
         await asyncio.sleep(2)
         
     # Cleanup
-    await runner.cleanup()
+    server.close()
+    await server.wait_closed()
 
 if __name__ == "__main__":
     if sys.platform == 'win32':
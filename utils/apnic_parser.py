@@ -1,45 +1,256 @@
-import requests
+import argparse
+import ipaddress
+import mmap
 import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+import requests
+
+try:
+    import numpy as np
+except ImportError:  # Batch lookups fall back to a sorted merge in pure Python
+    np = None
 
 APNIC_URL = "https://ftp.apnic.net/stats/apnic/delegated-apnic-latest"
 OUTPUT_FILE = "id_ranges.txt"
+INDEX_FILE = os.path.join("data", "apnic_delegated.idx")
 
-def fetch_id_ranges():
-    print(f"Downloading APNIC data from {APNIC_URL}...")
-    try:
-        response = requests.get(APNIC_URL, stream=True)
+# Index layout: header, then starts[n] and ends[n] as uint32, then country codes as 2 bytes each.
+MAGIC = b"DLGX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sIqI")  # magic, format version, file serial, record count
+
+def _open_lines(source):
+    """Yields decoded lines from a local path or an HTTP(S) URL, streaming either way."""
+    if source.startswith("http://") or source.startswith("https://"):
+        response = requests.get(source, stream=True, timeout=60)
         response.raise_for_status()
-        
-        id_ranges = []
-        
-        for line in response.iter_lines():
-            if not line: continue
-            line = line.decode('utf-8')
-            
-            # Format: apnic|ID|ipv4|103.2.160.0|1024|20130527|allocated
-            if "|ID|ipv4|" in line:
-                parts = line.split("|")
-                ip = parts[3]
-                count = int(parts[4])
-                
-                # Convert count to CIDR
-                # count = 2^(32 - cidr) => log2(count) = 32 - cidr => cidr = 32 - log2(count)
-                import math
-                cidr = 32 - int(math.log2(count))
-                
-                id_ranges.append(f"{ip}/{cidr}")
-
-        print(f"Found {len(id_ranges)} Indonesian IPv4 ranges.")
-        
-        with open(OUTPUT_FILE, "w") as f:
-            f.write("\n".join(id_ranges))
-            
-        print(f"Saved ranges to {OUTPUT_FILE}")
-        return id_ranges
+        try:
+            for line in response.iter_lines():
+                yield line.decode("utf-8", "replace")
+        finally:
+            response.close()
+    else:
+        with open(source, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+def read_serial(source):
+    """
+    Returns the serial from the version line (2|apnic|<serial>|...), reading
+    only the head of the file so an unchanged remote file is not downloaded.
+    """
+    for line in _open_lines(source):
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split("|")
+        if len(parts) >= 3 and parts[0][:1].isdigit():
+            return int(parts[2])
+        break
+    return 0
+
+def parse_delegated(source):
+    """
+    Parses every ipv4 record of a delegated-stats file, any country.
+    Returns (serial, [(start, end, cc)]) sorted by start. The count field is an
+    address count, not necessarily a power of two, so ranges are kept exact.
+    """
+    serial = 0
+    records = []
+    for line in _open_lines(source):
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split("|")
+        if serial == 0 and len(parts) >= 3 and parts[0][:1].isdigit():
+            serial = int(parts[2])
+            continue
+        # Format: apnic|ID|ipv4|103.2.160.0|1024|20130527|allocated
+        if len(parts) < 7 or parts[2] != "ipv4" or parts[1] in ("*", ""):
+            continue
+        if parts[6] not in ("allocated", "assigned"):
+            continue
+        start = int(ipaddress.IPv4Address(parts[3]))
+        count = int(parts[4])
+        records.append((start, start + count - 1, parts[1].upper()[:2]))
+
+    records.sort()
+    return serial, records
+
+def write_index(path, serial, records):
+    """Writes the compact sorted interval index atomically."""
+    starts = array("I", (r[0] for r in records))
+    ends = array("I", (r[1] for r in records))
+    if sys.byteorder != "little":
+        starts.byteswap()
+        ends.byteswap()
+    codes = b"".join(r[2].encode("ascii").ljust(2, b"?") for r in records)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, serial, len(records)))
+        f.write(starts.tobytes())
+        f.write(ends.tobytes())
+        f.write(codes)
+    os.replace(tmp_path, path)
+
+class DelegatedIndex:
+    """
+    Memory-mapped view of an index written by write_index(). Nothing is
+    parsed at load time; lookups bisect directly over the mapped arrays.
+    """
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.serial, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a delegated index (format {FORMAT_VERSION})")
+        if sys.byteorder != "little":
+            raise ValueError("Memory-mapped index requires a little-endian host")
+        n = self.count
+        off = HEADER.size
+        view = memoryview(self._mm)
+        self.starts = view[off:off + 4 * n].cast("I")
+        self.ends = view[off + 4 * n:off + 8 * n].cast("I")
+        self.codes = view[off + 8 * n:off + 10 * n]
+
+    def close(self):
+        self.starts.release()
+        self.ends.release()
+        self.codes.release()
+        self._mm.close()
+        self._file.close()
+
+    def __len__(self):
+        return self.count
+
+    def _cc(self, i):
+        return bytes(self.codes[2 * i:2 * i + 2]).decode("ascii")
+
+    def country_of(self, ip):
+        """Country code for one IPv4 address, None if not delegated."""
+        value = int(ipaddress.IPv4Address(ip))
+        i = bisect_right(self.starts, value) - 1
+        if i >= 0 and value <= self.ends[i]:
+            return self._cc(i)
+        return None
+
+    def countries_of(self, ips):
+        """Country codes for many addresses at once, in input order."""
+        values = [int(ipaddress.IPv4Address(ip)) for ip in ips]
+        if np is not None and self.count:
+            starts = np.frombuffer(self._mm, dtype="<u4", count=self.count, offset=HEADER.size)
+            ends = np.frombuffer(self._mm, dtype="<u4", count=self.count, offset=HEADER.size + 4 * self.count)
+            query = np.asarray(values, dtype=np.uint32)
+            idx = np.searchsorted(starts, query, side="right") - 1
+            hit = (idx >= 0) & (query <= ends[np.clip(idx, 0, None)])
+            return [self._cc(int(i)) if h else None for i, h in zip(idx, hit)]
+
+        # Sorted merge: one pass over the queries, bisecting forward from the last hit
+        order = sorted(range(len(values)), key=values.__getitem__)
+        results = [None] * len(values)
+        lo = 0
+        for pos in order:
+            value = values[pos]
+            i = bisect_right(self.starts, value, lo) - 1
+            if i >= 0 and value <= self.ends[i]:
+                results[pos] = self._cc(i)
+            lo = max(i, 0)
+        return results
+
+    def ranges_for(self, country):
+        """Exact (start, end) ranges delegated to `country`, adjacent ones merged."""
+        country = country.upper()
+        merged = []
+        for i in range(self.count):
+            if self._cc(i) != country:
+                continue
+            start, end = self.starts[i], self.ends[i]
+            if merged and merged[-1][1] + 1 == start:
+                merged[-1][1] = end
+            else:
+                merged.append([start, end])
+        return [(s, e) for s, e in merged]
+
+    def cidrs_for(self, country):
+        """Exact CIDR expansion of a country's ranges (a 768-address block becomes /23 + /24)."""
+        cidrs = []
+        for start, end in self.ranges_for(country):
+            cidrs.extend(ipaddress.summarize_address_range(ipaddress.IPv4Address(start), ipaddress.IPv4Address(end)))
+        return [str(c) for c in cidrs]
+
+def refresh_index(source=APNIC_URL, index_path=INDEX_FILE, force=False):
+    """
+    Rebuilds the index only when the delegated file's serial differs from the
+    one stored in the current index. Returns True if a rebuild happened.
+    """
+    current = None
+    if os.path.exists(index_path) and not force:
+        try:
+            with open(index_path, "rb") as f:
+                magic, version, current, _ = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                current = None
+        except (OSError, struct.error):
+            current = None
+
+    if current is not None:
+        serial = read_serial(source)
+        if serial and serial == current:
+            print(f"Index {index_path} is up to date (serial {serial}).")
+            return False
+
+    print(f"Parsing delegated data from {source}...")
+    serial, records = parse_delegated(source)
+    write_index(index_path, serial, records)
+    print(f"Indexed {len(records)} IPv4 delegations (serial {serial}) into {index_path}")
+    return True
+
+def fetch_id_ranges(source=APNIC_URL, index_path=INDEX_FILE, country="ID", output=OUTPUT_FILE):
+    """Refreshes the index and writes the exact CIDR list for one country."""
+    try:
+        refresh_index(source, index_path)
+        index = DelegatedIndex(index_path)
+        try:
+            ranges = index.cidrs_for(country)
+        finally:
+            index.close()
+
+        print(f"Found {len(ranges)} {country} IPv4 ranges.")
+
+        with open(output, "w") as f:
+            f.write("\n".join(ranges))
+
+        print(f"Saved ranges to {output}")
+        return ranges
 
     except Exception as e:
-        print(f"Error fetching APNIC data: {e}")
+        print(f"Error fetching delegated data: {e}")
         return []
 
 if __name__ == "__main__":
-    fetch_id_ranges()
+    parser = argparse.ArgumentParser(description="Build and query a country index from an RIR delegated-stats file")
+    parser.add_argument("--source", default=APNIC_URL, help="Local path or URL of the delegated file")
+    parser.add_argument("--index", default=INDEX_FILE, help="Where to keep the binary index")
+    parser.add_argument("--country", default="ID", help="Country to export as CIDRs")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="CIDR list output file")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the serial is unchanged")
+    parser.add_argument("--lookup", nargs="*", help="Print the country of these IPs and exit")
+    args = parser.parse_args()
+
+    if args.lookup:
+        refresh_index(args.source, args.index, args.force)
+        idx = DelegatedIndex(args.index)
+        for ip, cc in zip(args.lookup, idx.countries_of(args.lookup)):
+            print(f"{ip}\t{cc or '-'}")
+        idx.close()
+    else:
+        if args.force:
+            refresh_index(args.source, args.index, force=True)
+        fetch_id_ranges(args.source, args.index, args.country, args.output)